@@ -0,0 +1,100 @@
+"""
+Micro-benchmarks of `helpers.DynamicAttrDefaultDictList` against the UserDict-based class it replaced.
+
+    python bench_helpers.py [items]
+"""
+import sys
+import timeit
+import tracemalloc
+from collections import UserDict
+
+from helpers import DynamicAttrDefaultDictList, normalize_attribute_name, add_to_mapping, discard_from_mapping
+
+
+class UserDictAttrDefaultDictList(UserDict):
+    """
+    The previous implementation: duplicates are promoted to lists in place in the UserDict's `data`.
+    """
+
+    def __init__(self, mapping: dict | list, attribute_func=None):
+        super().__init__()
+        self._attribute_func = attribute_func
+        if isinstance(mapping, dict):
+            self.update(mapping)
+        else:
+            for item in mapping:
+                add_to_mapping(self.data, attribute_func(item), item)
+
+    def __setitem__(self, key: str, value):
+        add_to_mapping(self.data, normalize_attribute_name(key), value)
+
+    def add(self, item, key: str = None):
+        key = normalize_attribute_name(key) if key is not None else self._attribute_func(item)
+        add_to_mapping(self.data, key, item)
+
+    def discard(self, item, key: str = None):
+        key = normalize_attribute_name(key) if key is not None else self._attribute_func(item)
+        discard_from_mapping(self.data, key, item)
+
+    def __getattr__(self, item):
+        if item == 'data':
+            raise AttributeError(item)
+        try:
+            return self.data[item]
+        except KeyError:
+            raise AttributeError(f'The requested attribute does not exist: {item}') from None
+
+    def __dir__(self):
+        return list(self.data.keys())
+
+
+def _key(item: str) -> str:
+    return item.split(':')[0]
+
+
+def bench(cls, items: list, repeat: int = 5) -> dict[str, float]:
+    """
+    Return the best of `repeat` timings, in seconds per call, and the memory of one instance, in bytes.
+    """
+    mapping = cls(items, _key)
+    hit, extra = _key(items[len(items) // 2]), 'extra:0'
+
+    def best(statement, number):
+        return min(timeit.repeat(statement, number=number, repeat=repeat)) / number
+
+    def add_discard():
+        mapping.add(extra)
+        mapping.discard(extra)
+
+    tracemalloc.start()
+    kept = cls(items, _key)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+
+    return {
+        'build from list': best(lambda: cls(items, _key), 3),
+        'attribute hit': best(lambda: getattr(mapping, hit), 100_000),
+        'item hit': best(lambda: mapping[hit], 100_000),
+        'attribute miss': best(lambda: hasattr(mapping, 'missing'), 100_000),
+        'dir()': best(lambda: dir(mapping), 100),
+        'add + discard': best(add_discard, 100_000),
+        'memory': memory,
+        }
+
+
+def main(n: int = 20_000):
+    # one key in ten is duplicated, so n items have 0.9 * n keys.
+    items = [f'key{i if i % 10 else i - 1}:{i}' for i in range(n)]
+    before, after = bench(UserDictAttrDefaultDictList, items), bench(DynamicAttrDefaultDictList, items)
+
+    print(f'{n} items, {len({_key(x) for x in items})} keys, best of 5')
+    for name in before:
+        if name == 'memory':
+            print(f'{name:<16} {before[name] / 2**20:8.2f} MiB -> {after[name] / 2**20:8.2f} MiB')
+        else:
+            print(f'{name:<16} {before[name] * 1e6:8.2f} us  -> {after[name] * 1e6:8.2f} us')
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,91 @@
+"""
+Connection configuration for .beedb files.
+
+A BeeDiscovery uses one SQLAlchemy engine (and its connection pool) per file; the sqlite_utils `Database` is
+given a connection checked out from the same pool, so both see the same pragmas.
+Pragmas are applied to every new connection by a `connect` event, according to a named profile.
+"""
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlite_utils import Database
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#: Pragma settings per profile. `cache_size` is negative, i.e. in KiB.
+PROFILES = {
+    # notebooks and Panel servers: WAL lets readers carry on while something else writes.
+    'interactive': dict(
+        journal_mode='WAL',
+        synchronous='NORMAL',
+        mmap_size=256 * 2**20,
+        cache_size=-64 * 2**10,
+        temp_store='MEMORY',
+        busy_timeout=5_000,
+    ),
+    # large ingests: durability is traded for speed, and writers wait longer for locks.
+    'bulk_load': dict(
+        journal_mode='WAL',
+        synchronous='OFF',
+        mmap_size=1 * 2**30,
+        cache_size=-512 * 2**10,
+        temp_store='MEMORY',
+        busy_timeout=60_000,
+    ),
+    # reviewers browsing a shared case file: no writes, big read caches.
+    'read_only_review': dict(
+        query_only='ON',
+        mmap_size=1 * 2**30,
+        cache_size=-128 * 2**10,
+        temp_store='MEMORY',
+        busy_timeout=10_000,
+    ),
+}
+
+
+def apply_pragmas(dbapi_connection, pragmas: dict):
+    """
+    Apply `pragmas` to a sqlite3 connection.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def create_beed_engine(url: str, profile: str = 'interactive', **engine_kwargs) -> Engine:
+    """
+    Return an engine for a sqlite URL whose connections are configured with the pragmas of `profile`
+    (one of `PROFILES`).
+
+    The engine uses a QueuePool with `check_same_thread=False`, so connections can be shared between
+    the notebook and Panel's server threads.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown connection profile {profile!r}, expected one of {list(PROFILES)}")
+    pragmas = PROFILES[profile]
+
+    connect_args = engine_kwargs.pop('connect_args', dict())
+    connect_args.setdefault('check_same_thread', False)
+    engine = create_engine(url, connect_args=connect_args, poolclass=QueuePool, **engine_kwargs)
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+    engine.beed_profile = profile
+    return engine
+
+
+def sqlite_utils_database(engine: Engine) -> tuple[Database, object]:
+    """
+    Return a sqlite_utils Database on a connection checked out from `engine`'s pool, along with the pooled connection.
+    Keep a reference to the pooled connection for as long as the Database is used, otherwise it goes back to the pool.
+    """
+    pooled = engine.raw_connection()
+    return Database(pooled.dbapi_connection), pooled
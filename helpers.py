@@ -1,38 +1,30 @@
 from collections import UserDict, UserList
+from collections.abc import MutableMapping
 from typing import Callable
+import sqlite3
 
 import logging
 
 logger = logging.getLogger(__name__)
 logger.setLevel('DEBUG')
 
-class DynamicAttrDefaultDictList(UserDict):
+_MISSING = object()
+
+
+class DynamicAttrDefaultDictList(MutableMapping):
     """
     A Test Object which was a proof of concept for dynamic auto-completion of datset roles.
     
     Inspired by: 
     https://intellij-support.jetbrains.com/hc/en-us/community/posts/115000665110-auto-completion-for-dynamic-module-attributes-in-python
     
-    
+    Keys are exposed as attributes. A key with one item maps to that item; a key with several items maps to
+    a list of them. The lists made for duplicate keys are tracked in a side table, so they can be told apart
+    from list values and shrunk back to a single item when items are discarded.
     """
-    
-    
-    def __setitem__(self, key:str, value):
-        
-        key = key.replace('-', '_').replace(' ','')
-        
-        if key in self.data:
-            if not isinstance(self.data[key], list):
-                convert_to_list = list()
-                convert_to_list.append(self.data[key])
-                self.data[key] = convert_to_list
-            self.data[key].append(value)
-        else:
-            super().__setitem__(key, value)
-    
 
-    
-    
+    __slots__ = ('_items', '_duplicates', '_attribute_func')
+
     def __init__(self, mapping: dict | list, attribute_func=None):
         """
         Provide an existing mapping, or, if a list is provided, 
@@ -46,7 +38,11 @@ class DynamicAttrDefaultDictList(UserDict):
 
 
         """       
-        super().__init__()
+        #: key -> the item, or the list of items for a duplicated key.
+        self._items = dict()
+        #: key -> the list in `_items`, for keys which have been duplicated.
+        self._duplicates = dict()
+        self._attribute_func = attribute_func
         
         if isinstance(mapping, dict):
             self.update(mapping)
@@ -59,48 +55,155 @@ class DynamicAttrDefaultDictList(UserDict):
         
         else:
             raise ValueError(f'Unknown instantiating mapper: {mapping}')
-        
 
+    def _generate_mapping_from_list(self, list_items: list, attribute_func: Callable):
         
+        items = self._items
+        for item in list_items:
+            key = attribute_func(item)
+            if key in items:
+                self._add(key, item)
+            else:
+                items[key] = item
+
+    def _add(self, key: str, item):
+        if key not in self._items:
+            self._items[key] = item
+        elif key in self._duplicates:
+            self._duplicates[key].append(item)
+        else:
+            self._items[key] = self._duplicates[key] = [self._items[key], item]
+
+    def add(self, item, key: str = None):
+        """
+        Add a single item, under `key` or else under the name given by the attribute function.
+        Used to keep the mapping up to date incrementally rather than rebuilding it.
+        """
+        key = normalize_attribute_name(key) if key is not None else self._attribute_func(item)
+        self._add(key, item)
+
+    def discard(self, item, key: str = None):
+        """
+        Remove a single item from under `key` (or the name given by the attribute function), if it is there.
+        """
+        key = normalize_attribute_name(key) if key is not None else self._attribute_func(item)
+        if key not in self._items:
+            return
+
+        duplicates = self._duplicates.get(key)
+        if duplicates is None:
+            if self._items[key] is item:
+                del self._items[key]
+            return
+
+        for i, x in enumerate(duplicates):
+            if x is item:
+                del duplicates[i]
+                break
+        if len(duplicates) == 1:
+            self._items[key] = duplicates[0]
+            del self._duplicates[key]
+
+    # mapping interface
+
+    def __getitem__(self, key: str):
+        return self._items[key]
+
+    def __setitem__(self, key: str, value):
+        self._add(normalize_attribute_name(key), value)
+
+    def __delitem__(self, key: str):
+        del self._items[key]
+        self._duplicates.pop(key, None)
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def data(self) -> dict:
+        """
+        A plain dict of the contents, as the previous UserDict-based implementation exposed.
+        """
+        return dict(self._items)
+
+    def copy(self):
+        # the lists of duplicated keys are copied, rather than shared with the copy (or nested in a list by it).
+        copied = DynamicAttrDefaultDictList(dict(), self._attribute_func)
+        copied._items = dict(self._items)
+        for key, duplicates in self._duplicates.items():
+            copied._items[key] = copied._duplicates[key] = list(duplicates)
+        return copied
+
     def __repr__(self):
-        return str(self.data)
+        return str(self._items)
     
     def __str__(self):
         return repr(self)
-    
-    def _generate_mapping_from_list(self, list_items: list, attribute_func: Callable):
-        
-        for item in list_items:
-            
-            attr_value = attribute_func(item)
-            
-            if attr_value not in self.data:
-                # insert solo
-                self.data[attr_value] = item
-            else:
-                # it is already in the mapping, so we have a duplicate. Convert to list.
-                if not isinstance(self.data[attr_value], list):
-                    replacement_list = list()
-                    replacement_list.append(self.data[attr_value])
-                    self.data[attr_value] = replacement_list
 
-                self.data[attr_value].append(item)
+    # attribute access
 
     def __getattr__(self, item):
-        if item in self.data:
-            return self.data[item]
-        else:
-            try:
-                super().__getattr__(item)
-            except AttributeError as e:
-                return AttributeError(f'The requested attribute does not exist: {item}, raised this error: {e}')
-    
-    
-    
+        # only called once normal lookup has failed. An unset slot (e.g. while unpickling) must not recurse back in here.
+        if item in DynamicAttrDefaultDictList.__slots__:
+            raise AttributeError(item)
+
+        value = self._items.get(item, _MISSING)
+        if value is _MISSING:
+            raise AttributeError(f'The requested attribute does not exist: {item}')
+        return value
+
     # change the result of dir(foo) to change the auto-completion box
     def __dir__(self):
-        return list(self.data.keys())
-                # + super().__dir__()
+        return list(self._items)
+
+
+def normalize_attribute_name(name: str) -> str:
+    """
+    Turn a name into something usable as an attribute: spaces are dropped and hyphens become underscores.
+    """
+    return name.replace('-', '_').replace(' ', '')
+
+
+def add_to_mapping(data: dict, key, item):
+    """
+    Add `item` to `data` under `key`. The first item is stored on its own; duplicates promote the entry to a list.
+    """
+    if key not in data:
+        data[key] = item
+    elif isinstance(data[key], list):
+        data[key].append(item)
+    else:
+        data[key] = [data[key], item]
+
+
+def discard_from_mapping(data: dict, key, item):
+    """
+    Remove `item` from under `key` in `data` (compared by identity), undoing `add_to_mapping`:
+    a list left with one item is demoted back to that item, and an empty entry is removed.
+    """
+    if key not in data:
+        return
+
+    current = data[key]
+    if not isinstance(current, list):
+        if current is item:
+            del data[key]
+        return
+
+    for i, x in enumerate(current):
+        if x is item:
+            del current[i]
+            break
+    if len(current) == 1:
+        data[key] = current[0]
+    elif not current:
+        del data[key]
 
 
 # This is inspired /copied from https://docs.sqlalchemy.org/en/20/orm/collection_api.html#custom-collection-implementations
@@ -149,3 +252,20 @@ class OptionedList(list):
     #     print(f'extend called with {other=}')
     #     super().extend(other)
 
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Quote a table or column name for use in a SQLite statement, escaping any embedded double quotes.
+
+    >>> quote_identifier('first "nick" name')
+    '"first ""nick"" name"'
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> list[str]:
+    """
+    Return the names of the columns of `table` (none if there is no such table).
+    """
+    return [x[0] for x in conn.execute("SELECT name FROM pragma_table_info(?)", (table,))]
@@ -0,0 +1,630 @@
+"""
+Streaming loaders which dump CSV, JSON Lines and Parquet files into a sqlite table.
+
+Files are read in bounded-memory batches and written with `executemany` inside large transactions, with
+the `bulk_load` connection profile (`PRAGMA synchronous=OFF`, WAL journaling) while the load runs. Column types are inferred from a prefix of the rows.
+Parquet support needs `pyarrow`, which is imported only when a Parquet file is loaded.
+
+Many files can be loaded into one table in parallel with `load_files`: worker processes parse the files and
+stream their batches through bounded queues, and a single writer connection commits them in order.
+"""
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, wait
+from queue import Empty, Full, Queue
+from typing import Callable, Iterator, Iterable
+import csv
+import io
+import json
+import multiprocessing
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+from helpers import quote_identifier
+from connections import PROFILES
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+#: a batch of rows: the column names, and the rows as tuples aligned with them.
+Batch = tuple[list[str], list[tuple]]
+
+FORMATS = {
+    '.csv': 'csv',
+    '.tsv': 'csv',
+    '.txt': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.json': 'jsonl',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+}
+
+
+def detect_format(path: str) -> str:
+    suffix = pathlib.Path(path).suffix.lower()
+    if suffix not in FORMATS:
+        raise ValueError(f"Can't tell the format of {path}, please pass format= one of {sorted(set(FORMATS.values()))}")
+    return FORMATS[suffix]
+
+
+class _CountingReader(io.RawIOBase):
+    """
+    Wraps a binary file and counts the bytes read from it, for throughput reporting.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        self.bytes_read += n or 0
+        return n
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+def read_csv(path: str, batch_size: int, encoding: str = 'utf-8-sig', **csv_options) -> Iterator[tuple[Batch, int]]:
+    """
+    Yield ((columns, rows), bytes_read) batches from a CSV file with a header row.
+    `.tsv` files default to a tab delimiter; other `csv.reader` options can be passed through.
+    """
+    if pathlib.Path(path).suffix.lower() == '.tsv':
+        csv_options.setdefault('delimiter', '\t')
+
+    counter = _CountingReader(open(path, 'rb'))
+    with io.TextIOWrapper(io.BufferedReader(counter), encoding=encoding, newline='') as f:
+        reader = csv.reader(f, **csv_options)
+        columns = next(reader, None)
+        if columns is None:
+            return
+
+        width = len(columns)
+        rows = list()
+        for row in reader:
+            if len(row) != width:
+                row = (row + [None] * width)[:width]
+            rows.append(tuple(row))
+            if len(rows) >= batch_size:
+                yield (columns, rows), counter.bytes_read
+                rows = list()
+        if rows:
+            yield (columns, rows), counter.bytes_read
+
+
+def _to_sqlite_value(value):
+    if value is None or isinstance(value, (str, int, float, bytes)):
+        return value
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def read_jsonl(path: str, batch_size: int, encoding: str = 'utf-8') -> Iterator[tuple[Batch, int]]:
+    """
+    Yield ((columns, rows), bytes_read) batches from a JSON Lines file of objects.
+    Keys may vary from line to line; each batch has the union of its keys. Nested values are stored as JSON text.
+    """
+    with open(path, 'rb') as f:
+        records = list()
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            records.append(json.loads(line))
+            if len(records) >= batch_size:
+                yield _records_to_batch(records), f.tell()
+                records = list()
+        if records:
+            yield _records_to_batch(records), f.tell()
+
+
+def _records_to_batch(records: list[dict]) -> Batch:
+    columns = list(dict.fromkeys(key for record in records for key in record))
+    rows = [tuple(_to_sqlite_value(record.get(column)) for column in columns) for record in records]
+    return columns, rows
+
+
+def read_parquet(path: str, batch_size: int) -> Iterator[tuple[Batch, int]]:
+    """
+    Yield ((columns, rows), bytes_read) batches from a Parquet file, one record batch at a time.
+    bytes_read is estimated from the row groups read so far.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Loading Parquet files requires pyarrow: `pip install pyarrow`") from e
+
+    parquet_file = pq.ParquetFile(path)
+    total_rows = parquet_file.metadata.num_rows or 1
+    total_bytes = pathlib.Path(path).stat().st_size
+    rows_read = 0
+
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+        columns = record_batch.schema.names
+        values = [[_to_sqlite_value(x) for x in column.to_pylist()] for column in record_batch.columns]
+        rows = list(zip(*values))
+        rows_read += len(rows)
+        yield (columns, rows), int(total_bytes * rows_read / total_rows)
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+    'parquet': read_parquet,
+}
+
+
+def infer_column_type(values: Iterable) -> str:
+    """
+    Infer a SQLite column type (INTEGER, REAL, BLOB or TEXT) from sample values. Nulls and blanks are ignored.
+    """
+    inferred = None
+    for value in values:
+        if value is None or value == '':
+            continue
+        if isinstance(value, bytes):
+            value_type = 'BLOB'
+        elif isinstance(value, (bool, int)):
+            value_type = 'INTEGER'
+        elif isinstance(value, float):
+            value_type = 'REAL'
+        else:
+            value_type = 'TEXT'
+            try:
+                int(value)
+                value_type = 'INTEGER'
+            except ValueError:
+                try:
+                    float(value)
+                    value_type = 'REAL'
+                except ValueError:
+                    pass
+
+        if inferred is None or inferred == value_type:
+            inferred = value_type
+        elif {inferred, value_type} == {'INTEGER', 'REAL'}:
+            inferred = 'REAL'
+        else:
+            return 'TEXT'
+
+    return inferred or 'TEXT'
+
+
+def infer_types(batches: list[Batch]) -> dict[str, str]:
+    """
+    Infer the type of every column seen in `batches`.
+    """
+    samples = dict()
+    for columns, rows in batches:
+        for i, column in enumerate(columns):
+            samples.setdefault(column, []).extend(row[i] for row in rows)
+    return {column: infer_column_type(values) for column, values in samples.items()}
+
+
+def ensure_columns(conn: sqlite3.Connection, table: str, column_types: dict[str, str]):
+    """
+    Create `table` with the given columns if it doesn't exist, or add any columns it is missing.
+    """
+    quoted_table = quote_identifier(table)
+    existing = [x[1] for x in conn.execute(f"PRAGMA table_info({quoted_table})")]
+
+    if not existing:
+        definitions = ', '.join(f"{quote_identifier(c)} {t}" for c, t in column_types.items())
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {quoted_table} ({definitions})")
+        return
+
+    for column, column_type in column_types.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {quoted_table} ADD COLUMN {quote_identifier(column)} {column_type}")
+
+
+class LoadPragmas:
+    """
+    Context manager which switches a connection to the `bulk_load` connection profile's journaling, durability
+    and cache settings for the duration of a bulk load, and restores the previous settings afterwards.
+    """
+
+    pragmas = ('journal_mode', 'synchronous', 'cache_size')
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.previous = {x: self.conn.execute(f"PRAGMA {x}").fetchone()[0] for x in self.pragmas}
+        self._set({x: PROFILES['bulk_load'][x] for x in self.pragmas})
+        return self
+
+    def __exit__(self, *exc):
+        self._set(self.previous)
+
+    def _set(self, pragmas: dict):
+        for name, value in pragmas.items():
+            try:
+                self.conn.execute(f"PRAGMA {name}={value}")
+            except sqlite3.OperationalError as e:
+                logger.warning(f"couldn't set {name}={value}, another connection is probably busy: {e}")
+
+
+def log_progress(report: dict):
+    logger.info(
+        f"{report['rows']:,} rows, {report['bytes'] / 2**20:,.1f} MiB in {report['elapsed']:.1f}s: "
+        f"{report['rows_per_second']:,.0f} rows/s, {report['bytes_per_second'] / 2**20:,.1f} MiB/s"
+    )
+
+
+class _TableWriter:
+    """
+    Writes batches into a table on a single connection: extends the table as new columns appear,
+    commits every `transaction_rows` rows and keeps a running throughput report.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, table: str, column_types: dict[str, str],
+                 transaction_rows: int, progress: Callable[[dict], None] = None):
+        self.conn = conn
+        self.table = table
+        self.column_types = dict(column_types)
+        self.transaction_rows = transaction_rows
+        self.progress = progress
+
+        self.statements = dict()
+        self.uncommitted = 0
+        self.bytes_before = 0
+        self.started = time.perf_counter()
+        self.report = dict(rows=0, bytes=0, elapsed=0.0, rows_per_second=0.0, bytes_per_second=0.0)
+
+        ensure_columns(conn, table, self.column_types)
+        conn.commit()
+
+    def write(self, columns: list[str], rows: list[tuple], bytes_read: int, column_types: dict[str, str] = None):
+        """
+        Insert `rows`; `bytes_read` is the running byte count of the current source.
+        """
+        key = tuple(columns)
+        if key not in self.statements:
+            new_columns = [x for x in columns if x not in self.column_types]
+            if new_columns:
+                self.column_types.update(column_types or infer_types([(columns, rows)]))
+                ensure_columns(self.conn, self.table, {x: self.column_types[x] for x in new_columns})
+            self.statements[key] = (
+                f"INSERT INTO {quote_identifier(self.table)} ({', '.join(quote_identifier(x) for x in columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})"
+            )
+
+        self.conn.executemany(self.statements[key], rows)
+        self.uncommitted += len(rows)
+        if self.uncommitted >= self.transaction_rows:
+            self.conn.commit()
+            self.uncommitted = 0
+
+        elapsed = time.perf_counter() - self.started
+        report = self.report
+        report.update(
+            rows=report['rows'] + len(rows),
+            bytes=self.bytes_before + bytes_read,
+            elapsed=elapsed,
+        )
+        report.update(
+            rows_per_second=report['rows'] / elapsed if elapsed else 0.0,
+            bytes_per_second=report['bytes'] / elapsed if elapsed else 0.0,
+        )
+        if self.progress is not None:
+            self.progress(dict(report))
+
+    def next_source(self):
+        """
+        Start counting bytes for the next source file.
+        """
+        self.bytes_before = self.report['bytes']
+
+    def close(self) -> dict:
+        self.conn.commit()
+        return self.report
+
+
+def load_batches(
+        conn: sqlite3.Connection,
+        table: str,
+        batches: Iterable[tuple[Batch, int]],
+        infer_rows: int = 1000,
+        transaction_rows: int = 500_000,
+        progress: Callable[[dict], None] = log_progress,
+        ) -> dict:
+    """
+    Write a stream of ((columns, rows), bytes_read) batches into `table`, and return a throughput report.
+
+    The first `infer_rows` rows are buffered to infer column types before the table is created or extended.
+    Rows are committed every `transaction_rows` rows. `progress` is called with the running report after every batch.
+    If anything raises (including `progress`), the uncommitted rows are rolled back and the connection's pragmas
+    restored before the exception propagates; transactions already committed are kept.
+    """
+    batches = iter(batches)
+
+    # buffer a prefix of the stream to infer column types from.
+    prefix = list()
+    for batch in batches:
+        prefix.append(batch)
+        if sum(len(rows) for (_, rows), _ in prefix) >= infer_rows:
+            break
+    if not prefix:
+        return dict(rows=0, bytes=0, elapsed=0.0, rows_per_second=0.0, bytes_per_second=0.0)
+
+    with LoadPragmas(conn):
+        try:
+            writer = _TableWriter(conn, table, infer_types([x for x, _ in prefix]), transaction_rows, progress)
+            for (columns, rows), bytes_read in _chain(prefix, batches):
+                writer.write(columns, rows, bytes_read)
+            return writer.close()
+        except BaseException:
+            # e.g. a bad batch, or a progress callback raising (JobCancelled from a job's progress): the rows since the
+            # last commit are discarded, and the pragmas are restored outside the transaction.
+            conn.rollback()
+            raise
+
+
+def _chain(prefix: list, rest: Iterator):
+    yield from prefix
+    yield from rest
+
+
+#: provenance columns added to every row by `load_files`.
+SOURCE_FILE_COLUMN = '__beed_source_file'
+SOURCE_ROW_COLUMN = '__beed_source_row'
+
+
+def coerce_rows(columns: list[str], rows: list[tuple], column_types: dict[str, str]) -> list[tuple]:
+    """
+    Convert text values to int / float for INTEGER and REAL columns (blanks become NULL), leaving anything
+    that doesn't convert as it is.
+    """
+    converters = list()
+    for column in columns:
+        column_type = column_types.get(column)
+        converters.append(int if column_type == 'INTEGER' else float if column_type == 'REAL' else None)
+    if not any(converters):
+        return rows
+
+    def convert(value, converter):
+        if converter is None or not isinstance(value, str):
+            return value
+        if value == '':
+            return None
+        try:
+            return converter(value)
+        except ValueError:
+            return value
+
+    return [tuple(convert(value, converter) for value, converter in zip(row, converters)) for row in rows]
+
+
+def parse_file(path: str, queue, stop, format: str = None, batch_size: int = 10_000, infer_rows: int = 1000,
+               provenance: bool = True, reader_options: dict = None) -> int:
+    """
+    Read and type-coerce a file for `load_files`, in a worker: put ('types', column_types) on `queue`, then
+    ('batch', ((columns, rows), bytes_read)) for each batch, then ('end', rows).
+
+    The queue is bounded, so the worker waits while the writer is behind, and gives up once `stop` is set.
+    If reading fails, ('error', None) is put and the exception raised, for the writer to take from the future.
+    Returns the number of rows read.
+    """
+    format = format or detect_format(path)
+
+    def put(message) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(message, timeout=_POLL_SECONDS)
+                return True
+            except Full:
+                pass
+        return False
+
+    row_number = 0
+    try:
+        batches = READERS[format](path, batch_size, **(reader_options or {}))
+
+        # only the first `infer_rows` rows are held back, to infer the column types from.
+        prefix = list()
+        for batch in batches:
+            prefix.append(batch)
+            if sum(len(rows) for (_, rows), _ in prefix) >= infer_rows:
+                break
+        column_types = infer_types(_prefix([x for x, _ in prefix], infer_rows))
+        if provenance:
+            column_types.update({SOURCE_FILE_COLUMN: 'TEXT', SOURCE_ROW_COLUMN: 'INTEGER'})
+        if not put(('types', column_types)):
+            return row_number
+
+        for (columns, rows), bytes_read in _chain(prefix, batches):
+            rows = coerce_rows(columns, rows, column_types)
+            if provenance:
+                rows = [row + (path, row_number + n) for n, row in enumerate(rows, start=1)]
+                columns = list(columns) + [SOURCE_FILE_COLUMN, SOURCE_ROW_COLUMN]
+            row_number += len(rows)
+            if not put(('batch', ((columns, rows), bytes_read))):
+                return row_number
+
+        put(('end', row_number))
+        return row_number
+
+    except BaseException:
+        put(('error', None))
+        raise
+
+
+def _prefix(batches: list[Batch], rows: int) -> list[Batch]:
+    prefix = list()
+    for columns, batch_rows in batches:
+        prefix.append((columns, batch_rows[:rows]))
+        rows -= len(batch_rows)
+        if rows <= 0:
+            break
+    return prefix
+
+
+#: seconds between checks of a worker's future (by the writer) or of the stop event (by a worker) while waiting.
+_POLL_SECONDS = 0.5
+
+
+def _receive(future: Future, queue) -> tuple[str, object]:
+    """
+    Return the next (kind, payload) message from a `parse_file` worker, raising its exception if it failed.
+    """
+    finished = False
+    while True:
+        try:
+            kind, payload = queue.get(timeout=_POLL_SECONDS)
+        except Empty:
+            if future.done():
+                # raises the worker's exception, e.g. if its process died before it could say so.
+                future.result()
+                # a process's last messages can still be in the queue's pipe when its future is done.
+                if finished:
+                    raise RuntimeError("a file parser finished without ending its stream of batches")
+                finished = True
+            continue
+        if kind == 'error':
+            future.result()
+        return kind, payload
+
+
+#: the queues and stop event of the `load_files` call whose process pool this worker belongs to.
+_worker_queues: list = None
+_worker_stop = None
+
+
+def _init_worker(queues: list, stop):
+    """
+    Keep a process pool's queues in the worker, as `multiprocessing` queues can only be inherited, not submitted.
+    """
+    global _worker_queues, _worker_stop
+    _worker_queues, _worker_stop = queues, stop
+    for queue in queues:
+        # batches left in a queue when the pool shuts down must not keep this process from exiting.
+        queue.cancel_join_thread()
+
+
+def _parse_file_in_worker(path: str, slot: int, *args) -> int:
+    """
+    `parse_file` into queue `slot` of the worker's queues (see `_init_worker`).
+    """
+    return parse_file(path, _worker_queues[slot], _worker_stop, *args)
+
+
+def load_files(
+        conn: sqlite3.Connection,
+        table: str,
+        paths: Iterable[str],
+        format: str = None,
+        executor: Executor = None,
+        max_pending: int = None,
+        queue_batches: int = 4,
+        batch_size: int = 10_000,
+        infer_rows: int = 1000,
+        transaction_rows: int = 500_000,
+        provenance: bool = True,
+        progress: Callable[[dict], None] = log_progress,
+        **reader_options,
+        ) -> dict:
+    """
+    Load many files into one table: files are parsed and type-coerced in parallel by `executor`
+    (a new process pool by default), and this connection is the single writer, committing them in the given order.
+
+    Up to `max_pending` files (default: twice the CPU count) are parsed at once, each streaming its batches to the
+    writer through a queue of at most `queue_batches` batches; a parser waits while its queue is full. So about
+    max_pending * (queue_batches + 1) batches of `batch_size` rows are held in memory at most, however large the files.
+    With `provenance`, every row records its source file and row number in
+    `__beed_source_file` / `__beed_source_row`.
+
+    If a file can't be read or a write fails, the uncommitted rows are rolled back, the parsers are stopped and
+    the connection's pragmas restored before the exception propagates.
+    """
+    paths = iter(paths)
+    max_pending = max_pending or 2 * (os.cpu_count() or 1)
+    owns_executor = executor is None
+    manager, queues = None, None
+    if owns_executor:
+        # one queue per file parsed at once, handed to the workers as they start, so batches go straight
+        # through a pipe rather than through a manager process.
+        context = multiprocessing.get_context()
+        queues = [context.Queue(queue_batches) for _ in range(max_pending)]
+        stop = context.Event()
+        executor = ProcessPoolExecutor(mp_context=context, initializer=_init_worker, initargs=(queues, stop))
+    elif isinstance(executor, ProcessPoolExecutor):
+        # the workers of a given pool are already running, so can only be handed a manager's queue proxies.
+        manager = multiprocessing.Manager()
+        stop = manager.Event()
+    else:
+        # threads share ordinary queues.
+        stop = threading.Event()
+    free = deque(range(max_pending))
+
+    pending = deque()
+    submitted = list()
+
+    def submit():
+        path = next(paths, None)
+        if path is None:
+            return
+        options = (format, batch_size, infer_rows, provenance, reader_options)
+        slot = free.popleft()
+        if queues is not None:
+            queue = queues[slot]
+            future = executor.submit(_parse_file_in_worker, str(path), slot, *options)
+        else:
+            queue = manager.Queue(queue_batches) if manager is not None else Queue(queue_batches)
+            future = executor.submit(parse_file, str(path), queue, stop, *options)
+        pending.append((str(path), future, queue, slot))
+        submitted.append(future)
+
+    files = dict()
+    writer = None
+    try:
+        for _ in range(max_pending):
+            submit()
+
+        with LoadPragmas(conn):
+            try:
+                while pending:
+                    path, future, queue, slot = pending.popleft()
+                    _, column_types = _receive(future, queue)
+                    if writer is None:
+                        writer = _TableWriter(conn, table, column_types, transaction_rows, progress)
+                    writer.next_source()
+
+                    while True:
+                        kind, payload = _receive(future, queue)
+                        if kind == 'end':
+                            files[path] = payload
+                            break
+                        (columns, batch_rows), bytes_read = payload
+                        writer.write(columns, batch_rows, bytes_read, column_types=column_types)
+                    free.append(slot)
+                    submit()
+
+                report = writer.close() if writer is not None else \
+                    dict(rows=0, bytes=0, elapsed=0.0, rows_per_second=0.0, bytes_per_second=0.0)
+            except BaseException:
+                conn.rollback()
+                raise
+    finally:
+        stop.set()
+        for future in submitted:
+            future.cancel()
+        # parsers notice `stop` within a poll interval; wait for them before their queues go away.
+        wait(submitted)
+        if owns_executor:
+            executor.shutdown(cancel_futures=True)
+        if manager is not None:
+            manager.shutdown()
+
+    report['files'] = files
+    return report
@@ -0,0 +1,322 @@
+"""
+Background jobs for scan-heavy work on a .beedb file (profiling, syncs, ingests, row counts), so that the notebook
+or a Panel callback thread is never blocked while a large table is read.
+
+A job is a function `func(ctx, *args, **kwargs)` run by an executor: a thread pool by default, or a process pool if
+the function and its arguments can be pickled. Its state, progress and partial results are kept in the `__beed_job`
+table, so they can be watched from another thread, process or reviewer.
+
+The `JobContext` handed to the job gives it connections from the file's pool, whose SQLite progress handler
+interrupts any running statement once the job has been cancelled.
+"""
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable
+import json
+import sqlite3
+import threading
+import time
+
+from sqlalchemy.engine import Engine
+
+from connections import create_beed_engine
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+JOB_TABLE = '__beed_job'
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job (and by `JobHandle.result`) once the job has been cancelled.
+    """
+
+
+class JobContext:
+    """
+    Handed to a running job as its first argument: connections for its work, and the means to report progress,
+    record partial results and notice cancellation.
+    """
+
+    #: the progress handler runs every this many SQLite VM instructions.
+    handler_instructions = 10_000
+    #: minimum seconds between reads of the job's row to see whether it has been cancelled.
+    poll_interval = 0.5
+    #: minimum seconds between writes of progress to the job's row.
+    write_interval = 0.5
+
+    def __init__(self, job_id: int, engine: Engine, cancel_event: threading.Event = None, callbacks: list = None):
+        self.job_id = job_id
+        self.engine = engine
+        self.progress_info = dict()
+        self.partial_results = list()
+
+        self._cancel_event = cancel_event
+        self._callbacks = callbacks if callbacks is not None else list()
+        self._cancelled = False
+        self._last_poll = self._last_write = 0.0
+
+        # job state is written on its own connection, so it never commits (or waits on) the job's own transactions.
+        self._state_pooled = engine.raw_connection()
+        self._state = self._state_pooled.dbapi_connection
+        self._pooled = engine.raw_connection()
+        #: the sqlite3 connection for the job's work.
+        self.conn = self.watch(self._pooled.dbapi_connection)
+
+    def watch(self, conn: sqlite3.Connection) -> sqlite3.Connection:
+        """
+        Install the cancellation progress handler on another sqlite3 connection used by the job.
+        """
+        conn.set_progress_handler(self._progress_handler, self.handler_instructions)
+        return conn
+
+    @contextmanager
+    def session(self):
+        """
+        A SQLModel Session on the job's engine, whose connection is watched for cancellation. Committed on success.
+        """
+        from sqlmodel import Session
+
+        with Session(self.engine) as session:
+            conn = self.watch(session.connection().connection.dbapi_connection)
+            try:
+                yield session
+                session.commit()
+            finally:
+                # the connection goes back to the pool, so it must not keep a handler which may now interrupt everything.
+                conn.set_progress_handler(None, 0)
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        True once the job has been cancelled, either in this process or by setting `cancel_requested` on its row.
+        """
+        if self._cancelled:
+            return True
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            self._cancelled = True
+        elif time.monotonic() - self._last_poll > self.poll_interval:
+            self._last_poll = time.monotonic()
+            row = self._state.execute(f"SELECT cancel_requested FROM {JOB_TABLE} WHERE id = ?", (self.job_id,)).fetchone()
+            self._cancelled = bool(row and row[0])
+        return self._cancelled
+
+    def check_cancelled(self):
+        """
+        Raise JobCancelled if the job has been cancelled. Call between steps which don't run SQL.
+        """
+        if self.cancelled:
+            raise JobCancelled(f'job {self.job_id} was cancelled')
+
+    def _progress_handler(self) -> int:
+        # a non-zero return makes SQLite abort the running statement with "interrupted".
+        try:
+            return 1 if self.cancelled else 0
+        except sqlite3.Error:
+            return 0
+
+    def progress(self, info: dict):
+        """
+        Report progress (any JSON-serialisable dict): callbacks are called, and the job's row is updated at most
+        every `write_interval` seconds. Raises JobCancelled if the job has been cancelled, so it doubles as a checkpoint.
+        """
+        self.progress_info = dict(info)
+        for callback in list(self._callbacks):
+            try:
+                callback(dict(self.progress_info))
+            except Exception as e:
+                logger.warning(f'job {self.job_id} progress callback failed: {e}')
+
+        if time.monotonic() - self._last_write > self.write_interval:
+            self._last_write = time.monotonic()
+            self._update(progress=json.dumps(self.progress_info, default=str), required=False)
+
+        self.check_cancelled()
+
+    def partial(self, result):
+        """
+        Record a partial result (JSON-serialisable), so that work already done is known even if the job then fails
+        or is cancelled. Record results only once they are committed.
+        """
+        self.partial_results.append(result)
+        self._update(result=json.dumps(self.partial_results, default=str), required=False)
+
+    def _update(self, required: bool = True, **values):
+        if not required and self.conn.in_transaction:
+            # the job's own transaction holds the write lock; this is persisted with the next update after it commits.
+            return
+
+        assignments = ', '.join(f'{key} = ?' for key in values)
+        attempts = 5 if required else 1
+        for attempt in range(attempts):
+            try:
+                with self._state:
+                    self._state.execute(f"UPDATE {JOB_TABLE} SET {assignments} WHERE id = ?", (*values.values(), self.job_id))
+                return
+            except sqlite3.OperationalError as e:
+                # usually "database is locked", by a session that has not committed yet.
+                if attempt == attempts - 1:
+                    logger.warning(f'could not update job {self.job_id}: {e}')
+                else:
+                    time.sleep(2 ** attempt)
+
+    def close(self):
+        self._pooled.dbapi_connection.set_progress_handler(None, 0)
+        self._pooled.close()
+        self._state_pooled.close()
+
+
+#: engines created in worker processes, keyed by (url, profile).
+_worker_engines = dict()
+
+
+def _worker_engine(url: str, profile: str) -> Engine:
+    if (url, profile) not in _worker_engines:
+        _worker_engines[url, profile] = create_beed_engine(url, profile)
+    return _worker_engines[url, profile]
+
+
+def run_job(job_id: int, func: Callable, args: tuple, kwargs: dict, engine: Engine = None, url: str = None,
+            profile: str = 'interactive', cancel_event: threading.Event = None, callbacks: list = None):
+    """
+    Run `func(ctx, *args, **kwargs)` as job `job_id`, recording its state in the job table. This is what executors run.
+    In a worker process pass the database `url` (and connection `profile`) instead of an `engine`.
+    """
+    engine = engine if engine is not None else _worker_engine(url, profile)
+    ctx = JobContext(job_id, engine, cancel_event, callbacks)
+    try:
+        if ctx.cancelled:
+            raise JobCancelled(f'job {job_id} was cancelled before it started')
+        ctx._update(status='running', started_at=datetime.now().isoformat(' '))
+
+        result = func(ctx, *args, **kwargs)
+
+        ctx.conn.commit()
+        ctx._update(status='done', finished_at=datetime.now().isoformat(' '),
+                    progress=json.dumps(ctx.progress_info, default=str), result=json.dumps(result, default=str))
+        return result
+
+    except Exception as e:
+        cancelled = isinstance(e, JobCancelled) or (isinstance(e, sqlite3.OperationalError) and ctx.cancelled)
+        # release the write lock of any uncommitted work before recording the outcome.
+        ctx.conn.rollback()
+        ctx._update(status='cancelled' if cancelled else 'failed', finished_at=datetime.now().isoformat(' '),
+                    progress=json.dumps(ctx.progress_info, default=str), error=f'{type(e).__name__}: {e}')
+        if cancelled:
+            raise JobCancelled(f'job {job_id} was cancelled') from e
+        raise
+
+    finally:
+        ctx.close()
+
+
+class JobHandle:
+    """
+    The submitter's view of a job: its future, its row in the job table, progress callbacks and cancellation.
+    """
+
+    def __init__(self, job_id: int, future: Future, engine: Engine, cancel_event: threading.Event, callbacks: list,
+                 local: bool = True):
+        self.id = job_id
+        self.future = future
+        #: True if the job runs in this process, so progress callbacks are called directly rather than by `poll()`.
+        self.local = local
+        self._engine = engine
+        self._cancel_event = cancel_event
+        self._callbacks = callbacks
+        self._last_progress = None
+
+    def on_progress(self, callback: Callable[[dict], None]):
+        """
+        Call `callback` with each progress report. For jobs in this process it is called from the worker thread;
+        for jobs in a process pool it is called from `poll()`.
+        """
+        self._callbacks.append(callback)
+
+    def cancel(self) -> bool:
+        """
+        Cancel the job: a pending job never starts, and a running one is interrupted at its next SQL instruction
+        batch or progress report. Returns False if the job had already finished.
+        """
+        if self.future.done():
+            return False
+
+        self._cancel_event.set()
+        with self._engine.begin() as connection:
+            connection.exec_driver_sql(f"UPDATE {JOB_TABLE} SET cancel_requested = 1 WHERE id = ?", (self.id,))
+            if self.future.cancel():
+                # it never started, so nothing else will record that.
+                connection.exec_driver_sql(
+                    f"UPDATE {JOB_TABLE} SET status = 'cancelled', finished_at = ? WHERE id = ?",
+                    (datetime.now().isoformat(' '), self.id))
+        return True
+
+    def row(self) -> dict:
+        """
+        Return the job's row from the job table, with its JSON columns decoded.
+        """
+        with self._engine.connect() as connection:
+            row = connection.exec_driver_sql(f"SELECT * FROM {JOB_TABLE} WHERE id = ?", (self.id,)).mappings().one()
+        row = dict(row)
+        for key in ('progress', 'result'):
+            row[key] = json.loads(row[key]) if row[key] else None
+        return row
+
+    @property
+    def status(self) -> str:
+        return self.row()['status']
+
+    def poll(self) -> dict:
+        """
+        Read the job's row and pass its progress to the callbacks if it has changed. Use this (e.g. from a periodic
+        callback) to follow jobs running in a process pool. Returns the row.
+        """
+        row = self.row()
+        if row['progress'] is not None and row['progress'] != self._last_progress:
+            self._last_progress = row['progress']
+            for callback in list(self._callbacks):
+                callback(dict(row['progress']))
+        return row
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: float = None):
+        """
+        Wait for the job and return its result. Raises JobCancelled if it was cancelled, or the job's exception.
+        """
+        try:
+            return self.future.result(timeout)
+        except Exception:
+            if self.future.cancelled():
+                raise JobCancelled(f'job {self.id} was cancelled') from None
+            raise
+
+    def __repr__(self):
+        return f"JobHandle: {self.id}, {'done' if self.done() else 'running or pending'}"
+
+
+def submit(engine: Engine, executor: Executor, job_id: int, func: Callable, args: tuple = (), kwargs: dict = None,
+           on_progress: Callable[[dict], None] = None) -> JobHandle:
+    """
+    Run `func(ctx, *args, **kwargs)` as job `job_id` (an existing row of the job table) on `executor`.
+    """
+    kwargs = kwargs or dict()
+    callbacks = [on_progress] if on_progress is not None else list()
+    cancel_event = threading.Event()
+
+    local = not isinstance(executor, ProcessPoolExecutor)
+    if not local:
+        # neither the engine nor the callbacks can cross into the worker; it opens the file itself, and
+        # progress and cancellation go through the job's row.
+        future = executor.submit(run_job, job_id, func, args, kwargs,
+                                 url=str(engine.url), profile=getattr(engine, 'beed_profile', 'interactive'))
+    else:
+        future = executor.submit(run_job, job_id, func, args, kwargs,
+                                 engine=engine, cancel_event=cancel_event, callbacks=callbacks)
+
+    return JobHandle(job_id, future, engine, cancel_event, callbacks, local)
@@ -0,0 +1,571 @@
+"""
+Column profiling for the tables behind a Dataset.
+
+Statistics for many columns are computed in one aggregate scan of the table (chunked, so very wide tables stay
+within SQLite's limits on result columns), rather than a query per column.
+Approximate distinct counts and top-k values are computed with small Python aggregates registered on the connection.
+
+For very large tables a profile can be computed from a seeded random sample of rowids instead of the whole table;
+sampled statistics are scaled up to the estimated table size and reported with 95% error bounds.
+
+A full profile also returns the `state` it was computed from (counts, typed extremes, total length, top value
+counters and, if approximate, HyperLogLog registers), so that a profile of rows appended since can be merged into it
+with `merge_profile` instead of profiling the whole table again.
+"""
+from collections import Counter
+from typing import Iterable
+import hashlib
+import itertools
+import json
+import math
+import random
+import sqlite3
+
+from helpers import quote_identifier, table_columns
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HyperLogLog:
+    """
+    SQLite aggregate which estimates the number of distinct non-null values.
+
+    Uses 2**precision registers, giving a standard error of about 1.04 / sqrt(2**precision) (1.6% at the default of 12).
+    """
+
+    precision = 12
+
+    def __init__(self):
+        self.m = 1 << self.precision
+        self.registers = bytearray(self.m)
+
+    def step(self, value):
+        if value is None:
+            return
+        h = int.from_bytes(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.precision)
+        remainder = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def finalize(self):
+        return round(self.estimate(self.registers))
+
+    @classmethod
+    def estimate(cls, registers: bytearray) -> float:
+        m = len(registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -x for x in registers)
+
+        zeros = registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # small range correction: linear counting
+            return m * math.log(m / zeros)
+        return raw
+
+    @classmethod
+    def relative_error(cls) -> float:
+        return 1.04 / math.sqrt(1 << cls.precision)
+
+    @classmethod
+    def merge(cls, a: bytes | None, b: bytes | None) -> bytes | None:
+        """
+        Return the registers of the union of two sets of values, from the registers of each (None for no values).
+        """
+        if a is None or b is None:
+            return a if b is None else b
+        return bytes(map(max, a, b))
+
+
+class HyperLogLogRegisters(HyperLogLog):
+    """
+    As `HyperLogLog`, but returns its registers, so that the estimates of separate sets of rows can be merged.
+    """
+
+    def finalize(self):
+        return bytes(self.registers)
+
+
+class TopK:
+    """
+    SQLite aggregate which returns the most frequent non-null values as a JSON list of [value, count] pairs.
+
+    Uses the Space-Saving algorithm with a bounded number of counters, so memory stays constant on
+    high-cardinality columns; counts are exact whenever the column has fewer distinct values than `capacity`.
+    """
+
+    k = 5
+    capacity = 100
+
+    def __init__(self):
+        self.counters = dict()
+
+    def step(self, value):
+        if value is None:
+            return
+        if value in self.counters:
+            self.counters[value] += 1
+        elif len(self.counters) < self.capacity:
+            self.counters[value] = 1
+        else:
+            smallest = min(self.counters, key=self.counters.get)
+            self.counters[value] = self.counters.pop(smallest) + 1
+
+    def finalize(self):
+        top = sorted(self.counters.items(), key=lambda x: x[1], reverse=True)[:self.k]
+        return json.dumps([[value if not isinstance(value, bytes) else value.hex(), count] for value, count in top])
+
+
+class SampleDistinct:
+    """
+    SQLite aggregate which estimates the number of distinct values in a whole table from a sample of its rows,
+    using the GEE estimator (Charikar et al., 2000): sqrt(N/n) * f1 + sum(f2..), where f1 is the number of values
+    seen exactly once in the sample.
+
+    Returns a JSON list of [estimate, low, high]: `low` is the number of distinct values in the sample and
+    `high` assumes every value seen once in the sample is unique in the table.
+    """
+
+    #: population size / sample size
+    ratio = 1.0
+    population = None
+
+    def __init__(self):
+        self.counter = Counter()
+
+    def step(self, value):
+        if value is not None:
+            self.counter[value] += 1
+
+    def finalize(self):
+        f1 = sum(1 for x in self.counter.values() if x == 1)
+        rest = len(self.counter) - f1
+        high = self.ratio * f1 + rest
+        if self.population is not None:
+            high = min(high, self.population)
+        return json.dumps([round(math.sqrt(self.ratio) * f1 + rest), len(self.counter), round(high)])
+
+
+def register_aggregates(conn: sqlite3.Connection, top_k: int = 5, ratio: float = 1.0, population: int = None):
+    """
+    Register the profiling aggregates (`beed_hll`, `beed_hll_registers`, `beed_topk`, `beed_sample_distinct`)
+    on a sqlite3 connection. `beed_topk` returns all of its counters, most frequent first, so that they can be merged;
+    `profile_table` keeps the first `top_k` as `top_values`.
+    """
+    capacity = top_k_capacity(top_k)
+    topk = type('TopK', (TopK,), dict(k=capacity, capacity=capacity))
+    sample_distinct = type('SampleDistinct', (SampleDistinct,), dict(ratio=ratio, population=population))
+    conn.create_aggregate('beed_hll', 1, HyperLogLog)
+    conn.create_aggregate('beed_hll_registers', 1, HyperLogLogRegisters)
+    conn.create_aggregate('beed_topk', 1, topk)
+    conn.create_aggregate('beed_sample_distinct', 1, sample_distinct)
+
+
+def top_k_capacity(top_k: int) -> int:
+    """
+    Return the number of Space-Saving counters kept to find the `top_k` most frequent values.
+    """
+    return max(TopK.capacity, top_k * 20)
+
+
+DISTINCT_AGGREGATES = {
+    'exact': 'count(DISTINCT {})',
+    'hll': 'beed_hll({})',
+    'hll_registers': 'beed_hll_registers({})',
+    'sample': 'beed_sample_distinct({})',
+}
+
+#: the statistics of a profile's state which are summed when profiles of separate rows are merged.
+ADDITIVE_STATISTICS = (
+    'row_count', 'null_count', 'blank_count', 'integer_count', 'real_count', 'date_count', 'blob_count', 'length_sum',
+)
+
+
+def column_aggregates(column: str, distinct: str = 'exact', top_k: int = 5) -> list[tuple[str, str]]:
+    """
+    Return the (statistic, SQL expression) pairs used to profile a single column.
+    `distinct` selects how distinct values are counted: 'exact', 'hll', 'hll_registers' or 'sample'
+    (see `DISTINCT_AGGREGATES`).
+    """
+    c = quote_identifier(column)
+    text = f"typeof({c}) = 'text'"
+
+    aggregates = [
+        ('null_count', f"sum({c} IS NULL)"),
+        ('blank_count', f"sum({text} AND trim({c}) = '')"),
+        ('distinct_count', DISTINCT_AGGREGATES[distinct].format(c)),
+        ('min_value', f"min({c})"),
+        ('max_value', f"max({c})"),
+        ('min_length', f"min(length({c}))"),
+        ('max_length', f"max(length({c}))"),
+        ('avg_length', f"avg(length({c}))"),
+        ('length_sum', f"sum(length({c}))"),
+        ('integer_count', f"sum(typeof({c}) = 'integer' OR ({text} AND CAST({c} AS INTEGER) || '' = {c}))"),
+        ('real_count', f"sum(typeof({c}) IN ('integer', 'real') OR ({text} AND {c} GLOB '*[0-9]*' AND {c} NOT GLOB '*[^0-9.eE+-]*'))"),
+        ('date_count', f"sum({text} AND {c} GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9]*')"),
+        ('blob_count', f"sum(typeof({c}) = 'blob')"),
+    ]
+    if top_k:
+        aggregates.append(('top_values', f"beed_topk({c})"))
+
+    return aggregates
+
+
+def infer_type(stats: dict) -> str:
+    """
+    Infer the type of a column's values from its profile counts.
+    One of 'empty', 'integer', 'real', 'date', 'blob' or 'text'.
+    """
+    values = stats['row_count'] - stats['null_count'] - stats['blank_count']
+    if values <= 0:
+        return 'empty'
+    if stats['blob_count'] >= values:
+        return 'blob'
+    if stats['integer_count'] >= values:
+        return 'integer'
+    if stats['real_count'] >= values:
+        return 'real'
+    if stats['date_count'] >= values:
+        return 'date'
+    return 'text'
+
+
+def sample_rowids(conn: sqlite3.Connection, table: str, sample_size: int, seed: int = None) -> tuple[list[int], int] | None:
+    """
+    Draw `sample_size` rowids uniformly from the rowid range of `table`, without scanning it.
+
+    Returns (rowids, span), where span is the size of the rowid range, or None if the table is small enough
+    to be read in full. Rowids which were deleted are simply missed, and the hit rate is used to estimate the row count.
+    """
+    low, high = conn.execute(f"SELECT min(rowid), max(rowid) FROM {quote_identifier(table)}").fetchone()
+    if low is None:
+        return None
+
+    span = high - low + 1
+    if span <= sample_size:
+        return None
+
+    rowids = random.Random(seed).sample(range(low, high + 1), sample_size)
+    return rowids, span
+
+
+def proportion_error(p: float, n: int) -> float:
+    """
+    Return the 95% margin of error of a proportion `p` observed in a sample of `n` rows.
+    """
+    if not n:
+        return 1.0
+    return 1.96 * math.sqrt(p * (1 - p) / n)
+
+
+def profile_table(
+        conn: sqlite3.Connection,
+        table: str,
+        columns: Iterable[str],
+        approximate: bool = False,
+        top_k: int = 5,
+        chunk_size: int = 50,
+        sample_size: int = None,
+        seed: int = None,
+        after_rowid: int = None,
+        max_rowid: int = None,
+        ) -> dict[str, dict]:
+    """
+    Profile `columns` of `table` and return a mapping of column name -> statistics.
+
+    Each chunk of `chunk_size` columns is profiled with a single aggregate query over the table.
+    If `sample_size` is given, only that many randomly chosen rows (reproducible with `seed`) are read, and counts
+    are scaled to the estimated size of the table. Such profiles have `is_approximate` set, and carry error bounds
+    (`row_count_error`, `null_ratio_error`, `distinct_low` / `distinct_high`).
+
+    Otherwise only the rows with rowids after `after_rowid` and up to `max_rowid` (if given) are read, e.g. the rows
+    appended since an earlier profile, and each column's statistics include the `state` (and, if approximate, the
+    HyperLogLog `registers`) to merge them with `merge_profile`.
+    Raises ValueError if any of `columns` is not a column of the table.
+    """
+    columns = list(columns)
+    missing = set(columns) - set(table_columns(conn, table))
+    if missing:
+        # SQLite reads a double-quoted name which is not a column as a string literal, profiling a constant.
+        raise ValueError(f"No such columns in {table}: {sorted(missing)}")
+    source = quote_identifier(table)
+
+    sample = sample_rowids(conn, table, sample_size, seed) if sample_size else None
+    parameters = ()
+    if sample is not None:
+        rowids, span = sample
+        # the rowids are passed as one JSON parameter, so sampling needs no writes on the connection.
+        parameters = (json.dumps(rowids),)
+        source = f"(SELECT * FROM {source} WHERE rowid IN (SELECT value FROM json_each(?)))"
+        hits = conn.execute(f"SELECT count(*) FROM {source}", parameters).fetchone()[0]
+
+        hit_rate = hits / len(rowids)
+        row_count = round(span * hit_rate)
+        row_count_error = round(span * proportion_error(hit_rate, len(rowids)))
+        ratio = row_count / hits if hits else 1.0
+
+        distinct = 'sample'
+        register_aggregates(conn, top_k, ratio=ratio, population=row_count)
+    else:
+        if after_rowid is not None or max_rowid is not None:
+            parameters = (after_rowid if after_rowid is not None else -2**63, max_rowid if max_rowid is not None else 2**63 - 1)
+            source = f"(SELECT * FROM {source} WHERE rowid > ? AND rowid <= ?)"
+        distinct = 'hll_registers' if approximate else 'exact'
+        register_aggregates(conn, top_k)
+
+    profiles = dict()
+    for start in range(0, len(columns), chunk_size):
+        chunk = columns[start:start + chunk_size]
+        keys = [('', 'row_count')]
+        expressions = ['count(*)']
+        for column in chunk:
+            for key, expression in column_aggregates(column, distinct, top_k):
+                keys.append((column, key))
+                expressions.append(expression)
+
+        statement = f"SELECT {', '.join(expressions)} FROM {source}"
+        logger.debug(f'profiling {len(chunk)} columns of {table}')
+        row = conn.execute(statement, parameters).fetchone()
+
+        for (column, key), value in zip(keys[1:], row[1:]):
+            profiles.setdefault(column, dict(row_count=row[0]))[key] = value
+
+    if sample is None:
+        for column, stats in profiles.items():
+            registers = stats.pop('distinct_count') if approximate else None
+            if approximate:
+                stats['distinct_count'] = round(HyperLogLog.estimate(registers)) if registers is not None else 0
+            state = column_state(stats, 'hll' if approximate else 'exact', top_k)
+            profiles[column] = dict(profile_from_state(state, top_k), registers=registers)
+        return profiles
+
+    counts = ('null_count', 'blank_count', 'integer_count', 'real_count', 'date_count', 'blob_count')
+    for stats in profiles.values():
+        for key in counts:
+            stats[key] = stats[key] or 0
+        stats['inferred_type'] = infer_type(stats)
+        stats['top_values'] = _top_values(stats.get('top_values'), top_k)
+
+        # scale the sampled counts up to the estimated size of the table.
+        n = stats['row_count']
+        stats['null_ratio'] = stats['null_count'] / n if n else None
+        stats['is_approximate'] = True
+        stats['distinct_is_approximate'] = True
+        stats['sample_size'] = n
+        stats['null_ratio_error'] = proportion_error(stats['null_ratio'], n) if n else None
+        stats['distinct_count'], stats['distinct_low'], stats['distinct_high'] = json.loads(stats['distinct_count'])
+        stats['row_count'] = row_count
+        stats['row_count_error'] = row_count_error
+        for key in counts:
+            stats[key] = round(stats[key] * ratio)
+
+    return profiles
+
+
+def _top_values(counters: str | None, top_k: int) -> str | None:
+    return json.dumps(json.loads(counters)[:top_k]) if counters is not None else None
+
+
+def column_state(stats: dict, distinct: str, top_k: int = 5) -> dict:
+    """
+    Return the JSON-serialisable state of a column's (unsampled) profile, from the statistics of `profile_table`'s
+    aggregate query: everything `merge_profile` needs, with the typed min and max values.
+    `distinct` is how its distinct values were counted, 'exact' or 'hll'.
+    """
+    state = {key: stats.get(key) or 0 for key in ADDITIVE_STATISTICS}
+    state.update(
+        distinct=distinct,
+        distinct_count=stats['distinct_count'] or 0,
+        min_value=_encode_value(stats['min_value']),
+        max_value=_encode_value(stats['max_value']),
+        min_length=stats['min_length'],
+        max_length=stats['max_length'],
+        top_counters=json.loads(stats['top_values']) if stats.get('top_values') is not None else None,
+        top_capacity=top_k_capacity(top_k),
+        )
+    return state
+
+
+def profile_from_state(state: dict, top_k: int = 5) -> dict:
+    """
+    Return a column's statistics (as from `profile_table`, including the `state`) from its state.
+    """
+    stats = {key: state[key] for key in ADDITIVE_STATISTICS}
+    stats['distinct_count'] = state['distinct_count']
+    stats['inferred_type'] = infer_type(stats)
+
+    n = stats['row_count']
+    values = n - stats['null_count']
+    exact = state['distinct'] == 'exact'
+    stats.update(
+        min_value=_decode_value(state['min_value']),
+        max_value=_decode_value(state['max_value']),
+        min_length=state['min_length'],
+        max_length=state['max_length'],
+        avg_length=stats['length_sum'] / values if values else None,
+        top_values=json.dumps(state['top_counters'][:top_k]) if state['top_counters'] is not None else None,
+        null_ratio=stats['null_count'] / n if n else None,
+        is_approximate=False,
+        distinct_is_approximate=not exact,
+        sample_size=None,
+        row_count_error=0,
+        null_ratio_error=0.0,
+        distinct_low=state['distinct_count'] if exact else None,
+        distinct_high=state['distinct_count'] if exact else None,
+        state=state,
+        )
+    return stats
+
+
+def merge_profile(state: dict, delta: dict, top_k: int = 5, shared: int = None, registers: bytes = None) -> dict:
+    """
+    Return the statistics of a column over two sets of rows (e.g. those profiled before and those appended since),
+    from the `state` of the first and the `profile_table` statistics `delta` of the second.
+
+    Exact distinct counts need the number of distinct values the two have in common, `shared` (see `shared_distinct`);
+    approximate ones merge the HyperLogLog `registers` of the first with those of the delta. Top values merge the
+    Space-Saving counters of both, which stays exact while the column has fewer distinct values than the counters.
+    """
+    new = delta['state']
+    if new['distinct'] != state['distinct']:
+        raise ValueError(f"Can't merge a profile with {new['distinct']} distinct counts into one with {state['distinct']}")
+
+    merged = {key: state[key] + new[key] for key in ADDITIVE_STATISTICS}
+    merged['distinct'] = state['distinct']
+
+    if state['distinct'] == 'exact':
+        if shared is None:
+            raise ValueError("Merging exact distinct counts needs the number of shared distinct values")
+        merged['distinct_count'] = state['distinct_count'] + new['distinct_count'] - shared
+        merged_registers = None
+    else:
+        merged_registers = HyperLogLog.merge(registers, delta.get('registers'))
+        merged['distinct_count'] = round(HyperLogLog.estimate(merged_registers)) if merged_registers is not None else 0
+
+    values = [_decode_value(x) for x in (state['min_value'], state['max_value'], new['min_value'], new['max_value'])]
+    values = [x for x in values if x is not None]
+    merged['min_value'] = _encode_value(min(values, key=_sqlite_order)) if values else None
+    merged['max_value'] = _encode_value(max(values, key=_sqlite_order)) if values else None
+    for key, extreme in (('min_length', min), ('max_length', max)):
+        lengths = [x for x in (state[key], new[key]) if x is not None]
+        merged[key] = extreme(lengths) if lengths else None
+
+    merged['top_capacity'] = max(state['top_capacity'], new['top_capacity'])
+    merged['top_counters'] = _merge_counters(state['top_counters'], new['top_counters'], merged['top_capacity'])
+
+    return dict(profile_from_state(merged, top_k), registers=merged_registers)
+
+
+def _merge_counters(a: list | None, b: list | None, capacity: int) -> list | None:
+    if a is None or b is None:
+        return a if b is None else b
+    counts = Counter()
+    for value, count in itertools.chain(a, b):
+        counts[value] += count
+    return [[value, count] for value, count in counts.most_common(capacity)]
+
+
+def _sqlite_order(value) -> tuple:
+    # SQLite orders values of different types: numbers, then text (by UTF-8 bytes, i.e. by code point), then blobs.
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, value) if isinstance(value, str) else (2, value)
+
+
+def _encode_value(value):
+    return {'blob': value.hex()} if isinstance(value, bytes) else value
+
+
+def _decode_value(value):
+    return bytes.fromhex(value['blob']) if isinstance(value, dict) else value
+
+
+def shared_distinct(
+        conn: sqlite3.Connection,
+        table: str,
+        columns: Iterable[str],
+        after_rowid: int,
+        max_rowid: int = None,
+        chunk_size: int = 50,
+        ) -> dict[str, int]:
+    """
+    Return, for each of `columns`, the number of distinct values of the rows after `after_rowid` (up to `max_rowid`)
+    which also occur at or before it: what an exact distinct count of the two must not count twice (see `merge_profile`).
+
+    Each chunk of columns is one scan of the older rows, probing each value in the (usually much smaller) set of newer
+    values, which SQLite builds once per column; no Python function runs per row.
+    """
+    columns = list(columns)
+    source = quote_identifier(table)
+    parameters = dict(after=after_rowid, upper=max_rowid if max_rowid is not None else 2**63 - 1)
+
+    shared = dict()
+    for start in range(0, len(columns), chunk_size):
+        chunk = columns[start:start + chunk_size]
+        expressions = [
+            f"count(DISTINCT CASE WHEN {c} IN (SELECT {c} FROM {source} WHERE rowid > :after AND rowid <= :upper) "
+            f"THEN {c} END)"
+            for c in map(quote_identifier, chunk)
+            ]
+        row = conn.execute(f"SELECT {', '.join(expressions)} FROM {source} WHERE rowid <= :after", parameters).fetchone()
+        shared.update(zip(chunk, row))
+
+    return shared
+
+
+def nonblank_condition(column: str) -> str:
+    """
+    Return a SQL condition which is true where `column` is neither NULL nor blank text (as counted in `blank_count`).
+    """
+    c = quote_identifier(column)
+    return f"({c} IS NOT NULL AND (typeof({c}) != 'text' OR trim({c}) != ''))"
+
+
+def first_nonblank(
+        conn: sqlite3.Connection,
+        table: str,
+        columns: Iterable[str],
+        n: int = 5,
+        window: int = 1000,
+        chunk_size: int = 1000,
+        ) -> dict[str, list]:
+    """
+    Return the first `n` non-blank values (in rowid order) of each of `columns`, as a mapping of column name -> values.
+
+    The table is read forwards in windows of `window` matching rows, skipping rows which are blank in every column
+    still being collected. Each window only selects the columns which still need values, and the scan stops as soon
+    as every column has `n` values, so on most tables only the first window is read.
+    Columns are scanned together in groups of `chunk_size`, which keeps very wide tables within SQLite's column limit.
+    """
+    columns = list(dict.fromkeys(columns))
+    values = {column: list() for column in columns}
+    source = quote_identifier(table)
+
+    for start in range(0, len(columns), chunk_size):
+        pending = columns[start:start + chunk_size]
+        after = -2**63
+
+        while pending and n > 0:
+            conditions = [nonblank_condition(column) for column in pending]
+            selected = ', '.join(
+                f"CASE WHEN {condition} THEN {quote_identifier(column)} END"
+                for column, condition in zip(pending, conditions))
+            statement = (
+                f"SELECT rowid, {selected} FROM {source} "
+                f"WHERE rowid >= ? AND ({' OR '.join(conditions)}) ORDER BY rowid LIMIT ?")
+
+            rows = conn.execute(statement, (after, window)).fetchall()
+            for row in rows:
+                for column, value in zip(pending, row[1:]):
+                    if value is not None and len(values[column]) < n:
+                        values[column].append(value)
+
+            if len(rows) < window:
+                break
+            after = rows[-1][0] + 1
+            pending = [column for column in pending if len(values[column]) < n]
+
+    return values
@@ -13,8 +13,121 @@ from panel.widgets import MultiChoice
 
 
 from sqlmodels import DataField, Dataset, DataRole
+from jobs import JobHandle
 from helpers import OptionedList
 
+class RoleOptions(param.Parameterized):
+    """
+    The DataRole options of a Dataset, shared by every role picker in an editor, so they are
+    computed once per change rather than once per card.
+    """
+
+    dataset: Dataset = param.ClassSelector(class_=Dataset)
+    options: dict = param.Dict(default={})
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Recompute the options, e.g. after roles were assigned. Every watching card updates from the one result.
+        """
+        self.options = {x.name: x for x in self.dataset.roles_available}
+
+    def for_field(self, field: DataField) -> dict:
+        """
+        The options for one field: the available roles, plus the (possibly unique) roles it already has.
+        """
+        return dict(self.options, **{x.name: x for x in field.roles})
+
+    def by_name(self) -> dict:
+        """
+        Every DataRole, by name, for parsing typed-in role names.
+        """
+        return self.dataset.beediscovery.roles_by_name
+
+
+class RoleEditBuffer(param.Parameterized):
+    """
+    Collects role edits from the UI and writes them together with `BeeDiscovery.set_field_roles`, once no edit has
+    come in for `debounce` milliseconds. Only the latest roles chosen for each field are kept, so rapid clicking
+    results in one batched write. Outside a served document edits are written straight away.
+    A refused write (e.g. a unique role on two fields) is passed to the `on_error` callbacks, which should show the
+    stored roles again; without any it is raised.
+    """
+
+    beediscovery = param.Parameter()
+    debounce: int = param.Integer(default=300, bounds=(0, None))
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._pending = dict()
+        self._callbacks = list()
+        self._error_callbacks = list()
+        self._timer = None
+
+    def set(self, field: DataField, roles: List[DataRole]):
+        """
+        Queue `roles` as the complete set of roles of `field`.
+        """
+        self._pending[id(field)] = (field, list(roles))
+
+        if self._timer is not None and self._timer.running:
+            self._timer.stop()
+        if pn.state.curdoc is None or not self.debounce:
+            self.flush()
+        else:
+            self._timer = pn.state.add_periodic_callback(self.flush, period=self.debounce, count=1)
+
+    def on_flush(self, callback):
+        """
+        Call `callback(fields, report)` after each write, with the fields written and the added / removed counts.
+        """
+        self._callbacks.append(callback)
+
+    def on_error(self, callback):
+        """
+        Call `callback(fields, error)` when a write is refused with a ValueError. Nothing was written, and the
+        edits of those fields are dropped.
+        """
+        self._error_callbacks.append(callback)
+
+    def flush(self) -> dict | None:
+        """
+        Write the queued edits now, and return the added / removed counts, or None if the write was refused.
+        """
+        if self._timer is not None and self._timer.running:
+            self._timer.stop()
+        self._timer = None
+        if not self._pending:
+            return dict(added=0, removed=0)
+
+        written = dict(self._pending)
+        assignments = list(written.values())
+        fields = [field for field, _ in assignments]
+        try:
+            report = self.beediscovery.set_field_roles(assignments)
+        except ValueError as error:
+            self._forget(written)
+            if not self._error_callbacks:
+                raise
+            for callback in self._error_callbacks:
+                callback(fields, error)
+            return None
+
+        self._forget(written)
+        for callback in self._callbacks:
+            callback(fields, report)
+        return report
+
+    def _forget(self, written: dict):
+        # edits queued again while writing (e.g. by a callback) are kept for the next flush.
+        for key, assignment in written.items():
+            if self._pending.get(key) is assignment:
+                del self._pending[key]
+
+
 class DataFieldEditorCard(PydanticModelEditorCard):
     """Same as PydanticModelEditor but uses a Card container
     to hold the widgets and synces the header with the widget `name`
@@ -29,6 +142,14 @@ class DataFieldEditorCard(PydanticModelEditorCard):
     
     _selected_roles: pn.widgets.MultiChoice = param.ClassSelector(class_=pn.widgets.MultiChoice)
 
+    #: options shared with the other cards of an editor; without it each card queries its own.
+    role_options: RoleOptions = param.ClassSelector(class_=RoleOptions, default=None)
+    #: collects role edits to write in batches; without it each edit is applied to `value.roles` straight away.
+    role_edits: RoleEditBuffer = param.ClassSelector(class_=RoleEditBuffer, default=None)
+
+
+    #: set while the roles widget is being reset to the stored roles, which is not an edit.
+    _reverting = False
 
     def __init__(self, **params):
         super().__init__(**params)
@@ -38,7 +159,7 @@ class DataFieldEditorCard(PydanticModelEditorCard):
         self._selected_roles = pn.widgets.MultiChoice(
             name='ROLES', 
             value=self.value.roles,
-            options={x.name: x for x in self.value.dataset.roles_available}
+            options=self._role_options(),
             )
 
         self._composite.header = self.name
@@ -49,16 +170,268 @@ class DataFieldEditorCard(PydanticModelEditorCard):
         self._widgets['roles'] = self._selected_roles
         self._composite[:] = self.widgets
 
+        self._options_watcher = None
+        if self.role_options is not None:
+            self._options_watcher = self.role_options.param.watch(self._update_options, 'options')
+
+    def _role_options(self) -> dict:
+        if self.role_options is not None:
+            return self.role_options.for_field(self.value)
+        return {x.name: x for x in self.value.dataset.roles_available}
+
+    def _update_options(self, event=None):
+        self._selected_roles.options = self._role_options()
+
+    def dispose(self):
+        """
+        Stop following the shared role options, once the card is no longer displayed.
+        """
+        if self._options_watcher is not None:
+            self.role_options.param.unwatch(self._options_watcher)
+            self._options_watcher = None
+
+    def revert_roles(self):
+        """
+        Show the field's stored roles again, e.g. after an edit was refused, without queueing them as an edit.
+        """
+        self._reverting = True
+        try:
+            self._selected_roles.options = self._role_options()
+            self._selected_roles.value = list(self.value.roles)
+        finally:
+            self._reverting = False
+
     @param.depends("_selected_roles.value", watch=True)
     def _update_value(self, value=None):
-        if self.value is None or self._selected_roles is None:
+        if self.value is None or self._selected_roles is None or self._reverting:
             return
 
         self.value: DataField
-        self.value.roles.clear()
-        self.value.roles.extend(self._selected_roles.value)
+        if self.role_edits is not None:
+            # the options are refreshed by whoever follows the buffer's writes.
+            self.role_edits.set(self.value, self._selected_roles.value)
+            return
+
+        mutate_to_match(self.value.roles, self._selected_roles.value)
         # update the set of available options
-        self._selected_roles.options = dict(self.value.dataset.ra)
+        if self.role_options is not None:
+            self.role_options.refresh()
+        else:
+            self._selected_roles.options = dict(self.value.dataset.ra)
+
+
+class DatasetEditor(pn.viewable.Viewer):
+    """
+    Editor for the DataFields of a Dataset which stays responsive with thousands of fields.
+
+    Only the current page of field cards is created, and each card's widgets are only built when it is first
+    expanded. All the cards share one RoleOptions. Bulk edits go through a Tabulator with remote (server-side)
+    pagination, so only the visible page of rows is sent to the browser.
+
+    >>> DatasetEditor(value=bee.d.students).servable()
+    """
+
+    value: Dataset = param.ClassSelector(class_=Dataset)
+    page: int = param.Integer(default=1, bounds=(1, None))
+    page_size: int = param.Integer(default=20, bounds=(1, None))
+    #: only show the cards of fields whose name contains this (case-insensitive).
+    search: str = param.String(default='')
+
+    #: columns of the bulk edit table; the others are read-only.
+    editable_columns = ('name', 'description', 'roles')
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.role_options = RoleOptions(dataset=self.value)
+        self.role_edits = RoleEditBuffer(beediscovery=self.value.beediscovery)
+        self.role_edits.on_flush(self._roles_written)
+        self.role_edits.on_error(self._roles_refused)
+        self._cards = list()
+
+        self._search = pn.widgets.TextInput.from_param(self.param.search, placeholder='Filter fields by name')
+        self._page = pn.widgets.IntInput.from_param(self.param.page, width=100)
+        self._page_label = pn.widgets.StaticText()
+        self._card_column = pn.Column(sizing_mode='stretch_width')
+
+        self._table = pn.widgets.Tabulator(
+            self._fields_frame(),
+            pagination='remote',
+            page_size=50,
+            selectable='checkbox',
+            header_filters=True,
+            show_index=False,
+            editors={x: None for x in ('db_name', 'db_type', 'db_is_primary_key')},
+            sizing_mode='stretch_width',
+            )
+        self._table.on_edit(self._on_table_edit)
+
+        self._bulk_role = pn.widgets.Select(name='Role', options=self.role_options.options)
+        self._bulk_add = pn.widgets.Button(name='Add to selected', button_type='primary')
+        self._bulk_remove = pn.widgets.Button(name='Remove from selected')
+        self._bulk_add.on_click(lambda event: self._bulk_edit(add=True))
+        self._bulk_remove.on_click(lambda event: self._bulk_edit(add=False))
+        self._status = pn.widgets.StaticText()
+        self.role_options.param.watch(self._update_bulk_options, 'options')
+        self._header = pn.pane.Markdown(self._header_text(), sizing_mode='stretch_width')
+
+        self._render_page()
+
+    def __panel__(self):
+        cards = pn.Column(pn.Row(self._search, self._page, self._page_label), self._card_column, name='Fields')
+        table = pn.Column(pn.Row(self._bulk_role, self._bulk_add, self._bulk_remove), self._table, name='Bulk edit')
+        return pn.Column(self._header, self._status, pn.Tabs(cards, table))
+
+    def _header_text(self) -> str:
+        """
+        The Dataset's name and its cached row count, with when it was counted; the table itself isn't read.
+        """
+        record = self.value.row_count_record
+        if record is None or record.row_count is None:
+            rows = 'rows not counted yet'
+        elif record.is_tracked or record.counted_at is None:
+            rows = f'{record.row_count:,} rows'
+        else:
+            rows = f'{record.row_count:,} rows, counted {record.counted_at:%Y-%m-%d %H:%M} (may be stale)'
+        return f'### {self.value.name} ({self.value.table}): {rows}'
+
+    def refresh_header(self):
+        """
+        Show the current cached row count, e.g. after `Dataset.refresh_row_count` or a count job.
+        """
+        self._header.object = self._header_text()
+
+    # cards
+
+    def _matching_fields(self) -> List[DataField]:
+        search = self.search.lower()
+        return [x for x in self.value.fields if search in x.name.lower()]
+
+    @param.depends('page', 'page_size', 'search', watch=True)
+    def _render_page(self):
+        fields = self._matching_fields()
+        pages = max(1, -(-len(fields) // self.page_size))
+        if self.page > pages:
+            self.page = pages
+            return
+
+        for card in self._cards:
+            card.dispose()
+        self._cards = list()
+
+        start = (self.page - 1) * self.page_size
+        self._card_column[:] = [self._lazy_card(x) for x in fields[start:start + self.page_size]]
+        self._page_label.value = f'page {self.page} of {pages} ({len(fields)} fields)'
+
+    def _lazy_card(self, field: DataField) -> pn.Card:
+        """
+        A collapsed placeholder Card, which builds the field's editor the first time it is expanded.
+        """
+        placeholder = pn.Card(title=field.name, collapsed=True, sizing_mode='stretch_width')
+
+        def build(event):
+            if event.new or len(placeholder):
+                return
+            card = DataFieldEditorCard(
+                class_=DataField, value=field, name=field.name, role_options=self.role_options, role_edits=self.role_edits)
+            self._cards.append(card)
+            placeholder[:] = [card]
+
+        placeholder.param.watch(build, 'collapsed')
+        return placeholder
+
+    # bulk edits
+
+    def _fields_frame(self) -> pd.DataFrame:
+        fields = list(self.value.fields)
+        self._fields_by_id = {x.id: x for x in fields}
+        self._rows_by_id = {x.id: row for row, x in enumerate(fields)}
+        return pd.DataFrame(
+            [self._field_row(x) for x in fields],
+            columns=['id', 'name', 'db_name', 'db_type', 'db_is_primary_key', 'description', 'roles'],
+            )
+
+    @staticmethod
+    def _field_row(field: DataField) -> dict:
+        return dict(
+            id=field.id, name=field.name, db_name=field.db_name, db_type=field.db_type,
+            db_is_primary_key=field.db_is_primary_key, description=field.description,
+            roles=', '.join(x.name for x in field.roles),
+            )
+
+    def _field(self, row: int) -> DataField:
+        return self._fields_by_id[self._table.value.iloc[row]['id']]
+
+    def _on_table_edit(self, event):
+        field = self._field(event.row)
+        if event.column not in self.editable_columns:
+            return
+
+        if event.column == 'roles':
+            roles = self.role_options.by_name()
+            names = [x.strip() for x in (event.value or '').split(',') if x.strip()]
+            unknown = [x for x in names if x not in roles]
+            if unknown:
+                self._status.value = f'Unknown role(s) {unknown} for {field.name}, not changed.'
+                self._patch_rows([event.row])
+                return
+            self.role_edits.set(field, [roles[x] for x in names])
+            return
+
+        setattr(field, event.column, event.value)
+        self._status.value = f'{field.name}: {event.column} updated.'
+        self._patch_rows([event.row])
+
+    def _bulk_edit(self, add: bool):
+        role = self._bulk_role.value
+        rows = list(self._table.selection)
+        if role is None or not rows:
+            return
+
+        fields = [self._field(row) for row in rows]
+        if add and role.is_unique:
+            # queued edits are written first, so that the Dataset's roles are current.
+            if self.role_edits.flush() is None:
+                return
+            holders = self.value.roles.get(role.name) or []
+            holders = holders if isinstance(holders, list) else [holders]
+            others = [x.name for x in holders if x not in fields]
+            if others or len(fields) > 1:
+                reason = f'{", ".join(others)} already has it' if others else f'{len(fields)} fields are selected'
+                self._status.value = f'{role.name} can only be on one field of {self.value.name}, but {reason}; not changed.'
+                return
+
+        for field in fields:
+            roles = [x for x in field.roles if x is not role]
+            self.role_edits.set(field, roles + [role] if add else roles)
+        if self.role_edits.flush() is None:
+            return
+        self._status.value = f"{'Added' if add else 'Removed'} {role.name} {'to' if add else 'from'} {len(rows)} field(s)."
+
+    def _roles_written(self, fields: List[DataField], report: dict):
+        self.role_options.refresh()
+        self._patch_rows([self._rows_by_id[x.id] for x in fields if x.id in self._rows_by_id])
+        self._status.value = f"Roles updated: {report['added']} added, {report['removed']} removed."
+
+    def _roles_refused(self, fields: List[DataField], error: ValueError):
+        for card in self._cards:
+            if card.value in fields:
+                card.revert_roles()
+        self._patch_rows([self._rows_by_id[x.id] for x in fields if x.id in self._rows_by_id])
+        self._status.value = f'Roles not changed: {error}'
+
+    def _patch_rows(self, rows: List[int]):
+        """
+        Send the current values of the given rows to the table, rather than resending the whole frame.
+        """
+        self._table.patch({
+            'roles': [(row, self._field_row(self._field(row))['roles']) for row in rows],
+            'name': [(row, self._field(row).name) for row in rows],
+            'description': [(row, self._field(row).description) for row in rows],
+            })
+
+    def _update_bulk_options(self, event):
+        self._bulk_role.options = event.new
+
 
 class OptionedListEditor(PydanticModelEditor):
     """Same as PydanticModelEditor but uses a Card container
@@ -131,23 +504,8 @@ def mutate_list_roles_value(value, *events):
     value: DataField
 
     def mutate_existing(*events):
-        
-        print(f'{value=}')
         for event in events:
-            items_to_remove = value.roles.copy()
-
-            for role in event.new:
-                # check if in existing list of Roles
-                if role in value.roles:
-                    try:
-                        items_to_remove.remove(role)
-                    except ValueError as e:
-                        pass
-                else:
-                    value.roles.append(role)
-
-            for role in items_to_remove:
-                value.roles.remove(role)
+            mutate_to_match(value.roles, event.new)
 
     return mutate_existing
 
@@ -172,20 +530,18 @@ def infer_widget(value: List[DataRole], field: Optional[FieldInfo] = None, **kwa
 ############# USING A Custom MultiChoice editor CLASS ##############
 
 def mutate_to_match(original, values):
-    items_to_remove = original.copy()
-
-    for item in values:
-        # check if in existing list of Roles
-        if item in original:
-            try:
-                items_to_remove.remove(item)
-            except ValueError as e:
-                pass
-        else:
-            original.append(item)
+    """
+    Make the list `original` hold the items of `values`, appending and removing only what differs.
+    Items are compared by identity (DataRoles aren't hashable), using sets rather than repeated list scans.
+    """
+    wanted = {id(x): x for x in values}
+    current = {id(x) for x in original}
 
-    for item in items_to_remove:
+    for item in [x for x in original if id(x) not in wanted]:
         original.remove(item)
+    for key, item in wanted.items():
+        if key not in current:
+            original.append(item)
 
 
 
@@ -223,4 +579,53 @@ class OptionedListEditor(MultiChoice):
 
 #     print(f'using infer_widget for OptionedList: {type(value)=} and {value=}')
     
-#     return OptionedListEditor(value=value, parent=value.parent, options={x.name: x for x in value.options}, height=200)
\ No newline at end of file
+#     return OptionedListEditor(value=value, parent=value.parent, options={x.name: x for x in value.options}, height=200)
+
+############################
+#      Background jobs     #
+############################
+
+def job_progress(job: JobHandle, done_key: str = None, total_key: str = None, poll_period: int = 500) -> pn.Column:
+    """
+    Return a progress bar, status line and cancel button following a background job (see `BeeDiscovery.submit_job`).
+
+    Progress reports arrive on the job's worker thread, so when served the widget updates are handed to the document's
+    next tick. Jobs in a process pool are followed by polling their row every `poll_period` ms instead.
+    `done_key` / `total_key` name the progress entries shown by the bar (e.g. 'fields' and 'fields_total');
+    without them the bar only shows that the job is active.
+    """
+    bar = pn.indicators.Progress(value=-1, active=True, sizing_mode='stretch_width')
+    status = pn.widgets.StaticText(value=f'job {job.id}: pending')
+    cancel = pn.widgets.Button(name='Cancel', button_type='warning')
+    doc = pn.state.curdoc
+
+    def in_document(callback):
+        if doc is not None and doc.session_context is not None:
+            doc.add_next_tick_callback(callback)
+        else:
+            callback()
+
+    def show_progress(info: dict):
+        if info.get(done_key) is not None and info.get(total_key):
+            bar.max = info[total_key]
+            bar.value = min(info[done_key], info[total_key])
+        status.value = f'job {job.id}: ' + ', '.join(f'{k}={v}' for k, v in info.items())
+
+    def show_outcome(future):
+        bar.active = False
+        cancel.disabled = True
+        try:
+            future.result()
+            status.value = f'job {job.id}: done'
+        except Exception as e:
+            status.value = f'job {job.id}: {type(e).__name__}: {e}'
+
+    job.on_progress(lambda info: in_document(lambda: show_progress(info)))
+    job.future.add_done_callback(lambda future: in_document(lambda: show_outcome(future)))
+    cancel.on_click(lambda event: job.cancel())
+
+    if not job.local and doc is not None:
+        poller = pn.state.add_periodic_callback(job.poll, period=poll_period)
+        job.future.add_done_callback(lambda future: in_document(poller.stop))
+
+    return pn.Column(bar, status, cancel)
@@ -0,0 +1,166 @@
+"""
+Role-driven queries over the tables behind Datasets.
+
+A query names DataRoles instead of columns. `compile_select` maps each role to its column in one table and builds a
+single SELECT with the role names as result columns, so the same pipeline runs unchanged on every Dataset which
+carries those roles. A `where` clause refers to roles as `{ROLE}` placeholders, with values passed as parameters.
+`compile_union` combines such SELECTs over many tables into the UNION ALL behind `BeeDiscovery.role_view`.
+
+Results are streamed from a cursor `chunk_size` rows at a time and converted column-wise (no per-row Python mapping)
+to lists, NumPy arrays or Arrow record batches. NumPy and pyarrow are imported only when those formats are requested.
+"""
+from typing import Iterator, Sequence
+import re
+import sqlite3
+
+from helpers import quote_identifier
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+FORMATS = ('columns', 'rows', 'numpy', 'arrow')
+
+#: SQLite's default limit on the number of SELECTs in one compound SELECT (SQLITE_MAX_COMPOUND_SELECT).
+MAX_COMPOUND_SELECT = 500
+
+_PLACEHOLDER = re.compile(r'\{([^{}]+)\}')
+
+
+def placeholders(where: str | None) -> list[str]:
+    """
+    Return the role names referred to as `{ROLE}` in a where clause.
+    """
+    return _PLACEHOLDER.findall(where) if where else []
+
+
+def compile_select(table: str, columns: dict[str, str | None], where: str = None,
+                   roles: dict[str, str | None] = None) -> str:
+    """
+    Return a SELECT of `table` with one result column per item of `columns` (role name -> column, or None for a
+    role the table doesn't have, which selects NULL).
+
+    `{ROLE}` placeholders in `where` are replaced by the quoted column of that role in `roles` (default: `columns`),
+    or NULL if the table doesn't have it. A placeholder which is not a known role raises ValueError.
+    """
+    roles = columns if roles is None else roles
+
+    def substitute(match: re.Match) -> str:
+        name = match.group(1)
+        if name not in roles:
+            raise ValueError(f"Unknown role {{{name}}} in where clause {where!r}")
+        return _column_sql(roles[name])
+
+    select_list = ', '.join(f'{_column_sql(column)} AS {quote_identifier(role)}' for role, column in columns.items())
+    sql = f'SELECT {select_list} FROM {quote_identifier(table)}'
+    if where:
+        sql += f' WHERE {_PLACEHOLDER.sub(substitute, where)}'
+    return sql
+
+
+def compile_source_select(dataset_id: int, table: str, columns: dict[str, str | None]) -> str:
+    """
+    Return a SELECT of `table` for a cross-dataset view: `dataset_id` and `row_id` (the rowid in `table`),
+    then one column per item of `columns` as in `compile_select`.
+    """
+    select_list = ', '.join(f'{_column_sql(column)} AS {quote_identifier(role)}' for role, column in columns.items())
+    return f'SELECT {int(dataset_id)} AS dataset_id, rowid AS row_id, {select_list} FROM {quote_identifier(table)}'
+
+
+def compile_union(sources: list[tuple[int, str, dict[str, str | None]]], role_names: Sequence[str]) -> str:
+    """
+    Return a UNION ALL of `compile_source_select` over (dataset_id, table, columns) `sources`, all selecting
+    `role_names`. With no sources it selects no rows (but has the same columns).
+
+    Groups of `MAX_COMPOUND_SELECT` sources are nested as subqueries, so any number of datasets stays within
+    SQLite's limit. SQLite pushes a WHERE on the union down into each SELECT, where the table's indexes apply.
+    """
+    if not sources:
+        select_list = ', '.join(f'NULL AS {quote_identifier(role)}' for role in role_names)
+        return f'SELECT NULL AS dataset_id, NULL AS row_id, {select_list} WHERE 0'
+
+    selects = [
+        compile_source_select(dataset_id, table, {role: columns.get(role) for role in role_names})
+        for dataset_id, table, columns in sources
+        ]
+    if len(selects) <= MAX_COMPOUND_SELECT:
+        return '\nUNION ALL '.join(selects)
+
+    groups = [selects[i:i + MAX_COMPOUND_SELECT] for i in range(0, len(selects), MAX_COMPOUND_SELECT)]
+    return '\nUNION ALL '.join('SELECT * FROM (' + '\nUNION ALL '.join(x) + ')' for x in groups)
+
+
+def _column_sql(column: str | None) -> str:
+    return 'NULL' if column is None else quote_identifier(column)
+
+
+def stream(conn: sqlite3.Connection, sql: str, names: Sequence[str], params: Sequence | dict = (),
+           chunk_size: int = 10_000, format: str = 'columns') -> Iterator:
+    """
+    Run `sql` and yield its result `chunk_size` rows at a time, as:
+
+    - 'columns': a dict of name -> list of values
+    - 'rows': the list of row tuples, as returned by the cursor
+    - 'numpy': a dict of name -> NumPy array (see `to_numpy`)
+    - 'arrow': a `pyarrow.RecordBatch`
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format!r}, expected one of {FORMATS}")
+    convert = _converter(format, list(names))
+
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield convert(rows)
+    finally:
+        cursor.close()
+
+
+def _converter(format: str, names: list[str]):
+    if format == 'rows':
+        return lambda rows: rows
+    if format == 'columns':
+        return lambda rows: dict(zip(names, map(list, zip(*rows))))
+    if format == 'numpy':
+        return lambda rows: dict(zip(names, map(to_numpy, zip(*rows))))
+
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ImportError("Arrow batches require pyarrow: `pip install pyarrow`") from e
+
+    def to_arrow(rows):
+        columns = [_arrow_array(pa, values) for values in zip(*rows)]
+        return pa.RecordBatch.from_arrays(columns, names=names)
+
+    return to_arrow
+
+
+def to_numpy(values: Sequence):
+    """
+    Return a NumPy array of one column's values: int64 for integers, float64 for numbers (NULLs become NaN),
+    otherwise an object array of the values as they are (SQLite columns may mix types).
+    """
+    try:
+        import numpy as np
+    except ImportError as e:
+        raise ImportError("NumPy batches require numpy: `pip install numpy`") from e
+
+    types = set(map(type, values))
+    if types <= {int, bool}:
+        return np.array(values, dtype=np.int64)
+    if types <= {int, bool, float, type(None)}:
+        return np.array(values, dtype=np.float64)
+    return np.array(values, dtype=object)
+
+
+def _arrow_array(pa, values: Sequence):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # a column mixing types (e.g. numbers and text) has no single Arrow type; keep it as text.
+        return pa.array([None if x is None else str(x) for x in values], type=pa.string())
@@ -1,22 +1,42 @@
-from typing import Optional, List, DefaultDict
+from typing import Optional, List, DefaultDict, Callable
 from sqlite_utils import Database
 from sqlite_utils.db import Table, Column
+from concurrent.futures import Executor, ThreadPoolExecutor
 import pydantic_panel
 import sqlite_utils
 
 from collections import defaultdict
-
-from helpers import DynamicAttrDefaultDictList, OptionedList
-
-from sqlalchemy import event, and_
-from sqlalchemy.orm import validates, object_session, relationship
+from datetime import datetime
+import glob
+import hashlib
+import itertools
+import json
+import operator
+import time
+
+from helpers import DynamicAttrDefaultDictList, OptionedList, quote_identifier, table_columns, normalize_attribute_name, add_to_mapping, discard_from_mapping
+import profiling
+import ingest
+import jobs
+import queries
+import value_index
+from connections import create_beed_engine, sqlite_utils_database
+from ingest import log_progress
+
+from sqlalchemy import event, and_, or_, func, text, delete, tuple_, literal, Index
+from sqlalchemy.orm import validates, object_session, relationship, selectinload, aliased
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.associationproxy import AssociationProxy
+from sqlalchemy.engine import Engine
 from sqlmodel import Field, Session, SQLModel, Relationship, create_engine, select
 
 
 from typing import Optional, Union, List
 import pathlib
+import urllib.parse
+import sqlalchemy.exc
 from sqlmodel import create_engine, SQLModel, Field, Session, select, Relationship
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
@@ -68,7 +88,8 @@ class Dataset(SQLModel, table=True):
         back_populates="dataset", 
         sa_relationship_kwargs={
             'cascade': 'all, delete-orphan', 
-            'lazy':'joined', 
+            # loaded on first access; each DataField's roles then come in one batched query.
+            'lazy':'select', 
             },
         )
 
@@ -85,74 +106,255 @@ class Dataset(SQLModel, table=True):
 
     
     def __repr__(self):
-        return f"Dataset: {self.name}, {self.t.count if self.beediscovery and self.t.exists() else 0} records with DataFields {[x.name for x in self.fields]}"
+        return f"Dataset: {self.name}, {self._row_count_repr()} records with DataFields {[x.name for x in self.fields]}"
     
     def __str__(self):
         return self.__repr__()
 
 
     @property
-    def roles_available(self):
+    def row_count(self) -> int | None:
         """
-        Return a list of DataRoles which are available (i.e., can be currently assigned to new fields in the dataset.
-        If they are flagged as unique roles, then they are not a part of this list if they have already been assigned.
+        Return the cached number of rows in the table, without scanning it.
+        None if the table has never been counted; see `refresh_row_count()` and `track_row_count()`.
         """
-        
-        # get all roles
+        row_count = self.row_count_record
+        return row_count.row_count if row_count else None
 
-        # TODO: THIS NEEDS WORK, not working correctly
-        session = Session.object_session(self)
+    @property
+    def row_count_record(self) -> Optional["TableRowCount"]:
+        """
+        Return the cached row count of the table with when it was counted, or None if it never was.
+        """
+        if self.beediscovery is None or not self.beediscovery._has_table(TableRowCount.__tablename__):
+            return None
+        return self.beediscovery._session.get(TableRowCount, self.table)
 
-        roles_available = list()
+    def _row_count_repr(self) -> str:
+        row_count = self.row_count_record
+        if row_count is None:
+            return _row_count_label(None, False, None)
+        return _row_count_label(row_count.row_count, row_count.is_tracked, row_count.counted_at)
 
-        statement = select(DataRole).filter(DataRole.is_unique==False)
-        roles_non_unique = session.exec(statement)
-        for role in roles_non_unique:
-            logger.debug(f'available non_unique roles: {role=}')
-            if role not in roles_available:
-                roles_available.append(role)
+    def refresh_row_count(self) -> int:
+        """
+        Count the rows in the table and store the result, with a timestamp, in the row count metadata table.
+        The count is taken with the table's changes (see `refresh_changes`), so a table with `track_changes`
+        only has the rows added since the last count counted.
+        """
+        changes = self.refresh_changes()
+        if changes is not None:
+            return changes['row_count']
 
-        statement = select(DataRole).where(~DataRole.fields.any(DataField.id == self.id)).where(DataRole.is_unique==False)
-        roles_unique_no_fields = session.exec(statement)
-        for role in roles_unique_no_fields:
-            logger.debug(f'available unique role: {role=}')
-            if role not in roles_available:
-                roles_available.append(role)
+        session = self.beediscovery._session
+        with session.begin_nested():
+            _store_row_count(session, self.table, 0)
+        return 0
 
-        return sorted(roles_available, key=id, reverse=True)
+    def track_row_count(self, enable: bool = True):
+        """
+        Keep the cached row count current with insert/delete triggers on the table (or drop them, if `enable` is False).
+        The triggers add a small cost to every insert and delete, so this is opt-in per Dataset.
+        """
+        session = self.beediscovery._session
+        table = quote_identifier(self.table)
+        literal = "'" + self.table.replace("'", "''") + "'"
+        triggers = {
+            'insert': 'row_count + 1',
+            'delete': 'row_count - 1',
+        }
+
+        with session.begin_nested():
+            for action, update in triggers.items():
+                trigger = quote_identifier(f'__beed_rowcount_{self.table}_{action}')
+                session.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+                if enable:
+                    session.execute(text(f"""
+                        CREATE TRIGGER {trigger} AFTER {action.upper()} ON {table}
+                        BEGIN
+                            UPDATE __beed_rowcount SET row_count = {update} WHERE "table" = {literal};
+                        END
+                        """))
+
+            row_count = session.get(TableRowCount, self.table) or TableRowCount(table=self.table)
+            if enable:
+                # counted in the same transaction that installs the triggers, so no rows are missed.
+                row_count.row_count = session.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+                row_count.counted_at = datetime.now()
+            row_count.is_tracked = enable
+            session.add(row_count)
 
-    
+    @property
+    def generation(self) -> int | None:
+        """
+        The generation of the table's contents, as last recorded by `refresh_changes` (which profiles, ingests,
+        row counts and value index updates call), without reading the table. None if it has never been recorded.
+        """
+        if self.beediscovery is None or not self.beediscovery._has_table(TableChanges.__tablename__):
+            return None
+        record = self.beediscovery._session.get(TableChanges, self.table)
+        return record.generation if record else None
+
+    def refresh_changes(self) -> dict | None:
+        """
+        Record whether rows have been added to the table, or updated or deleted in it, since its changes were last
+        recorded, and if so advance its `generation`. Returns the record: `generation`, the rowid high-water mark
+        `max_rowid`, `row_count`, `new_rows` above the previous mark, and whether existing rows were `rewritten`
+        (None if the table doesn't exist). The cached row count is refreshed too.
+
+        Profiles and value index postings of an earlier generation are then brought up to date from the new rows
+        alone, unless existing rows were rewritten. Without `track_changes` the whole table is counted to detect
+        deletes, and the last rows are checksummed to detect replaced rowids, but other updates in place are missed
+        (call `profile(refresh=True)` after them); with it, only the new rows are counted.
+
+        >>> bee['logs'].refresh_changes()['new_rows']
+        """
+        return _record_changes(self.beediscovery._session, self.table)
+
+    def track_changes(self, enable: bool = True) -> dict | None:
+        """
+        Count updates and deletes of existing rows with triggers on the table (or drop them, if `enable` is False),
+        so that `refresh_changes` sees updates in place and only has to count the rows added since.
+        The triggers add a small cost to every update and delete, so this is opt-in per Dataset.
+        """
+        session = self.beediscovery._session
+        table = quote_identifier(self.table)
+        literal = "'" + self.table.replace("'", "''") + "'"
+
+        with session.begin_nested():
+            for action in ('update', 'delete'):
+                trigger = quote_identifier(f'__beed_changes_{self.table}_{action}')
+                session.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+                if enable:
+                    session.execute(text(f"""
+                        CREATE TRIGGER {trigger} AFTER {action.upper()} ON {table}
+                        WHEN OLD.rowid <= (SELECT max_rowid FROM __beed_changes WHERE "table" = {literal})
+                        BEGIN
+                            UPDATE __beed_changes SET modified = modified + 1 WHERE "table" = {literal};
+                        END
+                        """))
+
+            # recorded untracked (counting the whole table) in the same transaction that installs the triggers,
+            # so deletes made before tracking started are not missed.
+            changes = _record_changes(session, self.table)
+            record = session.get(TableChanges, self.table)
+            if record is not None:
+                record.is_tracked = enable
+                session.add(record)
+
+        return changes
+
+    @property
+    def roles_available(self):
+        """
+        Return a list of DataRoles which are available (i.e., can be currently assigned to new fields in the dataset.
+        If they are flagged as unique roles, then they are not a part of this list if they have already been assigned.
+
+        The list is fetched with a single query, ordered by name, and cached until role links or DataRoles change.
+        """
+        cache = self._cache()
+        if cache is None:
+            return self._query_roles_available()
+
+        if 'roles_available' not in cache:
+            cache['roles_available'] = self._query_roles_available()
+        return list(cache['roles_available'])
+
+    def _query_roles_available(self) -> List[DataRole]:
+        session = object_session(self)
+        if session is None:
+            return []
+
+        taken_in_dataset = (
+            select(DataFieldRoleLink.role_id)
+            .join(DataField, DataFieldRoleLink.field_id == DataField.id)
+            .where(DataField.dataset_id == self.id)
+            )
+        statement = (
+            select(DataRole)
+            .where(or_(DataRole.is_unique == False, DataRole.id.not_in(taken_in_dataset)))
+            .order_by(DataRole.name)
+            )
+        return session.exec(statement).unique().all()
 
     @property
     def roles(self) -> dict[str:"DataField"]:
-        # TODO: clean this up with a better SQL select statement        
-        role_mapping = dict()
+        """
+        Return a mapping of DataRole name -> DataField (or a list of DataFields, if several fields share the role).
+
+        The mapping is built with one joined query over the role link table, cached on the BeeDiscovery,
+        and kept up to date by events as DataFields gain or lose roles.
+        """
+        return {k: list(v) if isinstance(v, list) else v for k, v in self._role_index()['roles'].items()}
 
-        for field in self.fields:
-            for role in field.roles:
-                logger.debug(f'assessing {role=} for {field=}')
-                if role.name in role_mapping:
-                    if not isinstance(role_mapping[role.name], list):
-                        convert_to_list = list()
-                        convert_to_list.append(role_mapping[role.name])
-                        role_mapping[role.name] = convert_to_list
-                    role_mapping[role.name].append(field)
-                else:
-                    role_mapping[role.name] = field
-                
-        return role_mapping
-    
     @property
     def r(self) -> dict[str:"DataField"]:
-        return DynamicAttrDefaultDictList(self.roles)
-    
+        return self._role_index()['r']
+
+    def _role_index(self) -> dict:
+        """
+        Return the cached role index for this Dataset, building it if it has been invalidated.
+        """
+        cache = self._cache()
+        if cache is None:
+            return self._build_role_index()
+
+        if 'roles' not in cache:
+            cache.update(self._build_role_index())
+        return cache
+
+    def _build_role_index(self) -> dict:
+        session = object_session(self)
+
+        if session is None or self.id is None:
+            # not persisted yet, so the link table cannot be queried.
+            pairs = [(role.name, field) for field in self.fields for role in field.roles]
+        else:
+            statement = (
+                select(DataRole.name, DataField)
+                .join(DataFieldRoleLink, DataFieldRoleLink.role_id == DataRole.id)
+                .join(DataField, DataFieldRoleLink.field_id == DataField.id)
+                .where(DataField.dataset_id == self.id)
+                .order_by(DataFieldRoleLink.priority, DataField.id)
+                )
+            pairs = session.exec(statement).unique().all()
+
+        role_mapping = dict()
+        role_view = DynamicAttrDefaultDictList(dict())
+        for role_name, field in pairs:
+            add_to_mapping(role_mapping, role_name, field)
+            role_view.add(field, key=role_name)
+
+        return dict(roles=role_mapping, r=role_view)
+
+    def _cache(self) -> dict | None:
+        """
+        Return the dict used to cache derived values for this Dataset, or None if it cannot be cached
+        (e.g. it is not attached to a BeeDiscovery yet).
+        """
+        if self.beediscovery is None or self.id is None:
+            return None
+        return self.beediscovery._dataset_cache[self.id]
+
     @property
     def ra(self) -> dict[str:"DataField"]:
-        return DynamicAttrDefaultDictList(self.roles_available, lambda x: x.name.replace(' ','').replace('-','_'))
+        return self._view('ra', lambda: DynamicAttrDefaultDictList(self.roles_available, _attribute_name))
     
     @property
     def f(self) -> dict[str:"DataField"]:
-        return DynamicAttrDefaultDictList(self.fields, lambda x: x.name.replace(' ','').replace('-','_'))
+        return self._view('f', lambda: DynamicAttrDefaultDictList(self.fields, _attribute_name))
+
+    def _view(self, key: str, build: Callable):
+        """
+        Return the cached attribute-access view `key`, building it on first use.
+        Views are then maintained incrementally by the collection events at the bottom of this module.
+        """
+        cache = self._cache()
+        if cache is None:
+            return build()
+        if key not in cache:
+            cache[key] = build()
+        return cache[key]
 
     @property
     def t(self) -> Table:
@@ -185,50 +387,329 @@ class Dataset(SQLModel, table=True):
     def sync_columns(self):
         """
         evaluate the referenced table and create DataFields for each column which exists.
+
+        The table's column info is read once and every existing DataField for this Dataset is loaded
+        in a single query, so the diff is a keyed lookup rather than a query per column.
+        New DataFields are bulk-inserted in one flush.
         """
 
         try:
+            session = self.beediscovery._session
 
-            with self.beediscovery._session.begin_nested():
-                
-                matched_pairs = list()
-                matched_datafields = list()
-                extra_datafields = list()
-
-                for column in self.t.columns:
-                    # print(f'here is some column info: {column}')
-                    column: Column
-                    
-                    db_fields = self.datafield(db_name=column.name, db_is_primary_key=column.is_pk, dataset=self)
-
-                    if len(db_fields) > 1:
-                        # print("looks like there are lots of fields which match, oops")
-                        matched_pairs.append((column, db_fields))
+            with session.begin_nested():
+                session.flush()
 
-                    elif len(db_fields) == 1:
-                        # print(f'There is one match for these attributes! Great, use this as the match.')
-                        matched_pairs.append((column, db_fields))
-                        matched_datafields.append(db_fields[0])
+                statement = select(DataField).where(DataField.dataset_id == self.id)
+                existing = {field.id: field for field in session.exec(statement).unique().all()}
 
-                    else:
-                        field = DataField(dataset=self, name=column.name, db_name=column.name, db_type=column.type, db_default_value=column.default_value, db_is_primary_key=column.is_pk)
+                matched_ids, extra_ids, new_columns = _diff_columns(
+                    self.t.columns,
+                    [(field.id, field.db_name, field.db_is_primary_key) for field in existing.values()],
+                    )
+                created = _bulk_create_datafields(session, {self.id: new_columns})
 
-                        print(f"no match in the database, creating a new DataField for the Table's column:\n{field}")
-                
-                # look for any DataFields which were not matched against in the Table:
-                for field in self.fields:
-                    # print(f'examining field: {field}')
-                    if field not in matched_datafields:
-                        print(f'wait, we found a field that did not have a match: {field=}')
-                        extra_datafields.append(field)
+            if created:
+                # the relationship was loaded before the bulk insert, so refresh it to pick up the new rows.
+                session.expire(self, ['fields'])
+                _invalidate_dataset_cache(self, 'f')
 
-                return dict(matched_datafields=matched_datafields, extra_datafields=extra_datafields)
+            return dict(
+                matched_datafields=[existing[x] for x in matched_ids],
+                extra_datafields=[existing[x] for x in extra_ids],
+                created=created,
+                )
 
         except Exception as e:
             print(f"shoot, it didn't work: {e}")
 
 
 
+    def ingest(self,
+        source: str,
+        format: str = None,
+        batch_size: int = 10_000,
+        infer_rows: int = 1000,
+        transaction_rows: int = 500_000,
+        progress: Callable[[dict], None] = log_progress,
+        **reader_options,
+        ) -> dict:
+        """
+        Stream a CSV, JSON Lines or Parquet file into this Dataset's table, then sync its DataFields.
+
+        Rows are read in batches of `batch_size` and inserted with `executemany`, committing every `transaction_rows`
+        rows, so memory use stays bounded however large the file is. Column types are inferred from the first
+        `infer_rows` rows, and the table is created or extended as needed.
+        `progress` is called after every batch with the rows, bytes, rows/s and bytes/s so far.
+        The format is taken from the file extension unless `format` ('csv', 'jsonl' or 'parquet') is given.
+
+        The load writes through the `BeeDiscovery.db` connection, so the session is committed first to release its locks.
+
+        >>> bee['students'].ingest('student.csv')
+        """
+        format = format or ingest.detect_format(source)
+        session = self.beediscovery._session
+        session.commit()
+
+        batches = ingest.READERS[format](source, batch_size, **reader_options)
+        report = ingest.load_batches(
+            self.beediscovery.db.conn,
+            self.table,
+            batches,
+            infer_rows=infer_rows,
+            transaction_rows=transaction_rows,
+            progress=progress,
+            )
+
+        report['sync'] = self.sync_columns()
+        report['changes'] = self.refresh_changes()
+        report['value_index'] = self.beediscovery.update_value_index(tables=[self.table])
+        return report
+
+    def ingest_files(self,
+        sources: str | List[str],
+        format: str = None,
+        executor: Executor = None,
+        max_pending: int = None,
+        queue_batches: int = 4,
+        provenance: bool = True,
+        batch_size: int = 10_000,
+        transaction_rows: int = 500_000,
+        progress: Callable[[dict], None] = log_progress,
+        **reader_options,
+        ) -> dict:
+        """
+        Load many files (a list of paths, or a glob pattern) into this Dataset's table in parallel, then sync its DataFields.
+
+        Files are parsed and type-coerced by a process pool (or the given `executor`), while one writer connection
+        commits them in order. At most `max_pending` files are parsed at a time, each holding at most `queue_batches`
+        batches in memory while the writer catches up.
+        With `provenance`, each row records its source file and row number in
+        `__beed_source_file` and `__beed_source_row`. The report includes the rows loaded per file.
+
+        >>> bee['logs'].ingest_files('production_003/**/*.csv')
+        """
+        if isinstance(sources, str):
+            sources = sorted(glob.glob(sources, recursive=True))
+
+        session = self.beediscovery._session
+        session.commit()
+
+        report = ingest.load_files(
+            self.beediscovery.db.conn,
+            self.table,
+            sources,
+            format=format,
+            executor=executor,
+            max_pending=max_pending,
+            queue_batches=queue_batches,
+            batch_size=batch_size,
+            transaction_rows=transaction_rows,
+            provenance=provenance,
+            progress=progress,
+            **reader_options,
+            )
+
+        report['sync'] = self.sync_columns()
+        report['changes'] = self.refresh_changes()
+        report['value_index'] = self.beediscovery.update_value_index(tables=[self.table])
+        return report
+
+    def ingest_job(self,
+        source: str,
+        format: str = None,
+        batch_size: int = 10_000,
+        infer_rows: int = 1000,
+        transaction_rows: int = 500_000,
+        executor: Executor = None,
+        on_progress: Callable[[dict], None] = None,
+        **reader_options,
+        ) -> jobs.JobHandle:
+        """
+        Run `ingest` as a background job (see `BeeDiscovery.submit_job`) and return its handle.
+        Progress reports are those of `ingest`; if the job is cancelled, the transactions already committed are kept.
+        The result's `sync` names the DataFields matched, extra and created, as the datasets of `sync_all_job` do.
+
+        >>> job = bee['students'].ingest_job('student.csv', on_progress=print)
+        """
+        format = format or ingest.detect_format(source)
+        return self.beediscovery.submit_job(
+            _ingest_job,
+            args=(self.table, source, format),
+            kwargs=dict(dataset_id=self.id, batch_size=batch_size, infer_rows=infer_rows,
+                        transaction_rows=transaction_rows, reader_options=reader_options),
+            kind='ingest',
+            dataset=self,
+            executor=executor,
+            on_progress=on_progress,
+            )
+
+    def preview_nonblank(self, n: int = 5, fields: List["DataField"] = None, window: int = 1000) -> dict[str, list]:
+        """
+        Return the first `n` non-blank values of each of `fields` (default: all DataFields), keyed by DataField name.
+
+        All the columns are read together in one forward scan of the table, in windows of `window` rows, which stops
+        as soon as every field has `n` values, rather than a query per field as with `DataField.first_nonblank`.
+
+        >>> students.preview_nonblank(3)['mark']
+        """
+        fields = list(fields) if fields is not None else list(self.fields)
+        if not self.t.exists():
+            return {x.name: list() for x in fields}
+
+        values = profiling.first_nonblank(
+            self.beediscovery.db.conn, self.table, [x.db_name for x in fields], n=n, window=window)
+        return {x.name: values[x.db_name] for x in fields}
+
+    def select_roles(self,
+        *role_names: str,
+        where: str = None,
+        params: tuple | dict = (),
+        chunk_size: int = 10_000,
+        format: str = 'columns',
+        missing: str = 'null',
+        ):
+        """
+        Stream the columns of this Dataset which carry `role_names`, as batches of `chunk_size` rows keyed by role name
+        (see `queries.stream` for the formats: 'columns', 'rows', 'numpy' or 'arrow').
+
+        Roles are resolved to columns with the role index and compiled into one SELECT, so batches come straight
+        from the cursor. Where several fields share a role, the one with the lowest link priority is used.
+        A role which no field has is selected as NULL, or raises KeyError if `missing` is 'raise'.
+        `where` is a SQL condition referring to roles as `{ROLE}`, with values passed in `params`.
+
+        >>> for batch in students.select_roles('NAME', 'MARK', where='{MARK} >= ?', params=(50,), format='numpy'):
+        ...     batch['MARK'].mean()
+        """
+        if missing not in ('null', 'raise'):
+            raise ValueError(f"missing must be 'null' or 'raise', not {missing!r}")
+
+        names = self.beediscovery._query_role_names(role_names, where)
+        index = self._role_index()['roles']
+        columns = {name: _first(index.get(name)) for name in names}
+        absent = [name for name, field in columns.items() if field is None]
+        if absent and missing == 'raise':
+            raise KeyError(f"{self.name} has no fields with the roles {absent}")
+        columns = {name: field.db_name if field is not None else None for name, field in columns.items()}
+
+        sql = queries.compile_select(self.table, {name: columns[name] for name in role_names}, where, roles=columns)
+        return queries.stream(self.beediscovery.db.conn, sql, role_names, params, chunk_size, format)
+
+    def profile(self,
+        fields: List["DataField"] = None,
+        approximate: bool = False,
+        top_k: int = 5,
+        refresh: bool = False,
+        chunk_size: int = 50,
+        sample_size: int = None,
+        seed: int = None,
+        ) -> dict[str, "DataFieldProfile"]:
+        """
+        Compute column statistics (null/blank counts, distinct count, min/max, lengths, top values and an
+        inferred type) for the DataFields of this Dataset, and store them as DataFieldProfiles.
+
+        Columns are profiled together in one aggregate scan per `chunk_size` columns, not one query per field.
+        Fields whose stored profile is current (at the table's `generation`, see `refresh_changes`) are skipped
+        unless `refresh` is True. Profiles from an earlier generation are brought up to date by profiling only the
+        rows appended since and merging them in, unless existing rows were updated or deleted, which recomputes them.
+        Sampled profiles, and those stored before changes were tracked, are kept until `refresh`.
+        With `approximate`, distinct counts are HyperLogLog estimates, which keeps memory flat on large tables.
+        With `sample_size`, only that many randomly chosen rows are read (reproducibly, given a `seed`), and the
+        stored profiles are tagged `is_approximate` with error bounds on the counts, distinct estimate and null ratio.
+
+        >>> students.profile()['mark'].distinct_count
+        """
+        fields = list(fields) if fields is not None else list(self.fields)
+        to_profile, change, mergeable = self._fields_to_profile(fields, refresh, exact=refresh or sample_size is None)
+
+        if to_profile:
+            stats = _profile_stats(
+                self.beediscovery.db.conn,
+                self.table,
+                [(x.id, x.db_name) for x in to_profile],
+                mergeable,
+                change,
+                approximate=approximate,
+                top_k=top_k,
+                chunk_size=chunk_size,
+                sample_size=sample_size,
+                seed=seed,
+                )
+            self._store_profiles(to_profile, stats, change)
+
+        return {x.name: x.profile for x in fields}
+
+    def profile_job(self,
+        fields: List["DataField"] = None,
+        approximate: bool = False,
+        top_k: int = 5,
+        refresh: bool = False,
+        chunk_size: int = 50,
+        sample_size: int = None,
+        seed: int = None,
+        executor: Executor = None,
+        on_progress: Callable[[dict], None] = None,
+        ) -> jobs.JobHandle:
+        """
+        Run `profile` as a background job (see `BeeDiscovery.submit_job`) and return its handle.
+        Profiles are stored a chunk of `chunk_size` columns at a time, so a cancelled job keeps the chunks it finished.
+
+        >>> job = students.profile_job(sample_size=100_000, on_progress=print)
+        """
+        fields = list(fields) if fields is not None else list(self.fields)
+
+        return self.beediscovery.submit_job(
+            _profile_job,
+            args=(self.table, [(x.id, x.db_name) for x in fields]),
+            kwargs=dict(refresh=refresh, approximate=approximate, top_k=top_k, chunk_size=chunk_size,
+                        sample_size=sample_size, seed=seed),
+            kind='profile',
+            dataset=self,
+            executor=executor,
+            on_progress=on_progress,
+            )
+
+    def _fields_to_profile(self, fields: List["DataField"], refresh: bool,
+                           exact: bool = True) -> tuple[List["DataField"], dict, dict]:
+        """
+        Return the `fields` which have no current profile (or all of them, if `refresh`), with the table's change
+        record and the mergeable states of those which can be brought up to date incrementally (see `_profile_plan`).
+        """
+        session = self.beediscovery._session
+        session.flush()
+        change, to_profile, mergeable = _profile_plan(
+            session, self.table, [(x.id, x.db_name) for x in fields], refresh, exact=exact)
+
+        to_profile = {x[0] for x in to_profile}
+        for field in fields:
+            # e.g. profiled by a background job after this session had found no profile.
+            if field.id not in to_profile and sa_inspect(field).attrs.profile.loaded_value is None:
+                session.expire(field, ['profile'])
+
+        return [x for x in fields if x.id in to_profile], change, mergeable
+
+    def _store_profiles(self, fields: List["DataField"], stats: dict[str, dict], change: dict = None):
+        """
+        Replace the stored DataFieldProfiles of `fields` with the computed `stats` (keyed by db_name), computed
+        at the table's `change` record.
+        """
+        session = self.beediscovery._session
+
+        with session.begin_nested():
+            _replace_profiles(session, [(x.id, x.db_name) for x in fields], stats, change)
+
+        for field in fields:
+            session.expire(field, ['profile'])
+
+    def count_job(self, executor: Executor = None, on_progress: Callable[[dict], None] = None) -> jobs.JobHandle:
+        """
+        Run `refresh_row_count` as a background job (see `BeeDiscovery.submit_job`) and return its handle.
+        """
+        return self.beediscovery.submit_job(
+            _count_job, args=([self.table],), kind='count', dataset=self, executor=executor, on_progress=on_progress,
+            )
+
+
+
 class DataField(SQLModel, table=True):
     __tablename__ = "__beed_datafield"
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -281,7 +762,7 @@ class DataField(SQLModel, table=True):
     roles: OptionedList["DataRole"] = Relationship(back_populates="fields", link_model=DataFieldRoleLink,
     sa_relationship_kwargs={
             # 'cascade': 'all, delete-orphan', 
-            'lazy':'joined', 
+            'lazy':'selectin', 
             'collection_class': lambda: OptionedList(
                 optionspath='_sa_adapter.owner_state.object.roles_available',
                 parentpath='_sa_adapter.owner_state.object'),
@@ -289,6 +770,11 @@ class DataField(SQLModel, table=True):
             )
     
 
+    #: Column statistics computed by `Dataset.profile()`, stored in a companion table.
+    profile: Optional["DataFieldProfile"] = Relationship(back_populates="field",
+        sa_relationship_kwargs={'uselist': False, 'cascade': 'all, delete-orphan'},
+        )
+
     #: the same 'field_roles'->'role' proxy as in the basic dictionary example.
     #: This maps the Role_Value to the Role Name
     #: _r:  List["DataRole"] = association_proxy(
@@ -306,22 +792,31 @@ class DataField(SQLModel, table=True):
         """
         Return the list of DataRoles which can be applied to this DataField.
         """
-        available = self.dataset.roles_available.copy()
-        available.extend([x for x in self.roles if x not in available])
+        available = self.dataset.roles_available
+        available_ids = {x.id for x in available}
+        available.extend([x for x in self.roles if x.id not in available_ids])
 
         return available
     
 
+    @property
+    def profile_generation(self) -> int | None:
+        """
+        The generation of the Dataset's table (see `Dataset.generation`) which this DataField's profile was computed
+        at, or None if it has none, or was profiled before changes were tracked.
+        """
+        bee = self.dataset.beediscovery if self.dataset is not None else None
+        if bee is None or self.id is None or not bee._has_table(DataFieldProfileState.__tablename__):
+            return None
+        state = bee._session.get(DataFieldProfileState, self.id)
+        return state.generation if state else None
+
     def first_nonblank(self, n:int=1):
         """
         Return the first n non-blank values in the field.
+        To preview many fields at once use `Dataset.preview_nonblank`, which reads them all in one scan.
         """
-        results = self.dataset.t.rows_where(
-            f'{self.db_name} IS NOT NULL AND {self.db_name} != ""', 
-            select=self.db_name,
-            limit=n)
-
-        return [x[self.db_name] for x in results]
+        return profiling.first_nonblank(self.dataset.beediscovery.db.conn, self.dataset.table, [self.db_name], n)[self.db_name]
 
 
     @validates("roles")
@@ -333,7 +828,6 @@ class DataField(SQLModel, table=True):
         Otherwise, do nothing and we'll fix it later when the object is
         put into a Session.
         """
-        print(F"validating the 'role', changed to {key, value, type(value)}")
         logger.debug(F"validating the 'role', changed to {key, value, type(value)}")
         
         sess = object_session(self)
@@ -352,6 +846,234 @@ class DataField(SQLModel, table=True):
         return f"DataField: {self.name}, in dataset {self.dataset.name if self.dataset else ''}" + (f" with role(s): {[x.name for x in self.roles]}" if self.roles else "")
         
 
+class DataFieldProfile(SQLModel, table=True):
+    """
+    Column statistics for a DataField, as computed by `Dataset.profile()`.
+    """
+    __tablename__ = "__beed_datafieldprofile"
+    field_id: Optional[int] = Field(default=None, foreign_key="__beed_datafield.id", primary_key=True)
+    field: Optional[DataField] = Relationship(back_populates="profile")
+
+    row_count: Optional[int]
+    null_count: Optional[int]
+    #: values which are empty or whitespace-only strings
+    blank_count: Optional[int]
+    distinct_count: Optional[int]
+    #: True if `distinct_count` is a HyperLogLog or sample-based estimate rather than an exact count.
+    distinct_is_approximate: bool = Field(default=False)
+
+    #: True if the profile was computed from a sample of rows, in which case counts are estimates for the whole table.
+    is_approximate: bool = Field(default=False)
+    #: number of rows read for a sampled profile.
+    sample_size: Optional[int]
+    #: 95% margin of error of `row_count`.
+    row_count_error: Optional[int]
+    null_ratio: Optional[float]
+    #: 95% margin of error of `null_ratio`.
+    null_ratio_error: Optional[float]
+    #: bounds on `distinct_count`, when it is a sample-based estimate.
+    distinct_low: Optional[int]
+    distinct_high: Optional[int]
+
+    min_value: Optional[str]
+    max_value: Optional[str]
+    min_length: Optional[int]
+    max_length: Optional[int]
+    avg_length: Optional[float]
+
+    #: JSON list of [value, count] pairs for the most frequent values.
+    top_values: Optional[str]
+    inferred_type: Optional[str] = Field(default=None, index=True)
+
+    profiled_at: Optional[datetime]
+
+    def __repr__(self):
+        return f"DataFieldProfile: {self.field.name if self.field else self.field_id}, {self.inferred_type}, {self.distinct_count} distinct of {self.row_count}"
+
+
+class DataFieldProfileState(SQLModel, table=True):
+    """
+    What a DataFieldProfile was computed from: the generation and rowid high-water mark of the table at the time,
+    and the state (see `profiling.column_state`) that a profile of the rows appended since is merged into.
+    """
+    __tablename__ = "__beed_profilestate"
+    field_id: Optional[int] = Field(default=None, foreign_key="__beed_datafield.id", primary_key=True)
+
+    #: the `TableChanges.generation` of the Dataset's table which the profile is current at.
+    generation: int = Field(default=0)
+    #: the profile covers the rows up to this rowid.
+    max_rowid: int = Field(default=0)
+    #: JSON of the profile's mergeable state; None for sampled profiles, which are not updated incrementally.
+    state: Optional[str]
+    #: HyperLogLog registers, for profiles with approximate distinct counts.
+    registers: Optional[bytes]
+    updated_at: Optional[datetime]
+
+
+class TableChanges(SQLModel, table=True):
+    """
+    Change tracking for a data table: a generation number which advances each time the table is found to have
+    changed (see `Dataset.refresh_changes`), with its rowid high-water mark and row count at that generation.
+    Work done at a generation (profiles, value index postings) is brought up to date from the rows above its mark,
+    unless existing rows have been rewritten since.
+    """
+    __tablename__ = "__beed_changes"
+    table: str = Field(primary_key=True)
+    generation: int = Field(default=0)
+    #: the highest rowid at `generation`; rows above it were added since.
+    max_rowid: int = Field(default=0)
+    row_count: int = Field(default=0)
+    #: the latest generation at which rows at or below the previous high-water mark had been updated or deleted,
+    #: so work done at an earlier generation has to be redone in full.
+    rewritten_generation: int = Field(default=0)
+    rewritten_at: Optional[datetime]
+    #: updates and deletes of rows at or below `max_rowid` since `generation`, counted by triggers if `is_tracked`.
+    modified: int = Field(default=0)
+    #: True if triggers count updates and deletes; otherwise deletes are detected by counting, and updates are missed.
+    is_tracked: bool = Field(default=False)
+    #: a checksum of the last rows at or below `max_rowid`, for untracked tables: deleting the last row and then
+    #: inserting one reuses its rowid, which neither the mark nor the row count reveals.
+    top_checksum: Optional[str]
+    checked_at: Optional[datetime]
+
+
+class TableRowCount(SQLModel, table=True):
+    """
+    Cached row count of a data table, so that reprs and UI elements don't have to run `count(*)`.
+    """
+    __tablename__ = "__beed_rowcount"
+    table: str = Field(primary_key=True)
+    row_count: Optional[int]
+    #: when the table was last counted in full.
+    counted_at: Optional[datetime]
+    #: True if insert/delete triggers keep `row_count` current, otherwise it may be stale.
+    is_tracked: bool = Field(default=False)
+
+
+class Job(SQLModel, table=True):
+    """
+    A background job started with `BeeDiscovery.submit_job`: its state, latest progress and (partial) results.
+    The row is written by the job itself, from whichever thread or process runs it.
+    """
+    __tablename__ = jobs.JOB_TABLE
+    id: Optional[int] = Field(default=None, primary_key=True)
+    #: what the job does, e.g. 'profile', 'count', 'sync' or 'ingest'.
+    kind: str
+    #: the Dataset the job works on, if any.
+    dataset_id: Optional[int] = Field(default=None, index=True)
+    #: 'pending', 'running', 'done', 'failed' or 'cancelled'.
+    status: str = Field(default='pending', index=True)
+    #: set to ask a running job to stop, from this or any other process.
+    cancel_requested: bool = Field(default=False)
+
+    #: JSON of the latest progress report.
+    progress: Optional[str]
+    #: JSON of the result once done; until then, of the list of partial results.
+    result: Optional[str]
+    error: Optional[str]
+
+    created_at: Optional[datetime]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+    def __repr__(self):
+        return f"Job: {self.id}, {self.kind} ({self.status})"
+
+
+class RoleView(SQLModel, table=True):
+    """
+    A cross-dataset view of DataRoles created by `BeeDiscovery.role_view`, and the columns it was last built from.
+    """
+    __tablename__ = "__beed_roleview"
+    #: the name of the SQL view (or table, if materialized) in the database.
+    name: str = Field(primary_key=True)
+    #: JSON list of the role names, which are the view's columns after `dataset_id` and `row_id`.
+    role_names: str
+    #: True if the rows are copied into an indexed table, rather than selected by a SQL view.
+    materialized: bool = Field(default=False)
+    #: JSON of dataset id -> [table, {role name: column}], as of the last build.
+    sources: Optional[str]
+    built_at: Optional[datetime]
+
+    def __repr__(self):
+        return f"RoleView: {self.name}, {', '.join(json.loads(self.role_names))}{' (materialized)' if self.materialized else ''}"
+
+
+#: the prefix of the names of indexes proposed by `BeeDiscovery.advise_indexes`, kept apart from users' own.
+_INDEX_PREFIX = 'beed_idx_'
+
+
+class DataFieldIndex(SQLModel, table=True):
+    """
+    An index built on a data table column by `BeeDiscovery.build_indexes`, with timings of an equality lookup
+    on the column before and after it was built.
+    """
+    __tablename__ = "__beed_index"
+    #: the name of the index in the database.
+    name: str = Field(primary_key=True)
+    field_id: Optional[int] = Field(default=None, index=True)
+    table: str
+    column: str
+    #: why the index was proposed, e.g. "role EMAIL (unique), 98% distinct".
+    reason: Optional[str]
+
+    built_at: Optional[datetime]
+    #: seconds taken by CREATE INDEX.
+    build_seconds: Optional[float]
+    #: seconds taken by `SELECT count(*) ... WHERE column = ?` for a value in the column, before and after.
+    lookup_before: Optional[float]
+    lookup_after: Optional[float]
+
+    def __repr__(self):
+        timings = ''
+        if self.lookup_before is not None and self.lookup_after is not None:
+            timings = f", lookup {self.lookup_before * 1000:.1f} ms -> {self.lookup_after * 1000:.1f} ms"
+        return f"DataFieldIndex: {self.name} on {self.table}.{self.column}{timings}"
+
+
+class ValuePosting(SQLModel, table=True):
+    """
+    A posting of the value index (see the `value_index` module): the hash of a normalised value of an indexed role,
+    and the row it appears in. Clustered by hash, and indexed by dataset for overlaps.
+    """
+    __tablename__ = value_index.POSTINGS_TABLE
+    __table_args__ = (
+        Index(f'ix_{value_index.POSTINGS_TABLE}_dataset', 'dataset_id', 'hash', 'role_id'),
+        {'sqlite_with_rowid': False},
+        )
+    hash: int = Field(primary_key=True)
+    role_id: int = Field(primary_key=True)
+    dataset_id: int = Field(primary_key=True)
+    field_id: int = Field(primary_key=True)
+    row_id: int = Field(primary_key=True)
+
+
+class ValueIndexRole(SQLModel, table=True):
+    """
+    A DataRole whose values are kept in the value index, and how they are normalised before hashing.
+    """
+    __tablename__ = value_index.ROLES_TABLE
+    role_id: int = Field(primary_key=True)
+    #: one of `value_index.NORMALIZERS`.
+    normalizer: str = Field(default='text')
+    created_at: Optional[datetime]
+
+
+class ValueIndexSource(SQLModel, table=True):
+    """
+    A (DataField, DataRole) pair in the value index, and how far its table has been indexed.
+    """
+    __tablename__ = value_index.SOURCES_TABLE
+    field_id: int = Field(primary_key=True)
+    role_id: int = Field(primary_key=True)
+    dataset_id: int
+    normalizer: str
+    #: the highest rowid indexed so far; the next update reads only the rows after it.
+    max_rowid: int = Field(default=0)
+    postings: int = Field(default=0)
+    updated_at: Optional[datetime]
+
+
 @event.listens_for(Session, "transient_to_pending")
 def _validate_role(session, object_):
     """Receive the HasRole object when it gets attached to a Session to correct
@@ -360,7 +1082,6 @@ def _validate_role(session, object_):
     """
 
     if isinstance(object_, DataRole):  #
-        print(f"it's a DataRole: {object_}")
         logger.debug("it's a DataRole")
         object_: DataRole
         if object_.id is not None:
@@ -385,113 +1106,1714 @@ def _validate_role(session, object_):
 def _setup_role(session, role_object: DataRole):
     """Given a Session and a Role object, return
     the correct Role object from the database.
-    """
 
-    with session.no_autoflush:
-        return session.query(DataRole).filter_by(name=role_object.name).one() 
+    Roles already persistent in the session are returned as they are, and others are resolved by name through
+    the BeeDiscovery's role registry (see `BeeDiscovery.roles_by_name`), so validating a role assignment doesn't
+    run a query. A name missing from the registry is looked up in the database (e.g. a role inserted by another
+    connection), and raises NoResultFound if there is no such DataRole.
+    """
+    if role_object.id is not None and role_object in session:
+        return role_object
 
+    beediscovery = _session_beediscovery(session)
+    if beediscovery is None:
+        with session.no_autoflush:
+            return session.query(DataRole).filter_by(name=role_object.name).one()
 
+    registry = beediscovery.roles_by_name
+    role = registry.get(role_object.name)
+    if role is None:
+        with session.no_autoflush:
+            role = registry[role_object.name] = session.query(DataRole).filter_by(name=role_object.name).one()
+    return role
 
 
+def _primary_key(instance) -> int:
+    """
+    Return the id of a flushed instance from its identity key, which (unlike `instance.id`) doesn't
+    refresh an instance expired by a commit.
+    """
+    identity = sa_inspect(instance).identity
+    return identity[0] if identity is not None else instance.id
 
 
-class BeeDiscovery(SQLModel, table=True):
+def _first(value):
     """
-    The BeeDiscovery object is the main instance for an interactive data exploration session.
-    
-    it has a reference to the sqlite database that holds all of it's data and configurations.
-    
-    
+    Return the first item of a role index value: the DataField itself, or the first of a list of DataFields.
     """
-    __tablename__ = "__beediscovery"
+    return value[0] if isinstance(value, list) else value
 
 
-    @classmethod
-    def load(cls, beed_file: str):
-        """
-        Primary entryway to creating new BeeDiscovery projects.
-        >>> bdb = BeeDiscovery.load('name_of_file.beedb')
-        """
-        
-        engine = create_engine(f'sqlite:///{beed_file}')
-        session = Session(engine)
-        
-        id_ = dict()
-        id_['id'] = 1
-            
-        try:
-            SQLModel.metadata.create_all(engine)
-            instance = session.query(cls).filter_by(**id_).one()
+#: operators for the `profile` criteria of `BeeDiscovery.assign_roles` rules.
+_RULE_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda column, values: column.in_(values),
+}
 
-        except NoResultFound:
-            try:
-                with session.begin_nested():
-                    instance = cls(beed_file,
-                                   engine=engine, 
-                                   session=session
-                                  )
-                    session.add(instance)
-                session.commit()
 
-            except IntegrityError:
-                instance = session.query(cls).filter_by(**id_).one()
-                    
-        instance._engine = engine
-        instance._session = session
-        return instance
-    
-    
-    id: Optional[int] = Field(default=1, primary_key=True)
-    name: Optional[str] = Field(default=None)
-    beed_file_path: Optional[str]
-    test_option: Optional[str]
-    
-    datasets: List[Dataset] = Relationship(back_populates="beediscovery", 
-                                             sa_relationship_kwargs={'cascade': 'all, delete-orphan', 'lazy':'joined'}
-                                            )
-    roles: List[DataRole] = Relationship(back_populates="beediscovery", 
-                                             sa_relationship_kwargs={'lazy':'joined'}
-                                            )
+def _role_rule_conditions(rule: dict) -> list:
+    """
+    Return the SQL conditions on DataField (and DataFieldProfile, Dataset) for a `BeeDiscovery.assign_roles` rule.
+    """
+    conditions = list()
+    for key in ('name', 'db_name', 'db_type'):
+        if rule.get(key) is not None:
+            conditions.append(getattr(DataField, key).regexp_match(rule[key]))
 
-    
-    
-    
-    class Config:
-        extra = Extra.allow # or 'allow' str
-    
-    def __init__(self, beed_file: str = None, name: str = None, engine=None, session: Session=None):
-        
-        super().__init__()
+    for key, test in (rule.get('profile') or dict()).items():
+        if key not in DataFieldProfile.__fields__:
+            raise ValueError(f"Unknown profile statistic {key!r} in role rule {rule}")
+        op, value = test if isinstance(test, tuple) else ('==', test)
+        if op not in _RULE_OPERATORS:
+            raise ValueError(f"Unknown operator {op!r} in role rule {rule}, expected one of {list(_RULE_OPERATORS)}")
+        conditions.append(_RULE_OPERATORS[op](getattr(DataFieldProfile, key), value))
 
-        self.id : int = 1
-        self.name: str = name if name else beed_file
-        self.beed_file_path: str = beed_file
-        
-        self._engine = create_engine(f'sqlite:///{self.beed_file_path}')
-        self._session = Session(self._engine)
-        
-        self.__init_on_load()
-        
-    @reconstructor
-    def __init_on_load(self):
-        self.__sqlite_utils_db = Database(self.beed_file_path)
+    if rule.get('datasets') is not None:
+        conditions.append(Dataset.name.in_(rule['datasets']))
 
+    return conditions
 
-    def __repr__(self):
-        return f"BeeDiscovery: {self.beed_file_path}\n" + "\n".join([str(x) for x in self.datasets])
-    @property
-    def db(self):
-        return self.__sqlite_utils_db
 
-    def dataset(self, dataset_name: str, **kwargs) -> Dataset:
-        """
-        # TODO: Fix docstring
-        Return a table object, optionally configured with default options.
-        See :ref:`reference_db_table` for option details.
-        :param table_name: Name of the table
-        """
+def _session_beediscovery(session) -> Optional["BeeDiscovery"]:
+    """
+    Return the BeeDiscovery loaded in `session`, if any, without a query.
+    """
+    if session is None:
+        return None
+    return session.identity_map.get(identity_key(BeeDiscovery, 1))
 
-        with self._session.begin_nested():
+
+def _diff_columns(columns: List[Column], fields: List[tuple]):
+    """
+    Match table columns against existing DataFields on (db_name, db_is_primary_key).
+
+    `fields` is a list of (id, db_name, db_is_primary_key) tuples, so this works on plain values
+    and can be handed to a process pool.
+    Returns a tuple of (matched DataField ids, extra DataField ids, columns without a DataField).
+    Columns matching more than one DataField are ambiguous: they are not created, and the DataFields are reported as extra.
+    """
+
+    existing = defaultdict(list)
+    for field_id, db_name, is_pk in fields:
+        existing[(db_name, bool(is_pk))].append(field_id)
+
+    matched_ids = list()
+    new_columns = list()
+    for column in columns:
+        field_ids = existing.get((column.name, bool(column.is_pk)), [])
+        if len(field_ids) == 1:
+            matched_ids.append(field_ids[0])
+        elif not field_ids:
+            new_columns.append(column)
+
+    matched = set(matched_ids)
+    extra_ids = [field_id for field_id, _, _ in fields if field_id not in matched]
+
+    return matched_ids, extra_ids, new_columns
+
+
+def _bulk_create_datafields(session, new_columns: dict[int, List[Column]], chunk_size: int = 5000) -> List["DataField"]:
+    """
+    Insert a DataField for every column in `new_columns` (keyed by Dataset id) with a single executemany,
+    and return the new DataField objects, read back by their (dataset_id, db_name) keys `chunk_size` at a time.
+    Only ids above the largest one before the insert are read back, so existing DataFields with the same keys
+    (e.g. duplicated by an earlier sync) aren't returned as new.
+    """
+
+    mappings = [
+        dict(
+            dataset_id=dataset_id,
+            name=column.name,
+            db_name=column.name,
+            db_type=column.type,
+            db_default_value=column.default_value,
+            db_is_primary_key=bool(column.is_pk),
+            is_json=False,
+            )
+        for dataset_id, columns in new_columns.items()
+        for column in columns
+    ]
+    if not mappings:
+        return []
+
+    max_id = session.exec(select(func.max(DataField.id))).one() or 0
+    session.bulk_insert_mappings(DataField, mappings)
+
+    # by key rather than by id alone, as rows inserted meanwhile by another connection could take ids above ours.
+    keys = [(x['dataset_id'], x['db_name']) for x in mappings]
+    created = list()
+    for start in range(0, len(keys), chunk_size):
+        statement = select(DataField).where(
+            DataField.id > max_id, tuple_(DataField.dataset_id, DataField.db_name).in_(keys[start:start + chunk_size]))
+        created.extend(session.exec(statement).unique().all())
+    return sorted(created, key=lambda x: x.id)
+
+
+def _replace_profiles(session, fields: List[tuple[int, str]], stats: dict[str, dict], change: dict = None):
+    """
+    Replace the stored DataFieldProfiles of `fields` ((id, db_name) pairs) with the computed `stats` (keyed by db_name).
+    With the `change` record of the table they were computed at (see `_record_changes`), their states are stored too.
+    """
+    now = datetime.now()
+    columns = DataFieldProfile.__fields__.keys()
+    ids = [x[0] for x in fields]
+
+    rows = list()
+    for field_id, db_name in fields:
+        values = {k: v for k, v in stats[db_name].items() if k in columns}
+        for key in ('min_value', 'max_value'):
+            if values.get(key) is not None:
+                values[key] = str(values[key])
+        rows.append(dict(values, field_id=field_id, profiled_at=now))
+
+    session.execute(delete(DataFieldProfile).where(DataFieldProfile.field_id.in_(ids)))
+    session.bulk_insert_mappings(DataFieldProfile, rows)
+
+    if change is not None:
+        session.execute(delete(DataFieldProfileState).where(DataFieldProfileState.field_id.in_(ids)))
+        session.bulk_insert_mappings(DataFieldProfileState, [
+            dict(
+                field_id=field_id,
+                generation=change['generation'],
+                max_rowid=change['max_rowid'],
+                state=json.dumps(stats[db_name]['state']) if 'state' in stats[db_name] else None,
+                registers=stats[db_name].get('registers'),
+                updated_at=now,
+                )
+            for field_id, db_name in fields
+            ])
+
+
+def _record_changes(session, table: str, exact: bool = True) -> dict | None:
+    """
+    Compare `table` with its change record, and advance its generation if rows have been added, updated or deleted
+    since. Returns the record as a dict, with the number of `new_rows` above the previous high-water mark and whether
+    existing rows were found `rewritten`, or None if the table doesn't exist. The cached row count is updated too.
+
+    If the table is tracked (see `Dataset.track_changes`) only the new rows are counted, unless the triggers saw
+    updates or deletes. Otherwise the whole table is counted, and fewer rows at or below the mark than before means
+    deletes. A checksum of the last `_TOP_ROWS` rows at or below the mark also catches rows deleted from the end
+    of the table and replaced (SQLite reuses their rowids); other updates in place are not seen.
+
+    Without `exact`, an untracked table is only compared by its max(rowid) with the mark: appended rows are counted
+    by rowid, but neither the whole table nor the checksums are read, so deletes are left for the next exact check.
+    """
+    if not _has_tables(session, table):
+        return None
+
+    quoted = quote_identifier(table)
+    with session.begin_nested():
+        record = session.get(TableChanges, table) or TableChanges(table=table)
+        max_rowid = session.execute(text(f"SELECT max(rowid) FROM {quoted}")).scalar() or 0
+        quick = not exact and not record.is_tracked and record.generation > 0
+        if quick and max_rowid == record.max_rowid:
+            return _change_dict(record, new_rows=0, rewritten=False)
+
+        new_rows = session.execute(
+            text(f"SELECT count(*) FROM {quoted} WHERE rowid > :mark"), dict(mark=record.max_rowid)).scalar()
+
+        top_checksum = None
+        if quick or (record.is_tracked and not record.modified):
+            row_count, rewritten = record.row_count + new_rows, False
+        else:
+            row_count = session.execute(text(f"SELECT count(*) FROM {quoted}")).scalar()
+            rewritten = bool(record.modified) or row_count - new_rows != record.row_count
+            if not record.is_tracked:
+                previous = _top_checksum(session, quoted, record.max_rowid)
+                rewritten = rewritten or (record.top_checksum is not None and previous != record.top_checksum)
+                top_checksum = previous if max_rowid == record.max_rowid else _top_checksum(session, quoted, max_rowid)
+
+        now = datetime.now()
+        if rewritten or max_rowid != record.max_rowid or record.generation == 0:
+            record.generation += 1
+            if rewritten:
+                record.rewritten_generation = record.generation
+                record.rewritten_at = now
+        record.max_rowid, record.row_count, record.modified = max_rowid, row_count, 0
+        record.top_checksum = top_checksum
+        if not quick:
+            record.checked_at = now
+            _store_row_count(session, table, row_count, now)
+        session.add(record)
+
+    return _change_dict(record, new_rows=new_rows, rewritten=rewritten)
+
+
+def _change_dict(record: "TableChanges", new_rows: int, rewritten: bool) -> dict:
+    return dict(table=record.table, generation=record.generation, max_rowid=record.max_rowid,
+                row_count=record.row_count, new_rows=new_rows, rewritten=rewritten,
+                rewritten_generation=record.rewritten_generation)
+
+
+#: the number of rows below a table's high-water mark whose checksum is compared by `_record_changes`.
+_TOP_ROWS = 16
+
+
+def _top_checksum(session, quoted_table: str, max_rowid: int) -> str:
+    """
+    Return a checksum of the rowids and values of the last `_TOP_ROWS` rows of a table at or below `max_rowid`.
+    """
+    rows = session.execute(text(
+        f"SELECT rowid, * FROM {quoted_table} WHERE rowid <= :mark ORDER BY rowid DESC LIMIT {_TOP_ROWS}"),
+        dict(mark=max_rowid)).all()
+    return hashlib.blake2b(repr([tuple(x) for x in rows]).encode(), digest_size=16).hexdigest()
+
+
+def _store_row_count(session, table: str, count: int, counted_at: datetime = None):
+    row_count = session.get(TableRowCount, table) or TableRowCount(table=table)
+    row_count.row_count = count
+    row_count.counted_at = counted_at or datetime.now()
+    session.add(row_count)
+
+
+def _profile_plan(session, table: str, fields: List[tuple[int, str]], refresh: bool = False,
+                  exact: bool = True) -> tuple[dict | None, list, dict]:
+    """
+    Record the changes to `table` and return (change, fields, mergeable): its change record (see `_record_changes`),
+    the `fields` ((id, db_name) pairs) to profile, and field id -> (max_rowid, state, registers) of those which can be
+    brought up to date from the rows added since their profile.
+
+    Fields are profiled if they have no profile (or all of them, with `refresh`), or if their profile is from an
+    earlier generation: in full if existing rows have been rewritten since, otherwise from the new rows.
+    Profiles without a mergeable state (sampled, or stored before changes were tracked) are kept until `refresh`.
+    Fields whose column has been dropped from the table are skipped with a warning, until the Dataset is synced.
+    Without `exact` (for sampled profiles) the changes are only checked by rowid (see `_record_changes`).
+    """
+    change = _record_changes(session, table, exact=exact)
+    if change is None:
+        return None, list(), dict()
+
+    columns = set(session.execute(text("SELECT name FROM pragma_table_info(:table)"), dict(table=table)).scalars())
+    stale = [db_name for _, db_name in fields if db_name not in columns]
+    if stale:
+        logger.warning(f"Not profiling fields of {table} whose columns no longer exist (sync the Dataset): {stale}")
+        fields = [x for x in fields if x[1] in columns]
+
+    ids = [x[0] for x in fields]
+    profiled = set(session.exec(select(DataFieldProfile.field_id).where(DataFieldProfile.field_id.in_(ids))).all())
+    states = {
+        x.field_id: x
+        for x in session.exec(select(DataFieldProfileState).where(DataFieldProfileState.field_id.in_(ids))).all()
+        }
+
+    to_profile, mergeable = list(), dict()
+    for field_id, db_name in fields:
+        state = states.get(field_id)
+        if not refresh and field_id in profiled:
+            if state is None or state.state is None or state.generation >= change['generation']:
+                continue
+            if state.generation >= change['rewritten_generation']:
+                mergeable[field_id] = (state.max_rowid, json.loads(state.state), state.registers)
+        to_profile.append((field_id, db_name))
+
+    return change, to_profile, mergeable
+
+
+def _profile_stats(conn, table: str, fields: List[tuple[int, str]], mergeable: dict[int, tuple], change: dict,
+                   approximate: bool = False, top_k: int = 5, chunk_size: int = 50, sample_size: int = None,
+                   seed: int = None) -> dict[str, dict]:
+    """
+    Profile `fields` ((id, db_name) pairs) of `table` up to the high-water mark of `change`: those with a `mergeable`
+    state (see `_profile_plan`) from the rows after its mark, merged into it, and the others in full.
+    Returns db_name -> statistics, as `profiling.profile_table`.
+    """
+    max_rowid = change['max_rowid']
+    stats = dict()
+
+    full = [db_name for field_id, db_name in fields if field_id not in mergeable]
+    if full:
+        stats.update(profiling.profile_table(
+            conn, table, full, approximate=approximate, top_k=top_k, chunk_size=chunk_size, sample_size=sample_size,
+            seed=seed, max_rowid=max_rowid,
+            ))
+
+    # fields profiled at the same mark, with the same kind of distinct count, are brought up to date together.
+    groups = defaultdict(list)
+    for field_id, db_name in fields:
+        if field_id in mergeable:
+            after_rowid, state, registers = mergeable[field_id]
+            groups[after_rowid, state['distinct']].append((db_name, state, registers))
+
+    for (after_rowid, distinct), items in groups.items():
+        names = [x[0] for x in items]
+        delta = profiling.profile_table(conn, table, names, approximate=distinct == 'hll', top_k=top_k,
+                                        chunk_size=chunk_size, after_rowid=after_rowid, max_rowid=max_rowid)
+        shared = dict()
+        if distinct == 'exact':
+            shared = profiling.shared_distinct(conn, table, names, after_rowid, max_rowid, chunk_size)
+        for db_name, state, registers in items:
+            stats[db_name] = profiling.merge_profile(state, delta[db_name], top_k, shared.get(db_name), registers)
+
+    return stats
+
+
+# Background jobs (see `BeeDiscovery.submit_job`). These take plain values, not ORM objects,
+# so they can run in a process pool, and open their own sessions on the job's connections.
+
+def _profile_job(ctx: jobs.JobContext, table: str, fields: List[tuple[int, str]], refresh: bool = False,
+                 chunk_size: int = 50, **options) -> dict:
+    """
+    Profile those of `fields` ((id, db_name) pairs) of `table` which have no current profile (or all, with `refresh`),
+    as `Dataset.profile`, storing the profiles of each chunk of columns as it completes.
+    """
+    with ctx.session() as session:
+        change, fields, mergeable = _profile_plan(
+            session, table, fields, refresh, exact=refresh or options.get('sample_size') is None)
+
+    done = 0
+    for start in range(0, len(fields), chunk_size):
+        chunk = fields[start:start + chunk_size]
+        stats = _profile_stats(ctx.conn, table, chunk, mergeable, change, chunk_size=chunk_size, **options)
+        with ctx.session() as session:
+            _replace_profiles(session, chunk, stats, change)
+
+        done += len(chunk)
+        ctx.partial([x[0] for x in chunk])
+        ctx.progress(dict(table=table, fields=done, fields_total=len(fields)))
+
+    return dict(table=table, profiled=done, incremental=len(mergeable), generation=change and change['generation'])
+
+
+def _count_job(ctx: jobs.JobContext, tables: List[str]) -> dict[str, int]:
+    """
+    Count the rows of `tables` and store the counts in the row count metadata table, recording their changes
+    (see `_record_changes`).
+    """
+    counts = dict()
+    for table in tables:
+        with ctx.session() as session:
+            change = _record_changes(session, table)
+            counts[table] = change['row_count'] if change is not None else 0
+
+        ctx.partial({table: counts[table]})
+        ctx.progress(dict(tables=len(counts), tables_total=len(tables)))
+
+    return counts
+
+
+def _sync_job(ctx: jobs.JobContext, create_missing: bool = False) -> dict:
+    """
+    Run `BeeDiscovery.sync_all` in the job's own session, and return a summary of it, with the datasets by id.
+    """
+    with ctx.session() as session:
+        report = _job_beediscovery(ctx, session).sync_all(create_missing=create_missing)
+
+        return dict(
+            datasets={
+                dataset_id: dict(name=x['name'], table=x['table'], **_sync_summary(x))
+                for dataset_id, x in report['datasets'].items()
+                },
+            untracked_tables=report['untracked_tables'],
+            )
+
+
+def _job_beediscovery(ctx: jobs.JobContext, session) -> "BeeDiscovery":
+    bee = session.get(BeeDiscovery, 1)
+    bee._engine = ctx.engine
+    bee._session = session
+    return bee
+
+
+def _sync_summary(report: dict) -> dict:
+    """
+    Return the field names of a `Dataset.sync_columns` report, which (unlike the DataFields) can leave a job.
+    """
+    return dict(
+        matched=len(report['matched_datafields']),
+        extra=[field.name for field in report['extra_datafields']],
+        created=[field.name for field in report['created']],
+        )
+
+
+def _ingest_job(ctx: jobs.JobContext, table: str, source: str, format: str, dataset_id: int = None,
+                batch_size: int = 10_000, infer_rows: int = 1000, transaction_rows: int = 500_000,
+                reader_options: dict = None) -> dict:
+    """
+    Stream `source` into `table` (as `Dataset.ingest`), then sync the DataFields of Dataset `dataset_id` only.
+    """
+    batches = ingest.READERS[format](source, batch_size, **(reader_options or dict()))
+    report = ingest.load_batches(
+        ctx.conn, table, batches, infer_rows=infer_rows, transaction_rows=transaction_rows, progress=ctx.progress,
+        )
+    with ctx.session() as session:
+        # held, as the session only keeps a weak reference to the BeeDiscovery which the Dataset would load again.
+        bee = _job_beediscovery(ctx, session)
+        dataset = session.get(Dataset, dataset_id)
+        report['sync'] = _sync_summary(dataset.sync_columns()) if dataset is not None else None
+        report['changes'] = _record_changes(session, table)
+    report['value_index'] = _value_index_job(ctx, tables=[table])
+    return report
+
+
+
+
+
+
+def _index_job(ctx: jobs.JobContext, indexes: List[tuple[str, int, str, str, str]], measure: bool = True) -> List[dict]:
+    """
+    Build `indexes` ((name, field id, table, column, reason) tuples) one at a time, recording each in the index
+    metadata table as it completes. With `measure`, an equality lookup of a value in the column is timed before and after.
+    Raises ValueError if an index of the same name exists which wasn't built by this job on the same column, as
+    recording it would let `BeeDiscovery.drop_indexes` drop someone else's index.
+    """
+    results = list()
+    for name, field_id, table, column, reason in indexes:
+        existing = _index_definition(ctx.conn, name)
+        if existing is not None:
+            with ctx.session() as session:
+                recorded = session.get(DataFieldIndex, name)
+            if existing != (table, [column]) or recorded is None:
+                raise ValueError(f"An index named {name} already exists on {existing[0]} {existing[1]}, "
+                                 f"which wasn't built by build_indexes on {table} [{column!r}]")
+
+        probe = _index_probe(ctx.conn, table, column) if measure else None
+        before = _time_lookup(ctx.conn, table, column, probe) if probe is not None else None
+
+        start = time.perf_counter()
+        ctx.conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_identifier(name)} "
+                         f"ON {quote_identifier(table)} ({quote_identifier(column)})")
+        ctx.conn.commit()
+        build_seconds = time.perf_counter() - start
+
+        after = _time_lookup(ctx.conn, table, column, probe) if probe is not None else None
+        with ctx.session() as session:
+            session.merge(DataFieldIndex(
+                name=name, field_id=field_id, table=table, column=column, reason=reason, built_at=datetime.now(),
+                build_seconds=build_seconds, lookup_before=before, lookup_after=after,
+                ))
+
+        results.append(dict(name=name, build_seconds=build_seconds, lookup_before=before, lookup_after=after))
+        ctx.partial(name)
+        ctx.progress(dict(index=name, indexes=len(results), indexes_total=len(indexes)))
+
+    return results
+
+
+def _index_definition(conn, name: str) -> tuple[str, List[str]] | None:
+    """
+    Return the table and columns of the index `name`, or None if there is no such index.
+    """
+    row = conn.execute("SELECT tbl_name FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone()
+    if row is None:
+        return None
+    columns = [x[0] for x in conn.execute("SELECT name FROM pragma_index_info(?) ORDER BY seqno", (name,))]
+    return row[0], columns
+
+
+def _index_probe(conn, table: str, column: str):
+    """
+    Return a non-null value from about the middle of `column`, to time lookups with (or None if it is all NULL).
+    """
+    table, column = quote_identifier(table), quote_identifier(column)
+    row = conn.execute(
+        f"SELECT {column} FROM {table} WHERE rowid >= (SELECT (min(rowid) + max(rowid)) / 2 FROM {table}) "
+        f"AND {column} IS NOT NULL LIMIT 1"
+        ).fetchone() or conn.execute(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def _time_lookup(conn, table: str, column: str, value) -> float:
+    start = time.perf_counter()
+    conn.execute(f"SELECT count(*) FROM {quote_identifier(table)} WHERE {quote_identifier(column)} = ?", (value,)).fetchone()
+    return time.perf_counter() - start
+
+
+def _value_index_plan(session, tables: List[str] = None) -> tuple[list, list]:
+    """
+    Compare the (field, role) pairs which should be in the value index with those indexed so far, and return
+    (removals, tasks): (field_id, role_id, dataset_id) sources to remove, because the field lost the role, the
+    normaliser changed or rows of the table were found rewritten since it was indexed (checked by rowid only, see
+    `_record_changes`; `Dataset.refresh_changes` checks for deletes), and
+    (table, column, role_id, dataset_id, field_id, normalizer, after_rowid) sources to update.
+    With `tables`, only the Datasets of those tables are compared.
+    """
+    statement = (
+        select(DataField.id, DataFieldRoleLink.role_id, Dataset.id, Dataset.table, DataField.db_name, ValueIndexRole.normalizer)
+        .join(DataFieldRoleLink, DataFieldRoleLink.field_id == DataField.id)
+        .join(ValueIndexRole, ValueIndexRole.role_id == DataFieldRoleLink.role_id)
+        .join(Dataset, Dataset.id == DataField.dataset_id)
+        )
+    existing_statement = select(ValueIndexSource)
+    if tables is not None:
+        statement = statement.where(Dataset.table.in_(tables))
+        existing_statement = existing_statement.where(
+            ValueIndexSource.dataset_id.in_(select(Dataset.id).where(Dataset.table.in_(tables))))
+
+    existing = {(x.field_id, x.role_id): x for x in session.exec(existing_statement).all()}
+    present = set(session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+
+    removals, tasks = list(), list()
+    wanted = set()
+    rewritten_at = dict()
+    for field_id, role_id, dataset_id, table, column, normalizer in session.execute(statement).all():
+        wanted.add((field_id, role_id))
+        if table in present and table not in rewritten_at:
+            _record_changes(session, table, exact=False)
+            rewritten_at[table] = session.get(TableChanges, table).rewritten_at
+
+        source = existing.get((field_id, role_id))
+        if source is not None and (source.normalizer != normalizer or (
+                rewritten_at.get(table) is not None and (source.updated_at or datetime.min) < rewritten_at[table])):
+            removals.append((field_id, role_id, dataset_id))
+            source = None
+        if table in present:
+            tasks.append((table, column, role_id, dataset_id, field_id, normalizer, source.max_rowid if source else 0))
+
+    removals += [(x.field_id, x.role_id, x.dataset_id) for key, x in existing.items() if key not in wanted]
+    return removals, tasks
+
+
+def _update_value_index(conn, removals: list, tasks: list, window: int = 100_000,
+                        progress: Callable[[dict], None] = None) -> dict:
+    """
+    Apply a `_value_index_plan` on a sqlite3 connection.
+    """
+    removed = sum(value_index.remove_source(conn, *x) for x in removals)
+    added = value_index.index_sources(conn, tasks, window=window, progress=progress)
+    return dict(sources=len(tasks), postings_added=sum(added.values()), sources_removed=len(removals),
+                postings_removed=removed)
+
+
+def _value_index_job(ctx: jobs.JobContext, tables: List[str] = None, window: int = 100_000) -> dict:
+    """
+    Bring the value index up to date (see `BeeDiscovery.update_value_index`).
+    """
+    with ctx.session() as session:
+        if not _has_tables(session, ValueIndexRole.__tablename__):
+            return dict(sources=0, postings_added=0, sources_removed=0, postings_removed=0)
+        removals, tasks = _value_index_plan(session, tables)
+    return _update_value_index(ctx.conn, removals, tasks, window, ctx.progress)
+
+
+def _has_tables(session, *tables: str) -> bool:
+    present = set(session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+    return all(x in present for x in tables)
+
+
+def _row_count_label(row_count: int | None, is_tracked: bool, counted_at: datetime | None) -> str:
+    if row_count is None:
+        return '?'
+    if is_tracked or counted_at is None:
+        return str(row_count)
+    return f"{row_count} (counted {counted_at:%Y-%m-%d %H:%M}, may be stale)"
+
+
+#: engines for files opened with `BeeDiscovery.open_readonly`, shared process-wide and keyed by (path, immutable).
+_readonly_engines: dict[tuple[str, bool], Engine] = dict()
+
+
+class BeeDiscovery(SQLModel, table=True):
+    """
+    The BeeDiscovery object is the main instance for an interactive data exploration session.
+    
+    it has a reference to the sqlite database that holds all of it's data and configurations.
+    
+    
+    """
+    __tablename__ = "__beediscovery"
+
+
+    @classmethod
+    def load(cls, beed_file: str, profile: str = 'interactive'):
+        """
+        Primary entryway to creating new BeeDiscovery projects.
+        `profile` selects the connection tuning, one of `connections.PROFILES`: 'interactive', 'bulk_load' or 'read_only_review'.
+        >>> bdb = BeeDiscovery.load('name_of_file.beedb')
+        """
+        
+        if profile == 'read_only_review':
+            return cls.open_readonly(beed_file)
+
+        engine = create_beed_engine(f'sqlite:///{beed_file}', profile)
+        session = Session(engine)
+        
+        id_ = dict()
+        id_['id'] = 1
+            
+        try:
+            SQLModel.metadata.create_all(engine)
+            instance = session.query(cls).filter_by(**id_).one()
+
+        except NoResultFound:
+            try:
+                with session.begin_nested():
+                    instance = cls(beed_file,
+                                   engine=engine, 
+                                   session=session
+                                  )
+                    session.add(instance)
+                session.commit()
+
+            except IntegrityError:
+                instance = session.query(cls).filter_by(**id_).one()
+                    
+        instance._engine = engine
+        instance._session = session
+        return instance
+    
+    
+    @classmethod
+    def open_readonly(cls, beed_file: str, immutable: bool = False):
+        """
+        Open a .beedb file for browsing only, e.g. by several reviewers sharing one case file.
+
+        The file is opened with a `mode=ro` URI (or `immutable=1`, if nothing will write to it while it is open,
+        which also skips file locking) and the 'read_only_review' connection profile.
+        No DDL is run and no BeeDiscovery row is inserted, so opening never takes a write lock.
+        Every read-only BeeDiscovery for the same file in this process shares one engine, connection pool and
+        statement cache; each gets its own session.
+        >>> bdb = BeeDiscovery.open_readonly('name_of_file.beedb')
+        """
+
+        path = pathlib.Path(beed_file).resolve()
+        if not path.exists():
+            raise FileNotFoundError(f"{beed_file} does not exist, and can't be created in read-only mode")
+
+        key = (str(path), immutable)
+        if key not in _readonly_engines:
+            options = 'mode=ro&immutable=1' if immutable else 'mode=ro'
+            _readonly_engines[key] = create_beed_engine(
+                f"sqlite:///file:{urllib.parse.quote(str(path))}?{options}&uri=true", 'read_only_review',
+                )
+        engine = _readonly_engines[key]
+        session = Session(engine)
+
+        try:
+            instance = session.query(cls).filter_by(id=1).one()
+        except (NoResultFound, sqlalchemy.exc.OperationalError) as e:
+            raise ValueError(f"{beed_file} is not a BeeDiscovery file: {e}")
+
+        instance._engine = engine
+        instance._session = session
+        instance._tables = set(session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+        return instance
+
+    def _has_table(self, table: str) -> bool:
+        """
+        Return True if a metadata table exists in the file. Always True unless opened read-only,
+        since `load` creates any missing tables; older files opened read-only may lack newer tables.
+        """
+        tables = getattr(self, '_tables', None)
+        return tables is None or table in tables
+
+    @property
+    def readonly(self) -> bool:
+        return getattr(self, '_tables', None) is not None
+
+
+    id: Optional[int] = Field(default=1, primary_key=True)
+    name: Optional[str] = Field(default=None)
+    beed_file_path: Optional[str]
+    test_option: Optional[str]
+    
+    #: Datasets and DataRoles are loaded on first access, not with the BeeDiscovery row;
+    #: use `dataset_index()` for a cheap overview, or `prefetch()` to load everything up front.
+    datasets: List[Dataset] = Relationship(back_populates="beediscovery", 
+                                             sa_relationship_kwargs={'cascade': 'all, delete-orphan', 'lazy':'select'}
+                                            )
+    roles: List[DataRole] = Relationship(back_populates="beediscovery", 
+                                             sa_relationship_kwargs={'lazy':'select'}
+                                            )
+
+    
+    
+    
+    class Config:
+        extra = Extra.allow # or 'allow' str
+    
+    def __init__(self, beed_file: str = None, name: str = None, engine=None, session: Session=None):
+        
+        super().__init__()
+
+        self.id : int = 1
+        self.name: str = name if name else beed_file
+        self.beed_file_path: str = beed_file
+        
+        self._engine = engine if engine is not None else create_beed_engine(f'sqlite:///{self.beed_file_path}')
+        self._session = session if session is not None else Session(self._engine)
+        
+        self.__init_on_load()
+        
+    @reconstructor
+    def __init_on_load(self):
+        #: created on first use, from a connection in the engine's pool.
+        self.__sqlite_utils_db = None
+        self.__sqlite_utils_connection = None
+        #: per-Dataset caches of derived values (e.g. the role index), keyed by Dataset id.
+        self._dataset_cache = defaultdict(dict)
+        #: the `d` view, maintained by events on `datasets`.
+        self._datasets_view = None
+        #: created on first use by `submit_job`.
+        self._job_executor = None
+        #: name -> DataRole, loaded on first use by `roles_by_name`.
+        self._roles_by_name = None
+        #: True if role links may have changed since the role views were last checked, so they are checked
+        #: before the next commit (also on load, for changes made by other processes).
+        self._role_views_stale = True
+
+
+    def __repr__(self):
+        return f"BeeDiscovery: {self.beed_file_path}\n" + "\n".join(
+            f"Dataset: {x['name']}, {_row_count_label(x['row_count'], x['is_tracked'], x['counted_at'])} records "
+            f"with {x['field_count']} DataFields"
+            for x in self.dataset_index()
+        )
+
+    def dataset_index(self) -> List[dict]:
+        """
+        Return a lightweight overview of every Dataset (id, name, table, number of DataFields and cached row count),
+        read with one query and without loading any Dataset or DataField objects.
+        """
+        field_count = (
+            select(DataField.dataset_id, func.count(DataField.id).label('field_count'))
+            .group_by(DataField.dataset_id)
+            .subquery()
+            )
+        columns = [Dataset.id, Dataset.name, Dataset.table, func.coalesce(field_count.c.field_count, 0)]
+        statement = select(*columns).outerjoin(field_count, field_count.c.dataset_id == Dataset.id)
+
+        has_row_counts = self._has_table(TableRowCount.__tablename__)
+        if has_row_counts:
+            statement = (
+                statement.add_columns(TableRowCount.row_count, TableRowCount.is_tracked, TableRowCount.counted_at)
+                .outerjoin(TableRowCount, TableRowCount.table == Dataset.table)
+                )
+
+        index = list()
+        for row in self._session.execute(statement.order_by(Dataset.name)):
+            id_, name, table, fields, *row_count = row
+            row_count, is_tracked, counted_at = row_count if has_row_counts else (None, False, None)
+            index.append(dict(
+                id=id_, name=name, table=table, field_count=fields,
+                row_count=row_count, is_tracked=bool(is_tracked), counted_at=counted_at,
+                ))
+        return index
+
+    def prefetch(self):
+        """
+        Load every Dataset with its DataFields and their DataRoles, plus every DataRole, in a handful of batched
+        queries; for UIs which are going to show everything anyway.
+        """
+        # loaded through this BeeDiscovery so that its collections hold on to everything;
+        # the session's identity map alone only keeps weak references.
+        self._session.exec(
+            select(BeeDiscovery)
+            .where(BeeDiscovery.id == self.id)
+            .options(
+                selectinload(BeeDiscovery.datasets).selectinload(Dataset.fields).selectinload(DataField.roles),
+                selectinload(BeeDiscovery.roles),
+                )
+            ).all()
+        return self
+
+    def refresh_row_counts(self) -> dict[str, int]:
+        """
+        Recount every Dataset's table and store the results. Returns a mapping of Dataset name -> row count.
+        """
+        return {x.name: x.refresh_row_count() for x in self.datasets}
+
+    @property
+    def job_executor(self) -> Executor:
+        """
+        The default executor for background jobs: a small thread pool, created on first use.
+        """
+        if self._job_executor is None:
+            self._job_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='beed-job')
+        return self._job_executor
+
+    def submit_job(self,
+        func: Callable,
+        args: tuple = (),
+        kwargs: dict = None,
+        kind: str = None,
+        dataset: Dataset = None,
+        executor: Executor = None,
+        on_progress: Callable[[dict], None] = None,
+        ) -> jobs.JobHandle:
+        """
+        Run `func(ctx, *args, **kwargs)` in the background and return a `jobs.JobHandle` for it.
+
+        The job is recorded in the `__beed_job` table, where it keeps its status, latest progress and partial results.
+        It runs on `executor` (default: `job_executor`, a thread pool); with a process pool, `func` and its arguments
+        must be picklable, and progress reaches `on_progress` through `JobHandle.poll`.
+        `func` receives a `jobs.JobContext` whose connections are interrupted when the job is cancelled.
+
+        Jobs write through their own connections, so the session is committed first to release its locks.
+        Objects already loaded in the session are not refreshed by a job's writes; expire them to see the results.
+
+        >>> job = bee.submit_job(some_function, args=('students',), on_progress=print)
+        >>> job.cancel()
+        """
+        if self.readonly:
+            raise ValueError("Jobs record their state in the file, which is open read-only")
+
+        session = self._session
+        job = Job(kind=kind or func.__name__.strip('_'), dataset_id=dataset.id if dataset else None, created_at=datetime.now())
+        session.add(job)
+        session.commit()
+
+        return jobs.submit(self._engine, executor or self.job_executor, job.id, func, args, kwargs, on_progress)
+
+    def list_jobs(self, status: str = None) -> List[Job]:
+        """
+        Return the recorded jobs, newest first, optionally only those with `status`.
+        """
+        statement = select(Job).order_by(Job.id.desc()).execution_options(populate_existing=True)
+        if status is not None:
+            statement = statement.where(Job.status == status)
+        return self._session.exec(statement).all()
+
+    @property
+    def roles_by_name(self) -> dict[str, DataRole]:
+        """
+        Every DataRole by name. Loaded with one query on first use, then kept current by session events
+        (inserts, deletes, renames and rollbacks), so resolving a role name never needs a query.
+        """
+        if self._roles_by_name is None:
+            self._roles_by_name = {x.name: x for x in self._session.exec(select(DataRole)).all()}
+        return self._roles_by_name
+
+    def ensure_roles(self, names: List[str], is_unique: bool = False) -> dict[str, DataRole]:
+        """
+        Return the DataRoles with the given names, first creating any which don't exist yet with one batched INSERT.
+
+        >>> roles = bee.ensure_roles(['CUSTODIAN', 'BEGDOC'])
+        >>> bee.set_field_roles([(field, [roles['CUSTODIAN']]) for field in custodian_fields])
+        """
+        registry = self.roles_by_name
+        missing = [x for x in dict.fromkeys(names) if x not in registry]
+
+        if missing:
+            session = self._session
+            with session.begin_nested():
+                session.execute(
+                    DataRole.__table__.insert(),
+                    [dict(name=x, is_unique=is_unique, beediscovery_id=self.id) for x in missing],
+                    )
+                for role in session.exec(select(DataRole).where(DataRole.name.in_(missing))).all():
+                    registry[role.name] = role
+
+            # the inserts bypassed the ORM, so nothing else knows about the new roles yet.
+            session.expire(self, ['roles'])
+            _invalidate_roles_available(session)
+
+        return {x: registry[x] for x in names}
+
+    def set_field_roles(self, assignments: List[tuple["DataField", List["DataRole"]]], chunk_size: int = 5000) -> dict:
+        """
+        Set the roles of many DataFields at once, from (DataField, DataRoles) pairs.
+
+        The current links of all the fields are read in one query and compared with the wanted roles as sets,
+        and the differences are written with one batched INSERT and DELETE on the role link table, instead of
+        through a flush per collection change. The affected `roles` / `fields` collections and Dataset caches
+        are expired, so they reload on next access. Returns the number of links added and removed.
+        Raises ValueError, writing nothing, if a unique DataRole would be on more than one field of a Dataset.
+
+        >>> bee.set_field_roles([(students.f.id, [bee_role]), (students.f.name, [])])
+        """
+        session = self._session
+
+        with session.begin_nested():
+            # pending collection changes (and new fields or roles) need ids, and must not be overwritten later.
+            session.flush()
+
+            wanted = {_primary_key(field): {_primary_key(x) for x in roles} for field, roles in assignments}
+            current = defaultdict(set)
+            field_ids = list(wanted)
+            for start in range(0, len(field_ids), chunk_size):
+                statement = (
+                    select(DataFieldRoleLink.field_id, DataFieldRoleLink.role_id)
+                    .where(DataFieldRoleLink.field_id.in_(field_ids[start:start + chunk_size]))
+                    )
+                for field_id, role_id in session.execute(statement):
+                    current[field_id].add(role_id)
+
+            added = [(field_id, role_id) for field_id, roles in wanted.items() for role_id in roles - current[field_id]]
+            removed = [(field_id, role_id) for field_id, roles in wanted.items() for role_id in current[field_id] - roles]
+            self._check_unique_roles(wanted, added, chunk_size)
+
+            if added:
+                session.execute(
+                    DataFieldRoleLink.__table__.insert(), [dict(field_id=f, role_id=r, priority=0) for f, r in added])
+            for start in range(0, len(removed), chunk_size):
+                session.execute(delete(DataFieldRoleLink).where(
+                    tuple_(DataFieldRoleLink.field_id, DataFieldRoleLink.role_id).in_(removed[start:start + chunk_size])))
+
+        self._role_links_changed(
+            {f for f, _ in added} | {f for f, _ in removed},
+            {r for _, r in added} | {r for _, r in removed},
+            chunk_size,
+            )
+        return dict(added=len(added), removed=len(removed))
+
+    def _check_unique_roles(self, wanted: dict[int, set[int]], added: List[tuple[int, int]], chunk_size: int = 5000):
+        """
+        Raise ValueError if the `wanted` roles (field id -> role ids) would put a unique role which a field gains
+        (one of the `added` (field_id, role_id) links) on more than one field of a Dataset, counting the links of
+        the other fields.
+        """
+        session = self._session
+        if not added:
+            return
+        unique = dict(session.execute(
+            select(DataRole.id, DataRole.name)
+            .where(DataRole.is_unique == True, DataRole.id.in_({r for _, r in added}))).all())
+        if not unique:
+            return
+
+        # the fields which would hold each unique role in each Dataset (by id, as names needn't be unique): those
+        # assigned it, and those not reassigned which already have it.
+        holders = defaultdict(set)
+        names = dict()
+        field_ids = [field_id for field_id, roles in wanted.items() if roles & unique.keys()]
+        for start in range(0, len(field_ids), chunk_size):
+            statement = (
+                select(DataField.id, Dataset.id, Dataset.name)
+                .join(Dataset, Dataset.id == DataField.dataset_id)
+                .where(DataField.id.in_(field_ids[start:start + chunk_size]))
+                )
+            for field_id, dataset_id, name in session.execute(statement):
+                names[dataset_id] = name
+                for role_id in wanted[field_id] & unique.keys():
+                    holders[dataset_id, role_id].add(field_id)
+
+        statement = (
+            select(DataField.dataset_id, DataFieldRoleLink.field_id, DataFieldRoleLink.role_id)
+            .join(DataField, DataField.id == DataFieldRoleLink.field_id)
+            .where(DataFieldRoleLink.role_id.in_(list(unique)))
+            )
+        for dataset_id, field_id, role_id in session.execute(statement):
+            if field_id not in wanted and (dataset_id, role_id) in holders:
+                holders[dataset_id, role_id].add(field_id)
+
+        added = set(added)
+        clashes = sorted(
+            (names[dataset_id], unique[role_id]) for (dataset_id, role_id), fields in holders.items()
+            if len(fields) > 1 and any((x, role_id) in added for x in fields)
+            )
+        if clashes:
+            raise ValueError(f"Unique roles can only be on one field per Dataset, but would be on several in "
+                             f"(dataset, role) {clashes}")
+
+    def _role_links_changed(self, field_ids: set[int], role_ids: set[int], chunk_size: int = 5000):
+        """
+        After role links were written outside the ORM, expire the affected `roles` / `fields` collections
+        and drop the role caches of the Datasets involved.
+        """
+        session = self._session
+        for field_id in field_ids:
+            field = session.identity_map.get(identity_key(DataField, field_id))
+            if field is not None:
+                session.expire(field, ['roles'])
+        for role_id in role_ids:
+            role = session.identity_map.get(identity_key(DataRole, role_id))
+            if role is not None:
+                session.expire(role, ['fields'])
+
+        self._role_views_stale = True
+        field_ids = list(field_ids)
+        for start in range(0, len(field_ids), chunk_size):
+            statement = select(DataField.dataset_id).where(DataField.id.in_(field_ids[start:start + chunk_size]))
+            for dataset_id in set(session.exec(statement).all()):
+                for key in ('roles', 'r', 'roles_available', 'ra'):
+                    self._dataset_cache.get(dataset_id, dict()).pop(key, None)
+
+    def assign_roles(self, rules: List[dict], dry_run: bool = False) -> List[dict]:
+        """
+        Assign DataRoles to the DataFields of every Dataset which match `rules`, applied in order.
+
+        Each rule is a dict with the `role` name and any of these criteria, all of which must match:
+          - `name`, `db_name`, `db_type`: a regular expression searched for in the DataField attribute
+            (use `(?i)` for case-insensitive matching)
+          - `profile`: a dict of DataFieldProfile attribute -> value, or (operator, value) with one of
+            `==`, `!=`, `<`, `<=`, `>`, `>=` or `in`; only profiled fields can match
+          - `datasets`: a list of Dataset names to limit the rule to
+        A role which doesn't exist is created (with `is_unique` from the rule, default False).
+
+        Matches are written with one `INSERT ... SELECT` per rule into the role link table. For a unique role,
+        a Dataset is skipped if one of its fields already has the role, or if more than one of its fields match.
+        With `dry_run` nothing is written. Returns a report per rule, listing the (dataset, field) names matched,
+        added and skipped.
+
+        >>> bee.assign_roles([
+        ...     dict(role='EMAIL', name='(?i)e-?mail'),
+        ...     dict(role='BEGDOC', db_name='(?i)^beg(doc|bates)', profile=dict(null_ratio=0, distinct_count=('>', 1))),
+        ...     ], dry_run=True)
+        """
+        session = self._session
+        report = list()
+
+        with session.begin_nested():
+            session.flush()
+            for rule in rules:
+                report.append(self._assign_role_rule(rule, dry_run))
+
+        if not dry_run:
+            added = {field_id for x in report for field_id in x.pop('_added_ids')}
+            roles = {x['role_id'] for x in report if x['added']}
+            self._role_links_changed(added, roles)
+        else:
+            for x in report:
+                x.pop('_added_ids')
+
+        return report
+
+    def _assign_role_rule(self, rule: dict, dry_run: bool) -> dict:
+        unknown = set(rule) - {'role', 'name', 'db_name', 'db_type', 'profile', 'datasets', 'is_unique'}
+        if unknown or 'role' not in rule:
+            raise ValueError(f"Invalid role rule {rule}: it needs a 'role', and can't have {sorted(unknown)}")
+
+        session = self._session
+        role = self.roles_by_name.get(rule['role'])
+        if role is None and not dry_run:
+            role = self.ensure_roles([rule['role']], is_unique=rule.get('is_unique', False))[rule['role']]
+        role_id = role.id if role is not None else None
+        is_unique = role.is_unique if role is not None else rule.get('is_unique', False)
+
+        conditions = _role_rule_conditions(rule)
+        other = aliased(DataField)
+        has_role = (
+            select(DataFieldRoleLink.field_id)
+            .where(DataFieldRoleLink.field_id == DataField.id, DataFieldRoleLink.role_id == role_id)
+            .exists()
+            )
+        dataset_has_role = (
+            select(DataFieldRoleLink.field_id)
+            .join(other, other.id == DataFieldRoleLink.field_id)
+            .where(DataFieldRoleLink.role_id == role_id, other.dataset_id == DataField.dataset_id)
+            .exists()
+            )
+
+        def matching(*columns):
+            statement = select(*columns).select_from(DataField).join(Dataset, Dataset.id == DataField.dataset_id)
+            if 'profile' in rule:
+                statement = statement.join(DataFieldProfile, DataFieldProfile.field_id == DataField.id)
+            return statement.where(Dataset.beediscovery_id == self.id, *conditions)
+
+        # the report, from the same criteria as the insert below.
+        rows = session.execute(
+            matching(DataField.id, DataField.dataset_id, Dataset.name, DataField.name, has_role, dataset_has_role)
+            .order_by(Dataset.name, DataField.id)
+            ).all()
+        candidates = defaultdict(list)
+        for row in rows:
+            candidates[row[1]].append(row)
+
+        added, skipped = list(), list()
+        for dataset_rows in candidates.values():
+            new = [x for x in dataset_rows if not x[4]]
+            if not is_unique:
+                added.extend(new)
+            elif new and (dataset_rows[0][5] or len(dataset_rows) > 1):
+                skipped.extend(new)
+            else:
+                added.extend(new)
+
+        result = dict(
+            role=rule['role'],
+            role_id=role_id,
+            is_unique=is_unique,
+            matched=[(x[2], x[3]) for x in rows],
+            existing=[(x[2], x[3]) for x in rows if x[4]],
+            added=[(x[2], x[3]) for x in added],
+            skipped=[(x[2], x[3]) for x in skipped],
+            _added_ids=[x[0] for x in added],
+            )
+        if dry_run or not added:
+            return result
+
+        matches = matching(DataField.id.label('field_id'), DataField.dataset_id.label('dataset_id'))
+        if is_unique:
+            matches = matches.where(~dataset_has_role).subquery()
+            single = select(matches.c.dataset_id).group_by(matches.c.dataset_id).having(func.count() == 1)
+            source = select(matches.c.field_id, literal(role_id), literal(0)).where(matches.c.dataset_id.in_(single))
+        else:
+            matches = matches.where(~has_role).subquery()
+            source = select(matches.c.field_id, literal(role_id), literal(0))
+
+        session.execute(
+            DataFieldRoleLink.__table__.insert().from_select(['field_id', 'role_id', 'priority'], source))
+        return result
+
+    def select_roles(self,
+        *role_names: str,
+        where: str = None,
+        params: tuple | dict = (),
+        chunk_size: int = 10_000,
+        format: str = 'columns',
+        datasets: List[str] = None,
+        ):
+        """
+        Run `Dataset.select_roles` on every Dataset which has at least one of `role_names` (or those of the
+        `datasets` names), yielding (Dataset, batch) pairs. Roles a Dataset doesn't have are selected as NULL.
+
+        The columns of every Dataset are resolved with a single query over the role link table.
+
+        >>> for dataset, batch in bee.select_roles('EMAIL', where="{EMAIL} LIKE ?", params=('%@example.com',)):
+        ...     print(dataset.name, len(batch['EMAIL']))
+        """
+        names = self._query_role_names(role_names, where)
+
+        conditions = [Dataset.beediscovery_id == self.id, DataRole.name.in_(names)]
+        if datasets is not None:
+            conditions.append(Dataset.name.in_(datasets))
+        rows = self._session.execute(
+            select(DataField.dataset_id, DataRole.name, DataField.db_name)
+            .join(DataFieldRoleLink, DataFieldRoleLink.field_id == DataField.id)
+            .join(DataRole, DataRole.id == DataFieldRoleLink.role_id)
+            .join(Dataset, Dataset.id == DataField.dataset_id)
+            .where(*conditions)
+            .order_by(DataFieldRoleLink.priority, DataField.id)
+            ).all()
+
+        columns = defaultdict(dict)
+        for dataset_id, role_name, db_name in rows:
+            # the first field by priority, as in the role index.
+            columns[dataset_id].setdefault(role_name, db_name)
+
+        selected = [x for x in columns if any(name in columns[x] for name in role_names)]
+        found = self._session.exec(select(Dataset).where(Dataset.id.in_(selected)).order_by(Dataset.name)).all()
+        tables = set(self.db.table_names())
+        for dataset in found:
+            if dataset.table not in tables:
+                continue
+            roles = {name: columns[dataset.id].get(name) for name in names}
+            sql = queries.compile_select(dataset.table, {name: roles[name] for name in role_names}, where, roles=roles)
+            for batch in queries.stream(self.db.conn, sql, role_names, params, chunk_size, format):
+                yield dataset, batch
+
+    def _query_role_names(self, role_names: tuple[str], where: str = None) -> List[str]:
+        """
+        Return the role names selected by a `select_roles` query or referred to in its `where` clause,
+        raising ValueError for names which are not DataRoles at all (e.g. typos), rather than selecting NULL.
+        """
+        if not role_names:
+            raise ValueError("select_roles needs at least one role name")
+        names = list(dict.fromkeys((*role_names, *queries.placeholders(where))))
+        unknown = [x for x in names if x not in self.roles_by_name]
+        if unknown:
+            raise ValueError(f"Unknown roles {unknown}, expected DataRole names such as {sorted(self.roles_by_name)[:10]}")
+        return names
+
+    def role_view(self, role_names: List[str], name: str = None, materialize: bool = False) -> Table:
+        """
+        Create (or redefine) a view of `role_names` across every Dataset which has at least one of them, and return it.
+
+        The view is a `UNION ALL` of one SELECT per Dataset, with columns `dataset_id`, `row_id` (the rowid in the
+        Dataset's table) and one column per role (NULL for a role the Dataset doesn't have), so case-wide questions
+        are one SQL statement. With `materialize` the rows are copied into a table with an index per role column.
+
+        Role views are rebuilt when a commit changes which columns carry their roles; a materialized view copies only
+        the rows of the Datasets affected. Refresh materialized views after loading data with `refresh_role_views`.
+        The view and its definition (in `__beed_roleview`) are committed with the session.
+
+        >>> bee.role_view(['EMAIL']).count_where('"EMAIL" LIKE ?', ['%@example.com'])
+        """
+        if self.readonly:
+            raise ValueError("Role views are created in the file, which is open read-only")
+        role_names = self._query_role_names(tuple(role_names))
+        name = name if name is not None else 'roles_' + '_'.join(role_names)
+        if name.startswith('__beed') or (name not in self._role_views() and self._has_object(name)):
+            raise ValueError(f"Can't create role view {name!r}: the name is taken by another table or view")
+
+        session = self._session
+        view = session.get(RoleView, name) or RoleView(name=name, role_names='[]')
+        if json.loads(view.role_names) != role_names or view.materialized != materialize:
+            self._drop_role_view_object(view)
+            view.role_names, view.materialized, view.sources = json.dumps(role_names), materialize, None
+        session.add(view)
+        session.flush()
+
+        self.refresh_role_views([name])
+        session.commit()
+        return self.db[name]
+
+    def refresh_role_views(self, names: List[str] = None, full: bool = False) -> dict[str, int]:
+        """
+        Rebuild the role views (or those `names`) whose columns have changed since they were built: views are
+        recreated, materialized views copy the rows of only the Datasets which changed. With `full`, materialized
+        views are copied again in full, e.g. after new rows were loaded. Returns the number of sources rebuilt per view.
+
+        Runs automatically before a commit when role links, DataFields or Datasets have changed.
+        """
+        session = self._session
+        session.flush()
+        self._role_views_stale = False
+
+        views = [x for x in session.exec(select(RoleView)).all() if names is None or x.name in names]
+        if not views:
+            return dict()
+
+        sources = self._role_view_sources({role for x in views for role in json.loads(x.role_names)})
+        rebuilt = dict()
+        for view in views:
+            role_names = json.loads(view.role_names)
+            new = {str(dataset_id): [table, {role: columns[role] for role in role_names if role in columns}]
+                   for dataset_id, (table, columns) in sources.items()
+                   if any(role in columns for role in role_names)}
+            old = json.loads(view.sources) if view.sources is not None else None
+            if new == old and not (full and view.materialized):
+                continue
+
+            changed = None if old is None or full else {x for x in new.keys() | old.keys() if new.get(x) != old.get(x)}
+            if view.materialized:
+                self._build_materialized_role_view(view.name, role_names, new, changed)
+            else:
+                self._build_role_view(view.name, role_names, new)
+            rebuilt[view.name] = len(new) if changed is None else len(changed)
+            view.sources, view.built_at = json.dumps(new), datetime.now()
+            session.add(view)
+            logger.info(f'rebuilt role view {view.name} from {len(new)} datasets')
+
+        return rebuilt
+
+    def drop_role_view(self, name: str):
+        """
+        Drop a role view (or its materialized table) and forget its definition.
+        """
+        session = self._session
+        view = session.get(RoleView, name)
+        if view is None:
+            raise KeyError(f"No role view named {name!r}")
+        self._drop_role_view_object(view)
+        session.delete(view)
+        session.commit()
+
+    def _role_views(self) -> set[str]:
+        if not self._has_table(RoleView.__tablename__):
+            return set()
+        return set(self._session.exec(select(RoleView.name)).all())
+
+    def _has_object(self, name: str) -> bool:
+        statement = text("SELECT 1 FROM sqlite_master WHERE name = :name AND type IN ('table', 'view')")
+        return self._session.execute(statement, dict(name=name)).first() is not None
+
+    def _role_view_sources(self, role_names: set[str]) -> dict[int, tuple[str, dict[str, str]]]:
+        """
+        Return dataset id -> (table, {role name: column}) for the Datasets with tables and any of `role_names`,
+        with one query. Where several fields share a role, the one with the lowest link priority is used.
+        """
+        rows = self._session.execute(
+            select(Dataset.id, Dataset.table, DataRole.name, DataField.db_name)
+            .join(DataField, DataField.dataset_id == Dataset.id)
+            .join(DataFieldRoleLink, DataFieldRoleLink.field_id == DataField.id)
+            .join(DataRole, DataRole.id == DataFieldRoleLink.role_id)
+            .where(Dataset.beediscovery_id == self.id, DataRole.name.in_(role_names))
+            .order_by(Dataset.id, DataFieldRoleLink.priority, DataField.id)
+            ).all()
+        tables = set(self._session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+
+        sources = dict()
+        for dataset_id, table, role_name, db_name in rows:
+            if table in tables:
+                sources.setdefault(dataset_id, (table, dict()))[1].setdefault(role_name, db_name)
+        return sources
+
+    def _build_role_view(self, name: str, role_names: List[str], sources: dict[str, list]):
+        union = queries.compile_union([(int(k), table, columns) for k, (table, columns) in sources.items()], role_names)
+        self._session.execute(text(f"DROP VIEW IF EXISTS {quote_identifier(name)}"))
+        self._session.execute(text(f"CREATE VIEW {quote_identifier(name)} AS\n{union}"))
+
+    def _build_materialized_role_view(self, name: str, role_names: List[str], sources: dict[str, list],
+                                      changed: set[str] = None):
+        """
+        Copy the rows of `sources` into the table `name`: all of them, or only those of the `changed` dataset ids.
+        """
+        session = self._session
+        table = quote_identifier(name)
+        full = changed is None
+        if full:
+            session.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            columns = ', '.join(quote_identifier(role) for role in role_names)
+            session.execute(text(f"CREATE TABLE {table} (dataset_id INTEGER NOT NULL, row_id INTEGER, {columns})"))
+            changed = set(sources)
+        elif changed:
+            ids = ', '.join(str(int(x)) for x in changed)
+            session.execute(text(f"DELETE FROM {table} WHERE dataset_id IN ({ids})"))
+
+        for dataset_id in changed:
+            if dataset_id in sources:
+                source_table, columns = sources[dataset_id]
+                select_sql = queries.compile_source_select(
+                    int(dataset_id), source_table, {role: columns.get(role) for role in role_names})
+                session.execute(text(f"INSERT INTO {table} {select_sql}"))
+
+        if full:
+            # indexed after the rows are copied, which is faster than maintaining the indexes while inserting.
+            indexes = [(f'{name}_dataset', 'dataset_id, row_id')]
+            indexes += [(f'{name}_{role}', quote_identifier(role)) for role in role_names]
+            for index, columns in indexes:
+                session.execute(text(f"CREATE INDEX {quote_identifier(index)} ON {table} ({columns})"))
+
+    def _drop_role_view_object(self, view: RoleView):
+        kind = 'TABLE' if view.materialized else 'VIEW'
+        self._session.execute(text(f"DROP {kind} IF EXISTS {quote_identifier(view.name)}"))
+
+    def advise_indexes(self,
+        roles: List[str] = None,
+        min_rows: int = 10_000,
+        min_distinct: int = 100,
+        ) -> List[dict]:
+        """
+        Propose indexes on the data table columns used as keys or filters: DataFields with a DataRole (or one of
+        `roles`) in tables of at least `min_rows` rows, which are selective enough to be worth an index: at least
+        `min_distinct` distinct values in their profile (so a lookup reads at most about 1/min_distinct of the table),
+        or, if not profiled yet, a unique role. Columns which already lead an index are skipped. Indexes are named
+        `beed_idx_<table>_<column>`, with a number added if another index already has that name.
+
+        Returns proposals for `build_indexes`, most selective first: dicts with the index `name`, `dataset`, `field`,
+        `field_id`, `table`, `column`, `roles`, `row_count`, `distinct_ratio` and the `reason` for the index.
+
+        >>> bee.advise_indexes(roles=['EMAIL', 'USER_ID', 'HOSTNAME'])
+        """
+        conditions = [Dataset.beediscovery_id == self.id]
+        if roles is not None:
+            conditions.append(DataRole.name.in_(roles))
+
+        statement = (
+            select(DataField.id, DataField.name, DataField.db_name, Dataset.name, Dataset.table, DataRole.name,
+                   DataRole.is_unique, DataFieldProfile.distinct_count, DataFieldProfile.row_count)
+            .join(Dataset, Dataset.id == DataField.dataset_id)
+            .join(DataFieldRoleLink, DataFieldRoleLink.field_id == DataField.id)
+            .join(DataRole, DataRole.id == DataFieldRoleLink.role_id)
+            .outerjoin(DataFieldProfile, DataFieldProfile.field_id == DataField.id)
+            .where(*conditions)
+            .order_by(DataField.id, DataRole.name)
+            )
+        if self._has_table(TableRowCount.__tablename__):
+            statement = (statement.add_columns(TableRowCount.row_count)
+                         .outerjoin(TableRowCount, TableRowCount.table == Dataset.table))
+
+        candidates = dict()
+        for field_id, field, column, dataset, table, role, is_unique, distinct, profile_rows, *counted in self._session.execute(statement):
+            candidate = candidates.setdefault(field_id, dict(
+                dataset=dataset, field=field, field_id=field_id, table=table, column=column, roles=list(),
+                unique=set(), distinct=distinct, row_count=profile_rows if profile_rows is not None else next(iter(counted), None),
+                ))
+            candidate['roles'].append(role)
+            if is_unique:
+                candidate['unique'].add(role)
+
+        indexed = self._indexed_columns()
+        taken = set(self._session.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+        proposals = list()
+        for x in candidates.values():
+            if (x['table'], x['column']) in indexed or (x['row_count'] is not None and x['row_count'] < min_rows):
+                continue
+
+            if x['distinct'] is not None and x['distinct'] < min_distinct:
+                continue
+            if x['distinct'] is None and not x['unique']:
+                continue
+            ratio = x['distinct'] / x['row_count'] if x['distinct'] is not None and x['row_count'] else None
+
+            described = ', '.join(f"{role} (unique)" if role in x['unique'] else role for role in x['roles'])
+            if x['distinct'] is None:
+                reason = f"role {described}, not profiled"
+            else:
+                reason = f"role {described}, {x['distinct']:,} distinct values" + (f" ({ratio:.0%})" if ratio is not None else '')
+            name = f"{_INDEX_PREFIX}{x['table']}_{x['column']}"
+            suffix = 1
+            while name in taken:
+                suffix += 1
+                name = f"{_INDEX_PREFIX}{x['table']}_{x['column']}_{suffix}"
+            proposals.append(dict(
+                name=name, dataset=x['dataset'], field=x['field'], field_id=x['field_id'],
+                table=x['table'], column=x['column'], roles=x['roles'], row_count=x['row_count'], distinct_ratio=ratio,
+                reason=reason,
+                ))
+
+        return sorted(proposals, key=lambda x: (-(x['distinct_ratio'] or 0), -(x['row_count'] or 0)))
+
+    def _indexed_columns(self) -> set[tuple[str, str]]:
+        """
+        Return the (table, column) pairs of the columns which lead an index, read with one query.
+        """
+        statement = text("""
+            SELECT m.name, i.name
+            FROM sqlite_master AS m
+            JOIN pragma_index_list(m.name) AS l
+            JOIN pragma_index_info(l.name) AS i
+            WHERE m.type = 'table' AND i.seqno = 0
+            """)
+        return {tuple(x) for x in self._session.execute(statement)}
+
+    def build_indexes(self,
+        proposals: List[dict] = None,
+        measure: bool = True,
+        executor: Executor = None,
+        on_progress: Callable[[dict], None] = None,
+        ) -> jobs.JobHandle:
+        """
+        Build the indexes of `proposals` (default: all of `advise_indexes()`) in a background job
+        (see `submit_job`) and return its handle. Each index is recorded as a DataFieldIndex once built;
+        with `measure`, with the time of an equality lookup on the column before and after.
+
+        >>> job = bee.build_indexes(bee.advise_indexes(roles=['EMAIL']), on_progress=print)
+        >>> job.result()
+        """
+        proposals = self.advise_indexes() if proposals is None else proposals
+        indexes = [(x['name'], x.get('field_id'), x['table'], x['column'], x.get('reason')) for x in proposals]
+        return self.submit_job(
+            _index_job, args=(indexes,), kwargs=dict(measure=measure), kind='index', executor=executor,
+            on_progress=on_progress,
+            )
+
+    def list_indexes(self) -> List[DataFieldIndex]:
+        """
+        Return the indexes built by `build_indexes`, with their lookup timings.
+        """
+        if not self._has_table(DataFieldIndex.__tablename__):
+            return list()
+        statement = select(DataFieldIndex).order_by(DataFieldIndex.name).execution_options(populate_existing=True)
+        return self._session.exec(statement).all()
+
+    def drop_indexes(self, names: List[str] = None) -> List[str]:
+        """
+        Drop indexes built by `build_indexes` (or only those `names`) and forget them. Returns the names dropped.
+        An index which has since been replaced by another of the same name, on other columns, is forgotten but kept.
+        """
+        session = self._session
+        dropped = [x for x in self.list_indexes() if names is None or x.name in names]
+        for index in dropped:
+            definition = _index_definition(self.db.conn, index.name)
+            if definition == (index.table, [index.column]):
+                session.execute(text(f"DROP INDEX {quote_identifier(index.name)}"))
+            elif definition is not None:
+                logger.warning(f"Not dropping index {index.name}, which is now on {definition[0]} {definition[1]}")
+            session.delete(index)
+        session.commit()
+        return [x.name for x in dropped]
+
+    def index_values(self,
+        role_names: List[str],
+        normalizer: str = 'text',
+        window: int = 100_000,
+        progress: Callable[[dict], None] = None,
+        ) -> dict:
+        """
+        Add `role_names` to the value index, and index the values of every DataField with those roles.
+        Values are normalised with `normalizer` (one of `value_index.NORMALIZERS`: 'text', 'exact', 'digits' or 'email')
+        and hashed into postings, so that `find_value` and `value_overlap` never read the source tables.
+
+        Later ingests into a Dataset index its new rows; call `update_value_index` after roles are assigned.
+        The index is written through the `db` connection, so the session is committed first.
+
+        >>> bee.index_values(['EMAIL', 'CUSTODIAN_EMAIL'], normalizer='email')
+        """
+        self._register_value_roles(role_names, normalizer)
+        return self.update_value_index(window=window, progress=progress)
+
+    def index_values_job(self,
+        role_names: List[str],
+        normalizer: str = 'text',
+        window: int = 100_000,
+        executor: Executor = None,
+        on_progress: Callable[[dict], None] = None,
+        ) -> jobs.JobHandle:
+        """
+        Run `index_values` as a background job (see `submit_job`) and return its handle. Each window of rows is
+        committed with its source's progress, so a cancelled job resumes where it stopped on the next update.
+        """
+        self._register_value_roles(role_names, normalizer)
+        return self.submit_job(
+            _value_index_job, kwargs=dict(window=window), kind='value_index', executor=executor, on_progress=on_progress,
+            )
+
+    def update_value_index(self,
+        tables: List[str] = None,
+        window: int = 100_000,
+        progress: Callable[[dict], None] = None,
+        ) -> dict:
+        """
+        Bring the value index up to date with the role links and tables (or only those of `tables`): index the rows
+        added since the last update, and fields which gained an indexed role; drop the postings of fields which lost one.
+        Fields of tables with rows updated or deleted since (see `Dataset.refresh_changes`) are indexed again in full;
+        updates in place are only seen on tables with `Dataset.track_changes`.
+        """
+        if self.readonly or not self._has_table(ValueIndexRole.__tablename__):
+            return dict(sources=0, postings_added=0, sources_removed=0, postings_removed=0)
+
+        session = self._session
+        session.commit()
+        removals, tasks = _value_index_plan(session, tables)
+        session.commit()
+        return _update_value_index(self.db.conn, removals, tasks, window, progress)
+
+    def find_value(self, value, roles: List[str] = None, limit: int = 1000) -> List[dict]:
+        """
+        Return where `value` appears in the value index (optionally only with `roles`): dicts with the `dataset`,
+        `field` and `role` names and the `row_id` in the Dataset's table. The value is normalised as for each role.
+
+        >>> bee.find_value('Jane.Doe@example.com ', roles=['EMAIL'])
+        """
+        indexed = self._value_index_roles(roles)
+        hashes = {role_id: value_index.value_hash(value, normalizer) for role_id, normalizer in indexed.items()}
+        hashes = {role_id: x for role_id, x in hashes.items() if x is not None}
+        if not hashes:
+            return list()
+
+        postings = value_index.lookup(self.db.conn, set(hashes.values()), hashes, limit)
+        # a hash only counts for the roles whose normaliser produced it.
+        postings = [x for x in postings if hashes.get(x[1]) == x[0]]
+        return self._describe_postings(postings)
+
+    def value_overlap(self, dataset_a: Dataset | str, dataset_b: Dataset | str, roles: List[str] = None,
+                      examples: int = 5) -> dict:
+        """
+        Return how many distinct indexed values (optionally of `roles`) two Datasets share, from the value index:
+        `a_distinct`, `b_distinct`, `shared`, `jaccard`, and up to `examples` shared values of `dataset_a`,
+        read back from its table with their `dataset`, `field`, `role` and `row_id`.
+
+        >>> bee.value_overlap('custodians', 'mail_2019', roles=['EMAIL'])['shared']
+        """
+        ids = [self._dataset_id(x) for x in (dataset_a, dataset_b)]
+        role_ids = list(self._value_index_roles(roles)) if roles is not None else None
+
+        result = value_index.overlap(self.db.conn, *ids, role_ids=role_ids, examples=examples)
+        if examples:
+            result['examples'] = self._describe_postings(result['examples'], values=True)
+        return result
+
+    def drop_value_index(self, role_names: List[str] = None) -> dict:
+        """
+        Remove `role_names` (default: all) from the value index, deleting their postings.
+        """
+        session = self._session
+        indexed = self._value_index_roles(role_names)
+        session.commit()
+
+        conn = self.db.conn
+        with conn:
+            for role_id in indexed:
+                conn.execute(f"DELETE FROM {value_index.POSTINGS_TABLE} WHERE role_id = ?", (role_id,))
+                conn.execute(f"DELETE FROM {value_index.SOURCES_TABLE} WHERE role_id = ?", (role_id,))
+                conn.execute(f"DELETE FROM {value_index.ROLES_TABLE} WHERE role_id = ?", (role_id,))
+        session.expire_all()
+        return dict(roles=[x.name for x in self.roles_by_name.values() if x.id in indexed])
+
+    def _register_value_roles(self, role_names: List[str], normalizer: str):
+        if self.readonly:
+            raise ValueError("The value index is kept in the file, which is open read-only")
+        if normalizer not in value_index.NORMALIZERS:
+            raise ValueError(f"Unknown normalizer {normalizer!r}, expected one of {list(value_index.NORMALIZERS)}")
+
+        session = self._session
+        for name in self._query_role_names(tuple(role_names)):
+            role = self.roles_by_name[name]
+            session.flush()
+            indexed = session.get(ValueIndexRole, role.id) or ValueIndexRole(role_id=role.id, created_at=datetime.now())
+            indexed.normalizer = normalizer
+            session.add(indexed)
+        session.commit()
+
+    def _value_index_roles(self, role_names: List[str] = None) -> dict[int, str]:
+        """
+        Return role id -> normaliser of the indexed roles (or of those `role_names`, which must be indexed).
+        """
+        if not self._has_table(ValueIndexRole.__tablename__):
+            indexed = dict()
+        else:
+            indexed = dict(self._session.execute(select(ValueIndexRole.role_id, ValueIndexRole.normalizer)).all())
+        if role_names is None:
+            return indexed
+
+        ids = {name: getattr(self.roles_by_name.get(name), 'id', None) for name in role_names}
+        missing = [name for name, role_id in ids.items() if role_id not in indexed]
+        if missing:
+            raise ValueError(f"Roles {missing} are not in the value index, see `index_values`")
+        return {ids[name]: indexed[ids[name]] for name in role_names}
+
+    def _dataset_id(self, dataset: Dataset | str) -> int:
+        if isinstance(dataset, Dataset):
+            return dataset.id
+        dataset_id = self._session.exec(select(Dataset.id).where(Dataset.name == dataset)).first()
+        if dataset_id is None:
+            raise KeyError(f"No dataset named {dataset!r}")
+        return dataset_id
+
+    def _describe_postings(self, postings: List[tuple], values: bool = False) -> List[dict]:
+        """
+        Turn (hash, role_id, dataset_id, field_id, row_id) postings into dicts of names, with one query for the names
+        and, with `values`, one query per DataField for the values.
+        """
+        field_ids = {x[3] for x in postings}
+        names = {
+            field_id: (dataset, table, field, column)
+            for field_id, dataset, table, field, column in self._session.execute(
+                select(DataField.id, Dataset.name, Dataset.table, DataField.name, DataField.db_name)
+                .join(Dataset, Dataset.id == DataField.dataset_id)
+                .where(DataField.id.in_(field_ids)))
+            }
+        role_names = {role.id: name for name, role in self.roles_by_name.items()}
+
+        described = list()
+        for _, role_id, dataset_id, field_id, row_id in postings:
+            dataset, table, field, column = names.get(field_id, (None, None, None, None))
+            described.append(dict(dataset=dataset, field=field, role=role_names.get(role_id), row_id=row_id))
+
+        if values:
+            by_field = defaultdict(list)
+            for posting, x in zip(postings, described):
+                x['value'] = None
+                # the postings of a DataField deleted since they were looked up have no name or column to read.
+                if posting[3] in names:
+                    by_field[posting[3]].append(x)
+            columns = dict()
+            for field_id, items in by_field.items():
+                _, table, _, column = names[field_id]
+                if table not in columns:
+                    columns[table] = set(table_columns(self.db.conn, table))
+                if column not in columns[table]:
+                    continue
+                rows = dict(self.db.conn.execute(
+                    f"SELECT rowid, {quote_identifier(column)} FROM {quote_identifier(table)} "
+                    f"WHERE rowid IN ({', '.join('?' * len(items))})", [x['row_id'] for x in items]))
+                for x in items:
+                    x['value'] = rows.get(x['row_id'])
+        return described
+
+    def sync_all_job(self, create_missing: bool = False, executor: Executor = None,
+                     on_progress: Callable[[dict], None] = None) -> jobs.JobHandle:
+        """
+        Run `sync_all` as a background job (see `submit_job`) and return its handle.
+        """
+        return self.submit_job(
+            _sync_job, kwargs=dict(create_missing=create_missing), kind='sync', executor=executor, on_progress=on_progress,
+            )
+
+    @property
+    def db(self) -> Database:
+        """
+        Return the sqlite_utils Database for this file. It uses a connection from the same pool
+        (and so the same connection profile) as the SQLAlchemy session.
+        """
+        if self.__sqlite_utils_db is None:
+            engine = getattr(self, '_engine', None) or object_session(self).get_bind()
+            self.__sqlite_utils_db, self.__sqlite_utils_connection = sqlite_utils_database(engine)
+        return self.__sqlite_utils_db
+
+    @property
+    def profile(self) -> str:
+        """
+        The name of the connection profile in use.
+        """
+        return getattr(self._engine, 'beed_profile', None)
+
+    def dataset(self, dataset_name: str, **kwargs) -> Dataset:
+        """
+        # TODO: Fix docstring
+        Return a table object, optionally configured with default options.
+        See :ref:`reference_db_table` for option details.
+        :param table_name: Name of the table
+        """
+
+        with self._session.begin_nested():
             try:
                 table = kwargs['table'] if 'table' in kwargs else dataset_name
                 dataset = Dataset(name=dataset_name, table=table, beediscovery=self, **kwargs)
@@ -517,12 +2839,343 @@ class BeeDiscovery(SQLModel, table=True):
             return new_dataset
 
 
+    def table_columns(self) -> dict[str, List[Column]]:
+        """
+        Return the columns of every data table in the database, read with a single
+        `sqlite_master` / `pragma_table_info` join rather than a PRAGMA per table.
+        The BeeDiscovery metadata tables and materialized role views are excluded.
+        """
+
+        role_views = ''
+        if self._has_table(RoleView.__tablename__):
+            role_views = f"AND m.name NOT IN (SELECT name FROM {RoleView.__tablename__})"
+
+        statement = text(rf"""
+            SELECT m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk
+            FROM sqlite_master AS m
+            JOIN pragma_table_info(m.name) AS p
+            WHERE m.type = 'table'
+              AND m.name NOT LIKE 'sqlite\_%' ESCAPE '\'
+              AND m.name NOT LIKE '\_\_beed%' ESCAPE '\'
+              {role_views}
+            ORDER BY m.name, p.cid
+            """)
+
+        tables = defaultdict(list)
+        for table, *column in self._session.execute(statement):
+            tables[table].append(Column(*column))
+
+        return dict(tables)
+
+    def sync_all(self, executor: Executor = None, create_missing: bool = False) -> dict:
+        """
+        Run `Dataset.sync_columns` for every Dataset at once.
+
+        The schema of every table is read in one query, every DataField is loaded in one query,
+        and all new DataFields are inserted in one transaction.
+        Pass a `concurrent.futures` executor to diff the Datasets in parallel.
+        The report's `datasets` are keyed by Dataset id (names and tables need not be unique), each with the
+        Dataset's `name` and `table` and the `Dataset.sync_columns` report.
+        Tables which have no Dataset yet are reported under `untracked_tables`;
+        if `create_missing` is True, a Dataset is created for each of them and synced too.
+
+        >>> report = bee.sync_all(executor=ThreadPoolExecutor())
+        """
+
+        session = self._session
+
+        with session.begin_nested():
+            table_columns = self.table_columns()
+
+            untracked_tables = sorted(set(table_columns) - {x.table for x in self.datasets})
+            if create_missing:
+                for table in untracked_tables:
+                    self.dataset(table)
+            session.flush()
+
+            datasets = list(self.datasets)
+            existing = {field.id: field for field in session.exec(select(DataField)).unique().all()}
+            dataset_fields = defaultdict(list)
+            for field in existing.values():
+                dataset_fields[field.dataset_id].append((field.id, field.db_name, field.db_is_primary_key))
+
+            mapper = executor.map if executor is not None else map
+            diffs = list(mapper(
+                _diff_columns,
+                [table_columns.get(x.table, []) for x in datasets],
+                [dataset_fields[x.id] for x in datasets],
+                ))
+
+            created = _bulk_create_datafields(session, {x.id: diff[2] for x, diff in zip(datasets, diffs)})
+
+        created_by_dataset = defaultdict(list)
+        for field in created:
+            created_by_dataset[field.dataset_id].append(field)
+
+        report = dict()
+        for dataset, (matched_ids, extra_ids, _) in zip(datasets, diffs):
+            if created_by_dataset[dataset.id]:
+                session.expire(dataset, ['fields'])
+                _invalidate_dataset_cache(dataset, 'f')
+            report[dataset.id] = dict(
+                name=dataset.name,
+                table=dataset.table,
+                matched_datafields=[existing[x] for x in matched_ids],
+                extra_datafields=[existing[x] for x in extra_ids],
+                created=created_by_dataset[dataset.id],
+                )
+
+        return dict(datasets=report, untracked_tables=untracked_tables)
+
     @property
     def d(self) -> dict[str:Dataset]:
-        return DynamicAttrDefaultDictList(self.datasets, lambda x: x.name.replace(' ','').replace('-','_'))
+        if self._datasets_view is None:
+            self._datasets_view = DynamicAttrDefaultDictList(self.datasets, _attribute_name)
+        return self._datasets_view
         
     
 
+def _invalidate_dataset_cache(dataset: Dataset, *keys: str):
+    """
+    Drop the cached values for a Dataset, either only the given keys or everything.
+    """
+    if dataset is None or dataset.beediscovery is None:
+        return
+
+    cache = dataset.beediscovery._dataset_cache.get(dataset.id)
+    if not cache:
+        return
+
+    if keys:
+        for key in keys:
+            cache.pop(key, None)
+    else:
+        cache.clear()
+
+
+def _dataset_cache_for(dataset: Dataset) -> dict | None:
+    """
+    Return the cache of a Dataset if anything has been cached for it yet, without creating one.
+    """
+    if dataset is None or dataset.beediscovery is None:
+        return None
+    return dataset.beediscovery._dataset_cache.get(dataset.id)
+
+
+def _attribute_name(item) -> str:
+    return normalize_attribute_name(item.name)
+
+
+@event.listens_for(DataField.roles, 'append')
+def _datafield_role_appended(datafield, role, initiator):
+    cache = _dataset_cache_for(datafield.dataset)
+    if not cache:
+        return
+
+    if 'roles' in cache:
+        add_to_mapping(cache['roles'], role.name, datafield)
+        cache['r'].add(datafield, key=role.name)
+
+    if role.is_unique and 'roles_available' in cache:
+        # a unique role is no longer available once any field in the Dataset has it.
+        cache['roles_available'] = [x for x in cache['roles_available'] if x.name != role.name]
+        if 'ra' in cache:
+            for available in list(cache['ra'].values()):
+                if getattr(available, 'name', None) == role.name:
+                    cache['ra'].discard(available)
+
+
+@event.listens_for(DataField.roles, 'remove')
+def _datafield_role_removed(datafield, role, initiator):
+    cache = _dataset_cache_for(datafield.dataset)
+    if not cache:
+        return
+
+    if 'roles' in cache:
+        discard_from_mapping(cache['roles'], role.name, datafield)
+        cache['r'].discard(datafield, key=role.name)
+
+    if role.is_unique and 'roles_available' in cache:
+        if 'roles' not in cache:
+            cache.pop('roles_available', None)
+            cache.pop('ra', None)
+        elif role.name not in cache['roles']:
+            cache['roles_available'] = sorted(cache['roles_available'] + [role], key=lambda x: x.name)
+            if 'ra' in cache:
+                cache['ra'].add(role)
+
+
+@event.listens_for(Dataset.fields, 'append')
+def _dataset_field_appended(dataset, datafield, initiator):
+    cache = _dataset_cache_for(dataset)
+    if not cache:
+        return
+
+    if 'f' in cache:
+        cache['f'].add(datafield)
+    if datafield.roles:
+        for key in ('roles', 'r', 'roles_available', 'ra'):
+            cache.pop(key, None)
+
+
+@event.listens_for(Dataset.fields, 'remove')
+def _dataset_field_removed(dataset, datafield, initiator):
+    cache = _dataset_cache_for(dataset)
+    if not cache:
+        return
+
+    if 'f' in cache:
+        cache['f'].discard(datafield)
+    if datafield.roles:
+        for key in ('roles', 'r', 'roles_available', 'ra'):
+            cache.pop(key, None)
+
+
+@event.listens_for(DataField.name, 'set')
+def _datafield_renamed(datafield, value, oldvalue, initiator):
+    cache = _dataset_cache_for(datafield.dataset)
+    if not cache or 'f' not in cache:
+        return
+
+    if isinstance(oldvalue, str):
+        cache['f'].discard(datafield, key=oldvalue)
+        cache['f'].add(datafield, key=value)
+    else:
+        cache.pop('f')
+
+
+@event.listens_for(BeeDiscovery.datasets, 'append')
+def _beediscovery_dataset_appended(beediscovery, dataset, initiator):
+    if beediscovery._datasets_view is not None:
+        beediscovery._datasets_view.add(dataset)
+
+
+@event.listens_for(BeeDiscovery.datasets, 'remove')
+def _beediscovery_dataset_removed(beediscovery, dataset, initiator):
+    if beediscovery._datasets_view is not None:
+        beediscovery._datasets_view.discard(dataset)
+
+
+@event.listens_for(Dataset.name, 'set')
+def _dataset_renamed(dataset, value, oldvalue, initiator):
+    beediscovery = dataset.beediscovery
+    if beediscovery is None or beediscovery._datasets_view is None:
+        return
+
+    if isinstance(oldvalue, str):
+        beediscovery._datasets_view.discard(dataset, key=oldvalue)
+        beediscovery._datasets_view.add(dataset, key=value)
+    else:
+        beediscovery._datasets_view = None
+
+
+def _invalidate_roles_available(session, *keys: str):
+    """
+    Drop the cached `roles_available` (and `ra`) of every Dataset, for changes to the DataRoles themselves.
+    """
+    if session is None:
+        return
+
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, BeeDiscovery):
+            for cache in instance._dataset_cache.values():
+                for key in ('roles_available', 'ra') + keys:
+                    cache.pop(key, None)
+
+
+@event.listens_for(DataRole, 'after_insert')
+def _datarole_inserted(mapper, connection, role):
+    session = object_session(role)
+    _invalidate_roles_available(session)
+
+    beediscovery = _session_beediscovery(session)
+    if beediscovery is not None and beediscovery._roles_by_name is not None:
+        beediscovery._roles_by_name[role.name] = role
+
+
+@event.listens_for(DataRole, 'after_delete')
+def _datarole_deleted(mapper, connection, role):
+    session = object_session(role)
+    _invalidate_roles_available(session)
+
+    beediscovery = _session_beediscovery(session)
+    if beediscovery is not None and beediscovery._roles_by_name is not None:
+        if beediscovery._roles_by_name.get(role.name) is role:
+            del beediscovery._roles_by_name[role.name]
+
+
+@event.listens_for(DataRole.is_unique, 'set')
+def _datarole_is_unique_changed(role, value, oldvalue, initiator):
+    _invalidate_roles_available(object_session(role))
+
+
+@event.listens_for(DataRole.name, 'set')
+def _datarole_renamed(role, value, oldvalue, initiator):
+    session = object_session(role)
+    _invalidate_roles_available(session, 'roles', 'r')
+
+    beediscovery = _session_beediscovery(session)
+    if beediscovery is not None and beediscovery._roles_by_name is not None:
+        if isinstance(oldvalue, str) and beediscovery._roles_by_name.get(oldvalue) is role:
+            del beediscovery._roles_by_name[oldvalue]
+            beediscovery._roles_by_name[value] = role
+
+
+@event.listens_for(Session, 'after_flush')
+def _role_views_after_flush(session, flush_context):
+    """
+    Flag the role views to be checked before the next commit if the flush touched anything they are built from.
+    """
+    beediscovery = _session_beediscovery(session)
+    if beediscovery is None or beediscovery._role_views_stale:
+        return
+
+    for instance in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, (DataField, Dataset, DataRole, DataFieldRoleLink)):
+            beediscovery._role_views_stale = True
+            return
+
+
+@event.listens_for(Session, 'before_commit')
+def _refresh_role_views_before_commit(session):
+    """
+    Rebuild the role views whose columns changed, in the same transaction as the changes.
+    """
+    beediscovery = _session_beediscovery(session)
+    if beediscovery is None or session.in_nested_transaction():
+        return
+    if beediscovery.readonly or not beediscovery._has_table(RoleView.__tablename__):
+        return
+
+    # this runs before the commit's own flush, whose changes must be seen by `_role_views_after_flush` first.
+    session.flush()
+    if beediscovery._role_views_stale:
+        beediscovery.refresh_role_views()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _clear_caches_after_rollback(session):
+    """
+    A rollback can undo changes the views were updated with, so drop everything cached.
+    """
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, BeeDiscovery):
+            instance._dataset_cache.clear()
+            instance._datasets_view = None
+            instance._roles_by_name = None
+            instance._role_views_stale = True
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _clear_caches_after_savepoint_rollback(session, previous_transaction):
+    """
+    Rolling back a savepoint (`begin_nested`) undoes changes too, so clear the caches then as well, whether or
+    not this SQLAlchemy version also fires `after_rollback` for it.
+    """
+    if previous_transaction.nested:
+        _clear_caches_after_rollback(session)
+
+
 # Lifecycle Events
 #@event.listens_for(Dataset.fields, 'remove')
 def receive_persistent_to_deleted_datafield(dataset, datafield, initiator):
@@ -0,0 +1,39 @@
+"""
+Tests for the connection profiles in `connections`.
+"""
+import pytest
+
+from connections import PROFILES, create_beed_engine, sqlite_utils_database
+
+
+def _pragma(conn, name: str):
+    return conn.execute(f'PRAGMA {name}').fetchone()[0]
+
+
+@pytest.mark.parametrize('profile', ['interactive', 'bulk_load'])
+def test_profile_pragmas_are_applied_to_every_connection(tmp_path, profile):
+    engine = create_beed_engine(f"sqlite:///{tmp_path / 'test.beedb'}", profile)
+    db, pooled = sqlite_utils_database(engine)
+    pragmas = PROFILES[profile]
+
+    for conn in (db.conn, engine.raw_connection().dbapi_connection):
+        assert _pragma(conn, 'journal_mode') == 'wal'
+        assert _pragma(conn, 'cache_size') == pragmas['cache_size']
+        assert _pragma(conn, 'busy_timeout') == pragmas['busy_timeout']
+        assert _pragma(conn, 'temp_store') == 2
+    assert engine.beed_profile == profile
+
+
+def test_unknown_profiles_are_refused(tmp_path):
+    with pytest.raises(ValueError, match='fast'):
+        create_beed_engine(f"sqlite:///{tmp_path / 'test.beedb'}", 'fast')
+
+
+def test_load_uses_the_profile_for_sqlite_utils_too(tmp_path):
+    from sqlmodels import BeeDiscovery
+
+    bee = BeeDiscovery.load(str(tmp_path / 'test.beedb'), profile='bulk_load')
+
+    assert bee.profile == 'bulk_load'
+    assert _pragma(bee.db.conn, 'synchronous') == 0
+    bee._session.close()
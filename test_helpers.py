@@ -0,0 +1,52 @@
+"""
+Tests for the mappings in `helpers`.
+"""
+import pickle
+
+import pytest
+
+from helpers import DynamicAttrDefaultDictList
+
+
+def test_duplicate_keys_become_lists():
+    mapping = DynamicAttrDefaultDictList({'test': 1, 'space-buster': 4})
+    mapping['test'] = 2
+
+    assert mapping.data == {'test': [1, 2], 'space_buster': 4}
+    assert mapping.space_buster == 4
+    assert sorted(dir(mapping)) == ['space_buster', 'test']
+
+
+def test_missing_attributes_raise():
+    mapping = DynamicAttrDefaultDictList({'test': 1})
+
+    assert not hasattr(mapping, 'missing')
+    with pytest.raises(AttributeError):
+        mapping.missing
+
+
+def test_copy_keeps_duplicates():
+    items = ['a1', 'a2', 'b1']
+    mapping = DynamicAttrDefaultDictList(items, attribute_func=lambda x: x[0])
+
+    copied = mapping.copy()
+    copied.discard('a2')
+
+    assert mapping.data == {'a': ['a1', 'a2'], 'b': 'b1'}
+    assert copied.data == {'a': 'a1', 'b': 'b1'}
+    copied.add('b2')
+    assert copied.b == ['b1', 'b2'] and mapping.b == 'b1'
+
+
+def test_pickles():
+    mapping = DynamicAttrDefaultDictList({'test': 1})
+    assert pickle.loads(pickle.dumps(mapping)).data == {'test': 1}
+
+
+def test_list_values_are_not_taken_for_duplicates():
+    mapping = DynamicAttrDefaultDictList({'pair': [1, 2]})
+    mapping['pair'] = 3
+
+    assert mapping.pair == [[1, 2], 3]
+    mapping.discard(3, key='pair')
+    assert mapping.data == {'pair': [1, 2]}
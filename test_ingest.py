@@ -0,0 +1,122 @@
+"""
+Tests for the streaming loaders in `ingest`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import sqlite3
+
+import pytest
+
+import ingest
+
+
+def write_csv(path, rows: int, start: int = 0):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'name', 'score'])
+        for i in range(start, start + rows):
+            writer.writerow([i, f'name {i}', i / 2])
+    return str(path)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'test.beedb')
+    conn.execute('PRAGMA journal_mode=WAL')
+    yield conn
+    conn.close()
+
+
+def test_load_batches_loads_and_infers_types(conn, tmp_path):
+    path = write_csv(tmp_path / 'a.csv', 2500)
+    report = ingest.load_batches(conn, 'a', ingest.read_csv(path, 1000), progress=None)
+
+    assert report['rows'] == 2500
+    assert conn.execute('SELECT count(*), sum(id) FROM a').fetchone() == (2500, sum(range(2500)))
+    types = {x[1]: x[2] for x in conn.execute('PRAGMA table_info(a)')}
+    assert types == {'id': 'INTEGER', 'name': 'TEXT', 'score': 'REAL'}
+
+
+def test_load_batches_rolls_back_when_progress_raises(conn, tmp_path):
+    path = write_csv(tmp_path / 'a.csv', 50_000)
+    synchronous = conn.execute('PRAGMA synchronous').fetchone()[0]
+
+    def progress(report):
+        if report['rows'] >= 3000:
+            raise RuntimeError('stop')
+
+    with pytest.raises(RuntimeError):
+        ingest.load_batches(conn, 'a', ingest.read_csv(path, 1000), transaction_rows=100_000, progress=progress)
+
+    assert not conn.in_transaction
+    assert conn.execute('SELECT count(*) FROM a').fetchone()[0] == 0
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == synchronous
+
+
+def test_load_batches_keeps_committed_transactions(conn, tmp_path):
+    path = write_csv(tmp_path / 'a.csv', 10_000)
+
+    def progress(report):
+        if report['rows'] >= 5000:
+            raise RuntimeError('stop')
+
+    with pytest.raises(RuntimeError):
+        ingest.load_batches(conn, 'a', ingest.read_csv(path, 1000), transaction_rows=2000, progress=progress)
+
+    # committed every 2000 rows: the batches after the last commit are rolled back.
+    assert conn.execute('SELECT count(*) FROM a').fetchone()[0] == 4000
+
+
+def test_load_files_streams_files_in_order(conn, tmp_path):
+    paths = [write_csv(tmp_path / f'{i}.csv', 3000, start=3000 * i) for i in range(4)]
+    with ThreadPoolExecutor(2) as executor:
+        report = ingest.load_files(conn, 'a', paths, executor=executor, max_pending=2, queue_batches=1,
+                                   batch_size=500, progress=None)
+
+    assert report['rows'] == 12_000
+    assert report['files'] == {path: 3000 for path in paths}
+    assert [x[0] for x in conn.execute('SELECT id FROM a ORDER BY rowid')] == list(range(12_000))
+    assert conn.execute(f'SELECT {ingest.SOURCE_FILE_COLUMN}, {ingest.SOURCE_ROW_COLUMN} FROM a WHERE id = 3001') \
+        .fetchone() == (paths[1], 2)
+
+
+def test_load_files_rolls_back_when_progress_raises(conn, tmp_path):
+    paths = [write_csv(tmp_path / f'{i}.csv', 3000, start=3000 * i) for i in range(3)]
+    synchronous = conn.execute('PRAGMA synchronous').fetchone()[0]
+
+    def progress(report):
+        if report['rows'] >= 4000:
+            raise RuntimeError('stop')
+
+    with ThreadPoolExecutor(2) as executor, pytest.raises(RuntimeError):
+        ingest.load_files(conn, 'a', paths, executor=executor, batch_size=500, progress=progress)
+
+    assert not conn.in_transaction
+    assert conn.execute('SELECT count(*) FROM a').fetchone()[0] == 0
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == synchronous
+
+
+def test_load_files_raises_a_parser_error(conn, tmp_path):
+    paths = [write_csv(tmp_path / '0.csv', 3000), str(tmp_path / 'missing.csv')]
+    with ThreadPoolExecutor(2) as executor, pytest.raises(FileNotFoundError):
+        ingest.load_files(conn, 'a', paths, executor=executor, batch_size=500, progress=None)
+
+    assert not conn.in_transaction
+    assert conn.execute('SELECT count(*) FROM a').fetchone()[0] == 0
+
+
+def test_load_files_in_its_own_process_pool(conn, tmp_path):
+    paths = [write_csv(tmp_path / f'{i}.csv', 20_000, start=20_000 * i) for i in range(3)]
+
+    def progress(report):
+        if report['rows'] >= 4000:
+            raise RuntimeError('stop')
+
+    # the workers still have batches queued when the load is abandoned, which must not keep the pool from closing.
+    with pytest.raises(RuntimeError):
+        ingest.load_files(conn, 'a', paths, max_pending=2, queue_batches=1, batch_size=500, progress=progress)
+    assert conn.execute('SELECT count(*) FROM a').fetchone()[0] == 0
+
+    report = ingest.load_files(conn, 'a', paths, max_pending=2, batch_size=5000, progress=None)
+    assert report['files'] == {path: 20_000 for path in paths}
+    assert [x[0] for x in conn.execute('SELECT id FROM a ORDER BY rowid')] == list(range(60_000))
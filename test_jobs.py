@@ -0,0 +1,98 @@
+"""
+Tests for the background jobs in `jobs`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+
+from connections import create_beed_engine
+from sqlmodels import Job
+import jobs
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_beed_engine(f'sqlite:///{tmp_path / "test.beedb"}')
+    Job.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql('CREATE TABLE t (x INTEGER)')
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(1) as executor:
+        yield executor
+
+
+def new_job(engine) -> int:
+    with engine.begin() as connection:
+        return connection.exec_driver_sql(f"INSERT INTO {jobs.JOB_TABLE} (kind, status, cancel_requested) "
+                                          "VALUES ('test', 'pending', 0)").lastrowid
+
+
+def insert_rows(ctx, rows):
+    ctx.conn.executemany('INSERT INTO t VALUES (?)', [(x,) for x in range(rows)])
+    ctx.progress(dict(rows=rows))
+    return dict(rows=rows)
+
+
+def test_job_records_its_result(engine, executor):
+    reports = list()
+    handle = jobs.submit(engine, executor, new_job(engine), insert_rows, args=(3,), on_progress=reports.append)
+
+    assert handle.result(timeout=10) == dict(rows=3)
+    row = handle.row()
+    assert (row['status'], row['result'], row['progress']) == ('done', dict(rows=3), dict(rows=3))
+    assert reports == [dict(rows=3)]
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT count(*) FROM t').scalar() == 3
+
+
+def test_failed_job_rolls_back(engine, executor):
+    def fail(ctx):
+        ctx.conn.execute('INSERT INTO t VALUES (1)')
+        raise ValueError('bad input')
+
+    handle = jobs.submit(engine, executor, new_job(engine), fail)
+
+    with pytest.raises(ValueError):
+        handle.result(timeout=10)
+    row = handle.row()
+    assert (row['status'], row['error']) == ('failed', 'ValueError: bad input')
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT count(*) FROM t').scalar() == 0
+
+
+def test_cancel_running_job(engine, executor):
+    started = threading.Event()
+
+    def run_until_cancelled(ctx):
+        started.set()
+        while True:
+            ctx.progress(dict(waiting=True))
+
+    handle = jobs.submit(engine, executor, new_job(engine), run_until_cancelled)
+    assert started.wait(10)
+
+    assert handle.cancel()
+    with pytest.raises(jobs.JobCancelled):
+        handle.result(timeout=10)
+    assert handle.status == 'cancelled'
+    assert not handle.cancel()
+
+
+def test_cancel_pending_job(engine, executor):
+    release = threading.Event()
+    blocker = jobs.submit(engine, executor, new_job(engine), lambda ctx: release.wait(10))
+    handle = jobs.submit(engine, executor, new_job(engine), insert_rows, args=(3,))
+
+    assert handle.cancel()
+    release.set()
+    blocker.result(timeout=10)
+
+    with pytest.raises(jobs.JobCancelled):
+        handle.result(timeout=10)
+    assert handle.status == 'cancelled'
@@ -0,0 +1,108 @@
+"""
+Tests for the column profiles in `profiling`.
+"""
+import sqlite3
+
+import pytest
+
+import profiling
+
+
+def mixed(i: int):
+    """
+    A low-cardinality value of several types, with NULLs and blanks.
+    """
+    return [None, '', 'a', 'bb', i % 5, (i % 3) / 2, f'2020-01-{i % 28 + 1:02d}'][i % 7]
+
+
+#: statistics which depend on the order rows were read in, which differs between a merge and a full profile.
+ORDER_DEPENDENT = {'state', 'registers'}
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (id INTEGER, name TEXT, score REAL)')
+    conn.executemany('INSERT INTO t VALUES (?, ?, ?)',
+                     [(i, None if i % 7 == 0 else f'name {i % 40}', i / 3) for i in range(1000)])
+    yield conn
+    conn.close()
+
+
+def test_profile_table(conn):
+    profiles = profiling.profile_table(conn, 't', ['id', 'name'])
+
+    assert profiles['id']['row_count'] == 1000
+    assert profiles['id']['distinct_count'] == 1000
+    assert profiles['name']['null_count'] == len(range(0, 1000, 7))
+    assert profiles['name']['distinct_count'] == 40
+
+
+def test_profile_table_rejects_missing_columns(conn):
+    # quoted, an unknown name would otherwise be profiled as the constant string 'gone'.
+    with pytest.raises(ValueError, match='gone'):
+        profiling.profile_table(conn, 't', ['id', 'gone'])
+
+
+
+def test_sampled_profile_bounds_and_seed(conn):
+    profiles = profiling.profile_table(conn, 't', ['id', 'name'], sample_size=200, seed=3)
+
+    assert profiles == profiling.profile_table(conn, 't', ['id', 'name'], sample_size=200, seed=3)
+    assert profiles != profiling.profile_table(conn, 't', ['id', 'name'], sample_size=200, seed=4)
+    name = profiles['name']
+    assert name['is_approximate'] and name['sample_size'] == 200
+    assert abs(name['null_ratio'] - len(range(0, 1000, 7)) / 1000) <= name['null_ratio_error']
+    assert name['distinct_low'] <= 40 <= name['distinct_high']
+    assert profiles['id']['distinct_low'] <= 1000 <= profiles['id']['distinct_high']
+
+@pytest.fixture
+def appended():
+    """
+    A table of 1000 rows, then 500 appended whose values partly repeat the first.
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (id INTEGER, mark INTEGER, mixed)')
+    conn.executemany('INSERT INTO t VALUES (?, ?, ?)', [(i, i % 13, mixed(i)) for i in range(1000)])
+    conn.executemany('INSERT INTO t VALUES (?, ?, ?)', [(i, i % 17, mixed(i * 3)) for i in range(800, 1300)])
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('approximate', [False, True])
+def test_merge_profile_matches_full_profile(appended, approximate):
+    columns = ['id', 'mark', 'mixed']
+    before = profiling.profile_table(appended, 't', columns, approximate=approximate, max_rowid=1000)
+    delta = profiling.profile_table(appended, 't', columns, approximate=approximate, after_rowid=1000, max_rowid=1500)
+    shared = profiling.shared_distinct(appended, 't', columns, 1000, 1500) if not approximate else dict()
+    full = profiling.profile_table(appended, 't', columns, approximate=approximate)
+
+    for column in columns:
+        merged = profiling.merge_profile(
+            before[column]['state'], delta[column], 5, shared.get(column), before[column]['registers'])
+        expected = {k: v for k, v in full[column].items() if k not in ORDER_DEPENDENT}
+        if column == 'id':
+            # more distinct values than Space-Saving counters: the top values are approximate either way.
+            expected.pop('top_values')
+        assert {k: merged[k] for k in expected} == expected, column
+
+        # and the merged state merges again as a full one would.
+        assert profiling.profile_from_state(merged['state'])['distinct_count'] == full[column]['distinct_count']
+
+
+def test_shared_distinct(appended):
+    shared = profiling.shared_distinct(appended, 't', ['id', 'mark', 'mixed'], 1000, chunk_size=2)
+
+    def distinct(column, where):
+        return {x[0] for x in appended.execute(f'SELECT {column} FROM t WHERE {where} AND {column} IS NOT NULL')}
+
+    for column in ('id', 'mark', 'mixed'):
+        assert shared[column] == len(distinct(column, 'rowid <= 1000') & distinct(column, 'rowid > 1000')), column
+
+
+def test_merge_profile_rejects_other_distinct_counts(appended):
+    before = profiling.profile_table(appended, 't', ['mark'], max_rowid=1000)
+    delta = profiling.profile_table(appended, 't', ['mark'], approximate=True, after_rowid=1000)
+
+    with pytest.raises(ValueError):
+        profiling.merge_profile(before['mark']['state'], delta['mark'], registers=before['mark']['registers'])
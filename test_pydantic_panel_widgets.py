@@ -0,0 +1,98 @@
+"""
+Tests for the Panel editors in `pydantic_panel_widgets`.
+"""
+import pytest
+
+from sqlmodels import BeeDiscovery
+from pydantic_panel_widgets import DatasetEditor
+
+
+@pytest.fixture
+def bee(tmp_path):
+    bee = BeeDiscovery.load(str(tmp_path / 'test.beedb'))
+    conn = bee.db.conn
+    conn.execute('CREATE TABLE students (id INTEGER, name TEXT, mark REAL)')
+    conn.executemany('INSERT INTO students VALUES (?, ?, ?)', [(i, f'student {i}', i % 10) for i in range(100)])
+    conn.commit()
+    bee.sync_all(create_missing=True)
+    bee._session.commit()
+    yield bee
+    bee._session.close()
+
+
+def _open_cards(editor: DatasetEditor) -> dict:
+    for placeholder in editor._card_column:
+        placeholder.collapsed = False
+    return {x.value.name: x for x in editor._cards}
+
+
+def test_refused_role_edit_reverts_the_card(bee):
+    key = bee.ensure_roles(['KEY'], is_unique=True)['KEY']
+    dataset = bee['students']
+    bee.set_field_roles([(dataset.fields[0], [key])])
+    editor = DatasetEditor(value=dataset)
+    cards = _open_cards(editor)
+
+    cards['name']._selected_roles.value = [key]
+
+    assert [x.name for x in key.fields] == ['id']
+    assert cards['name']._selected_roles.value == []
+    assert 'KEY' in editor._status.value and 'not changed' in editor._status.value
+    assert not editor.role_edits._pending
+
+    # the next edit is written as usual.
+    cards['id']._selected_roles.value = []
+    cards['name']._selected_roles.value = [key]
+    assert [x.name for x in key.fields] == ['name']
+
+
+def test_header_shows_the_cached_row_count(bee):
+    dataset = bee['students']
+    editor = DatasetEditor(value=dataset)
+    assert editor._header.object.endswith('rows not counted yet')
+
+    dataset.refresh_row_count()
+    editor.refresh_header()
+
+    counted_at = dataset.row_count_record.counted_at
+    assert editor._header.object.endswith(f"100 rows, counted {counted_at:%Y-%m-%d %H:%M} (may be stale)")
+
+
+def test_editor_builds_only_the_opened_cards_of_a_page(bee):
+    conn = bee.db.conn
+    conn.execute(f"CREATE TABLE wide ({', '.join(f'c{i} TEXT' for i in range(45))})")
+    conn.commit()
+    bee.sync_all(create_missing=True)
+    editor = DatasetEditor(value=bee['wide'], page_size=20)
+
+    assert len(editor._card_column) == 20 and not editor._cards
+    assert editor._page_label.value == 'page 1 of 3 (45 fields)'
+    editor.page = 3
+    assert [x.title for x in editor._card_column] == ['c40', 'c41', 'c42', 'c43', 'c44']
+
+    editor._card_column[0].collapsed = False
+    editor._card_column[1].collapsed = False
+    assert [x.value.name for x in editor._cards] == ['c40', 'c41']
+    assert all(x.role_options is editor.role_options for x in editor._cards)
+    assert editor._table.pagination == 'remote'
+
+
+def test_bulk_edit_refuses_a_unique_role_on_several_fields(bee):
+    roles = bee.ensure_roles(['TAG'])
+    key = bee.ensure_roles(['KEY'], is_unique=True)['KEY']
+    dataset = bee['students']
+    editor = DatasetEditor(value=dataset)
+
+    editor._bulk_role.value = roles['TAG']
+    editor._table.selection = [0, 1]
+    editor._bulk_edit(add=True)
+    assert [x.name for x in roles['TAG'].fields] == ['id', 'name']
+
+    editor._bulk_role.value = key
+    editor._bulk_edit(add=True)
+    assert 'can only be on one field' in editor._status.value
+    assert key.fields == []
+
+    editor._table.selection = [2]
+    editor._bulk_edit(add=True)
+    assert [x.name for x in key.fields] == ['mark']
@@ -0,0 +1,63 @@
+"""
+Tests for the role-driven queries in `queries`.
+"""
+import sqlite3
+
+import pytest
+
+import queries
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE mail ("from" TEXT, sent TEXT, size INTEGER)')
+    conn.executemany('INSERT INTO mail VALUES (?, ?, ?)', [(f'user{i % 3}', f'2020-01-{i + 1:02d}', i) for i in range(25)])
+    conn.execute('CREATE TABLE chat (author TEXT)')
+    conn.executemany('INSERT INTO chat VALUES (?)', [('user1',), ('user9',)])
+    yield conn
+    conn.close()
+
+
+def test_compile_select_maps_roles_to_columns(conn):
+    sql = queries.compile_select('mail', {'SENDER': 'from', 'SUBJECT': None}, where='{SENDER} = ? AND {SIZE} < ?',
+                                 roles={'SENDER': 'from', 'SUBJECT': None, 'SIZE': 'size'})
+    rows = conn.execute(sql, ('user1', 10)).fetchall()
+
+    assert rows == [('user1', None)] * 3
+
+
+def test_compile_select_rejects_unknown_roles():
+    with pytest.raises(ValueError, match='DATE'):
+        queries.compile_select('mail', {'SENDER': 'from'}, where='{DATE} > ?')
+
+
+def test_compile_union(conn, monkeypatch):
+    sources = [(1, 'mail', {'SENDER': 'from'}), (2, 'chat', {'SENDER': 'author'}), (3, 'chat', {})]
+    expected = conn.execute(queries.compile_union(sources, ['SENDER'])).fetchall()
+
+    # nested in groups past SQLite's compound SELECT limit, with the same rows.
+    monkeypatch.setattr(queries, 'MAX_COMPOUND_SELECT', 2)
+    assert conn.execute(queries.compile_union(sources, ['SENDER'])).fetchall() == expected
+    assert len(expected) == 29 and expected[-1] == (3, 2, None)
+    assert conn.execute(queries.compile_union([], ['SENDER'])).fetchall() == []
+
+
+def test_stream_in_chunks(conn):
+    sql = queries.compile_select('mail', {'SENDER': 'from', 'SIZE': 'size'})
+    batches = list(queries.stream(conn, sql, ['SENDER', 'SIZE'], chunk_size=10))
+
+    assert [len(x['SIZE']) for x in batches] == [10, 10, 5]
+    assert sum(sum(x['SIZE']) for x in batches) == sum(range(25))
+
+
+def test_to_numpy_types():
+    assert queries.to_numpy([1, 2]).dtype.kind == 'i'
+    assert queries.to_numpy([1, None, 2.5]).dtype.kind == 'f'
+    assert queries.to_numpy([1, 'a']).dtype.kind == 'O'
+
+
+def test_stream_rejects_unknown_formats(conn):
+    with pytest.raises(ValueError):
+        # raised on the first step, before any query runs.
+        next(queries.stream(conn, 'SELECT 1', ['x'], format='csv'))
@@ -0,0 +1,422 @@
+"""
+Tests for the BeeDiscovery metadata models in `sqlmodels`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+
+import pytest
+
+from sqlalchemy import event
+from sqlalchemy.orm.exc import NoResultFound
+
+from sqlite_utils.db import Column
+
+from sqlmodels import BeeDiscovery, Dataset, DataField, DataRole, _bulk_create_datafields, _setup_role
+
+
+@pytest.fixture
+def bee(tmp_path):
+    bee = BeeDiscovery.load(str(tmp_path / 'test.beedb'))
+    conn = bee.db.conn
+    conn.execute('CREATE TABLE students (id INTEGER, name TEXT, mark REAL)')
+    conn.executemany('INSERT INTO students VALUES (?, ?, ?)', [(i, f'student {i}', i % 10) for i in range(100)])
+    conn.commit()
+    bee.sync_all(create_missing=True)
+    bee._session.commit()
+    yield bee
+    bee._session.close()
+
+
+def test_profile_skips_fields_of_dropped_columns(bee):
+    dataset = bee['students']
+    bee.db.conn.execute('ALTER TABLE students DROP COLUMN mark')
+    bee.db.conn.commit()
+
+    profiles = dataset.profile()
+
+    assert profiles['mark'] is None
+    assert profiles['id'].distinct_count == 100
+
+
+def test_describe_postings_of_deleted_fields(bee):
+    dataset = bee['students']
+    field = dataset.fields[0]
+    postings = [(1, 1, dataset.id, field.id, 5), (1, 1, dataset.id, 10_000, 5)]
+
+    described = bee._describe_postings(postings, values=True)
+
+    assert described[0]['field'] == field.name and described[0]['value'] is not None
+    assert described[1]['field'] is None and described[1]['value'] is None
+
+
+def test_set_field_roles_keeps_unique_roles_unique(bee):
+    dataset = bee['students']
+    id_, name, mark = dataset.fields[:3]
+    key = bee.ensure_roles(['KEY'], is_unique=True)['KEY']
+
+    with pytest.raises(ValueError, match='KEY'):
+        bee.set_field_roles([(id_, [key]), (name, [key])])
+    bee.set_field_roles([(id_, [key])])
+    # counting the existing link of a field which isn't reassigned.
+    with pytest.raises(ValueError, match='KEY'):
+        bee.set_field_roles([(name, [key])])
+
+    assert bee.set_field_roles([(id_, []), (name, [key])]) == dict(added=1, removed=1)
+    assert [x.name for x in key.fields] == [name.name]
+
+
+def test_unique_roles_are_checked_per_dataset_not_per_name(bee):
+    students = bee['students']
+    bee.db.conn.execute('CREATE TABLE students_2020 (id INTEGER)')
+    bee.db.conn.commit()
+    other = Dataset(name='students', table='students_2020', beediscovery=bee)
+    bee._session.commit()
+    bee.sync_all(create_missing=True)
+    key = bee.ensure_roles(['KEY'], is_unique=True)['KEY']
+
+    assert bee.set_field_roles([(students.fields[0], [key]), (other.fields[0], [key])]) == dict(added=2, removed=0)
+
+
+def test_repr_reads_the_cached_row_count(bee):
+    dataset = bee['students']
+    dataset.refresh_row_count()
+
+    statements = list()
+    event.listen(bee._engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    bee.db.conn.set_trace_callback(statements.append)
+    texts = repr(bee), repr(dataset)
+    bee.db.conn.set_trace_callback(None)
+
+    assert all('students, 100' in x for x in texts)
+    # only the metadata tables are read.
+    assert not [x for x in statements if 'FROM students' in x or 'FROM "students"' in x]
+
+
+def test_ingest_job_syncs_only_its_dataset(bee, tmp_path):
+    bee.db.conn.execute('CREATE TABLE other (id INTEGER)')
+    bee.db.conn.commit()
+    path = tmp_path / 'more.csv'
+    path.write_text('id,name,mark,grade\n100,new,5,A\n')
+
+    with ThreadPoolExecutor(1) as executor:
+        report = bee['students'].ingest_job(str(path), executor=executor).result(timeout=60)
+
+    assert report['rows'] == 1
+    assert report['sync'] == dict(matched=3, extra=[], created=['grade'])
+    # the new table is left untracked, as it would be by `Dataset.ingest`.
+    assert 'other' not in {x.table for x in bee.datasets}
+
+
+def test_setup_role_resolves_known_names_only(bee):
+    key = bee.ensure_roles(['KEY'])['KEY']
+
+    assert _setup_role(bee._session, DataRole(name='KEY')) is key
+    with pytest.raises(NoResultFound):
+        _setup_role(bee._session, DataRole(name='MISSING'))
+
+
+def test_savepoint_rollback_resets_role_registry(bee):
+    with pytest.raises(RuntimeError):
+        with bee._session.begin_nested():
+            bee.ensure_roles(['TEMP'])
+            raise RuntimeError('undo')
+
+    assert 'TEMP' not in bee.roles_by_name
+
+
+def test_sync_columns_returns_the_created_fields(bee):
+    dataset = bee['students']
+    bee.db.conn.execute('ALTER TABLE students ADD COLUMN grade TEXT')
+    bee.db.conn.commit()
+
+    report = dataset.sync_columns()
+
+    assert [(x.name, x.dataset_id) for x in report['created']] == [('grade', dataset.id)]
+    assert len(report['matched_datafields']) == 3
+    assert dataset.fields[-1].db_name == 'grade'
+
+
+def test_bulk_created_fields_exclude_existing_fields_with_the_same_key(bee):
+    dataset = bee['students']
+    session = bee._session
+    existing = DataField(name='grade', db_name='grade', db_type='TEXT', dataset=dataset)
+    session.add(existing)
+    session.flush()
+
+    created = _bulk_create_datafields(session, {dataset.id: [Column(3, 'grade', 'TEXT', 0, None, 0)]})
+
+    assert len(created) == 1 and created[0].id > existing.id
+
+
+def test_sync_all_reports_datasets_by_id(bee):
+    bee.db.conn.execute('CREATE TABLE students_2020 (id INTEGER)')
+    bee.db.conn.commit()
+    # a second Dataset with the same name, over another table.
+    other = Dataset(name='students', table='students_2020', beediscovery=bee)
+    bee._session.commit()
+
+    report = bee.sync_all()
+
+    assert set(report['datasets']) == {x.id for x in bee.datasets}
+    assert report['datasets'][other.id]['table'] == 'students_2020'
+    assert [x.name for x in report['datasets'][other.id]['created']] == ['id']
+
+
+def test_sync_all_job_summarises_datasets_by_id(bee):
+    bee.db.conn.execute('CREATE TABLE other (id INTEGER)')
+    bee.db.conn.commit()
+
+    with ThreadPoolExecutor(1) as executor:
+        report = bee.sync_all_job(create_missing=True, executor=executor).result(timeout=60)
+
+    students = bee['students']
+    assert report['datasets'][students.id] == dict(name='students', table='students', matched=3, extra=[], created=[])
+    assert report['untracked_tables'] == ['other']
+
+
+def test_refresh_changes_sees_a_replaced_last_row(bee):
+    dataset = bee['students']
+    conn = bee.db.conn
+    generation = dataset.refresh_changes()['generation']
+    assert dataset.refresh_changes()['generation'] == generation
+
+    # the new row takes the deleted row's rowid, so neither the high-water mark nor the count changes.
+    conn.execute('DELETE FROM students WHERE rowid = (SELECT max(rowid) FROM students)')
+    conn.execute("INSERT INTO students VALUES (1000, 'replacement', 1)")
+    conn.commit()
+    change = dataset.refresh_changes()
+
+    assert (change['new_rows'], change['row_count']) == (0, 100)
+    assert change['rewritten'] and change['generation'] == generation + 1
+
+
+def test_profile_merges_appended_rows(bee):
+    dataset = bee['students']
+    dataset.profile()
+    bee.db.conn.executemany('INSERT INTO students VALUES (?, ?, ?)', [(i, f'student {i}', i % 13) for i in range(100, 150)])
+    bee.db.conn.commit()
+
+    merged = {name: profile.distinct_count for name, profile in dataset.profile().items()}
+    assert dataset.fields[0].profile_generation == dataset.generation
+    full = {name: profile.distinct_count for name, profile in dataset.profile(refresh=True).items()}
+
+    assert merged == full == dict(id=150, name=150, mark=13)
+
+
+def test_sampled_profile_only_checks_changes_by_rowid(bee):
+    dataset = bee['students']
+    generation = dataset.refresh_changes()['generation']
+    bee.db.conn.executemany('INSERT INTO students VALUES (?, ?, ?)', [(i, f'student {i}', 1) for i in range(100, 110)])
+    bee.db.conn.commit()
+
+    statements = list()
+    event.listen(bee._engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    dataset.profile(sample_size=20, seed=1)
+
+    counts = [x for x in statements if 'count(*)' in x and 'FROM "students"' in x]
+    assert counts and all('rowid >' in x for x in counts)
+    assert not [x for x in statements if 'ORDER BY rowid DESC' in x]
+    assert dataset.generation == generation + 1
+
+
+def test_roles_index_follows_role_changes(bee):
+    dataset = bee['students']
+    id_, name, mark = dataset.fields[:3]
+    tag = bee.ensure_roles(['TAG'])['TAG']
+    bee.set_field_roles([(id_, [tag]), (name, [tag])])
+
+    assert dataset.roles == dict(TAG=[id_, name])
+    statements = list()
+    event.listen(bee._engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    assert dataset.r.TAG == [id_, name]
+    assert not statements
+
+    # kept up to date by the collection events, without a rebuild.
+    name.roles.remove(tag)
+    mark.roles.append(tag)
+    assert dataset.r.TAG == [id_, mark]
+    assert dataset.roles == dict(TAG=[id_, mark])
+
+
+def test_roles_available_offers_unique_roles_until_taken(bee):
+    dataset = bee['students']
+    id_, name = dataset.fields[:2]
+    roles = bee.ensure_roles(['TAG', 'ALIAS'])
+    key = bee.ensure_roles(['KEY'], is_unique=True)['KEY']
+
+    assert [x.name for x in dataset.roles_available] == ['ALIAS', 'KEY', 'TAG']
+    bee.set_field_roles([(id_, [key]), (name, [roles['TAG']])])
+    assert [x.name for x in dataset.roles_available] == ['ALIAS', 'TAG']
+    # the field holding a unique role can still keep it.
+    assert [x.name for x in id_.roles_available] == ['ALIAS', 'TAG', 'KEY']
+
+    bee.set_field_roles([(id_, [])])
+    assert [x.name for x in dataset.roles_available] == ['ALIAS', 'KEY', 'TAG']
+
+
+def test_open_readonly_refuses_writes(bee):
+    bee.ensure_roles(['TAG'])
+    bee._session.commit()
+    reviewer = BeeDiscovery.open_readonly(bee.beed_file_path)
+
+    assert reviewer.readonly
+    assert [x.name for x in reviewer['students'].fields] == ['id', 'name', 'mark']
+    assert 'TAG' in reviewer.roles_by_name
+    with pytest.raises(sqlite3.OperationalError, match='readonly'):
+        reviewer.db.conn.execute('INSERT INTO students VALUES (1000, NULL, NULL)')
+    with pytest.raises(ValueError, match='read-only'):
+        reviewer.role_view(['TAG'])
+    reviewer._session.close()
+
+    with pytest.raises(FileNotFoundError):
+        BeeDiscovery.open_readonly(bee.beed_file_path + '.missing')
+
+
+def test_load_is_lazy_and_prefetch_loads_everything(bee):
+    bee.set_field_roles([(bee['students'].fields[0], [bee.ensure_roles(['TAG'])['TAG']])])
+    bee._session.commit()
+    path = bee.beed_file_path
+    bee._session.close()
+
+    reopened = BeeDiscovery.load(path)
+    assert not [x for x in reopened._session.identity_map.values() if isinstance(x, Dataset)]
+    assert [(x['name'], x['field_count']) for x in reopened.dataset_index()] == [('students', 3)]
+    assert not [x for x in reopened._session.identity_map.values() if isinstance(x, Dataset)]
+
+    reopened.prefetch()
+    statements = list()
+    event.listen(reopened._engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    assert [[y.name for y in x.roles] for x in reopened.datasets[0].fields] == [['TAG'], [], []]
+    assert not statements
+    reopened._session.close()
+
+
+def test_attribute_views_are_kept_up_to_date(bee):
+    dataset = bee['students']
+    id_, name, mark = dataset.fields[:3]
+    fields, datasets = dataset.f, bee.d
+
+    mark.name = 'final mark'
+    name.name = 'id'
+    dataset.name = 'pupils'
+
+    assert dataset.f is fields and bee.d is datasets
+    assert fields.finalmark is mark and not hasattr(fields, 'mark')
+    assert fields.id == [id_, name]
+    assert sorted(dir(fields)) == ['finalmark', 'id']
+    assert datasets.pupils is dataset and not hasattr(datasets, 'students')
+
+    name.name = 'name'
+    assert fields.id is id_ and fields.name is name
+
+    key = bee.ensure_roles(['KEY'], is_unique=True)['KEY']
+    available = dataset.ra
+    assert available.KEY is key
+    id_.roles.append(key)
+    assert dataset.ra is available and not hasattr(available, 'KEY')
+    assert dataset.r.KEY is id_
+
+
+def test_preview_nonblank_reads_all_fields_in_one_scan(bee):
+    conn = bee.db.conn
+    conn.execute('ALTER TABLE students ADD COLUMN [odd "name"]')
+    conn.execute("UPDATE students SET name = '' WHERE id < 3")
+    conn.execute('UPDATE students SET [odd "name"] = ? WHERE id IN (5, 50)', ['x'])
+    conn.commit()
+    dataset = bee['students']
+    dataset.sync_columns()
+
+    statements = list()
+    conn.set_trace_callback(statements.append)
+    preview = dataset.preview_nonblank(2)
+    conn.set_trace_callback(None)
+
+    assert preview == {'id': [0, 1], 'name': ['student 3', 'student 4'], 'mark': [0.0, 1.0], 'odd "name"': ['x', 'x']}
+    assert len([x for x in statements if x.startswith('SELECT rowid')]) == 1
+
+
+def test_assign_roles_rules(bee):
+    bee.db.conn.execute('CREATE TABLE staff (staff_id INTEGER, email_address TEXT, mark REAL)')
+    bee.db.conn.commit()
+    bee.sync_all(create_missing=True)
+    students = bee['students']
+    students.profile()
+    rules = [
+        dict(role='ID', name='(?i)id$', is_unique=True),
+        dict(role='MARK', db_name='^mark$', datasets=['students']),
+        dict(role='VARIED', profile=dict(distinct_count=('>', 50))),
+        dict(role='KEYISH', name='^(id|name)$', is_unique=True),
+        ]
+
+    dry_run = bee.assign_roles(rules, dry_run=True)
+    assert 'ID' not in bee.roles_by_name and students.roles == {}
+    report = bee.assign_roles(rules)
+    assert [x['added'] for x in dry_run] == [x['added'] for x in report]
+
+    by_role = {x['role']: x for x in report}
+    assert by_role['ID']['added'] == [('staff', 'staff_id'), ('students', 'id')]
+    assert by_role['MARK']['added'] == [('students', 'mark')]
+    # only profiled fields match profile criteria.
+    assert by_role['VARIED']['added'] == [('students', 'id'), ('students', 'name')]
+    # a unique role matching two fields of a Dataset is put on neither.
+    assert by_role['KEYISH']['skipped'] == [('students', 'id'), ('students', 'name')]
+    assert students.roles == dict(ID=students.f.id, MARK=students.f.mark, VARIED=[students.f.id, students.f.name])
+
+
+def test_role_view_is_rebuilt_when_role_columns_change(bee):
+    conn = bee.db.conn
+    conn.execute('CREATE TABLE staff (staff_id INTEGER, full_name TEXT)')
+    conn.executemany('INSERT INTO staff VALUES (?, ?)', [(i, f'staff {i}') for i in range(5)])
+    conn.commit()
+    bee.sync_all(create_missing=True)
+    students, staff = bee['students'], bee['staff']
+    role = bee.ensure_roles(['PERSON'])['PERSON']
+    bee.set_field_roles([(students.f.name, [role])])
+
+    view = bee.role_view(['PERSON'])
+    assert view.count == 100
+
+    # a new Dataset with the role, and the role moved to another column, are picked up on commit.
+    bee.set_field_roles([(staff.f.full_name, [role]), (students.f.name, []), (students.f.id, [role])])
+    bee._session.commit()
+
+    rows = conn.execute('SELECT dataset_id, "PERSON" FROM roles_PERSON ORDER BY dataset_id, row_id').fetchall()
+    assert len(rows) == 105
+    assert rows[0] == (students.id, 0) and (staff.id, 'staff 0') in rows
+
+    # a dropped table leaves the view once it is refreshed, rather than breaking it.
+    conn.execute('DROP TABLE staff')
+    conn.commit()
+    assert bee.refresh_role_views() == dict(roles_PERSON=1)
+    assert conn.execute('SELECT count(*) FROM roles_PERSON').fetchone()[0] == 100
+
+
+def test_advise_build_and_drop_indexes(bee):
+    dataset = bee['students']
+    roles = bee.ensure_roles(['TAG'])
+    key = bee.ensure_roles(['KEY'], is_unique=True)['KEY']
+    bee.set_field_roles([(dataset.f.id, [key]), (dataset.f.name, [roles['TAG']]), (dataset.f.mark, [roles['TAG']])])
+    dataset.profile()
+    bee._session.commit()
+
+    proposals = bee.advise_indexes(min_rows=50, min_distinct=50)
+    # mark has only 10 distinct values.
+    assert [(x['name'], x['column']) for x in proposals] == [('beed_idx_students_id', 'id'), ('beed_idx_students_name', 'name')]
+
+    # a user's index which happens to have the name of a proposal is neither taken over nor dropped.
+    bee.db.conn.execute('CREATE INDEX beed_idx_students_name ON students (mark)')
+    bee.db.conn.commit()
+    with ThreadPoolExecutor(1) as executor:
+        with pytest.raises(ValueError, match='beed_idx_students_name'):
+            bee.build_indexes(proposals, executor=executor).result(timeout=60)
+
+    assert [x.name for x in bee.list_indexes()] == ['beed_idx_students_id']
+    proposals = bee.advise_indexes(min_rows=50, min_distinct=50)
+    assert [x['name'] for x in proposals] == ['beed_idx_students_name_2']
+    with ThreadPoolExecutor(1) as executor:
+        bee.build_indexes(proposals, executor=executor).result(timeout=60)
+
+    assert bee.advise_indexes(min_rows=50, min_distinct=50) == []
+    assert bee.drop_indexes() == ['beed_idx_students_id', 'beed_idx_students_name_2']
+    indexes = bee.db.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'students'")
+    assert [x[0] for x in indexes] == ['beed_idx_students_name']
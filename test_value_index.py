@@ -0,0 +1,74 @@
+"""
+Tests for the value hash index in `value_index`.
+"""
+import sqlite3
+
+import pytest
+
+import value_index
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(f"""
+        CREATE TABLE {value_index.POSTINGS_TABLE} (
+            hash INTEGER, role_id INTEGER, dataset_id INTEGER, field_id INTEGER, row_id INTEGER,
+            PRIMARY KEY (hash, role_id, dataset_id, field_id, row_id)) WITHOUT ROWID;
+        CREATE TABLE {value_index.SOURCES_TABLE} (
+            field_id INTEGER, role_id INTEGER, dataset_id INTEGER, normalizer TEXT, max_rowid INTEGER,
+            postings INTEGER, updated_at TEXT, PRIMARY KEY (field_id, role_id));
+        CREATE TABLE people (email TEXT);
+        CREATE TABLE mail (sender TEXT);
+        """)
+    conn.executemany('INSERT INTO people VALUES (?)', [(f'user{i}@corp.com',) for i in range(100)] + [(None,), ('',)])
+    conn.executemany('INSERT INTO mail VALUES (?)', [(f'Name <USER{i}@corp.com>',) for i in range(50, 150)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_normalize():
+    assert value_index.normalize('  Jane   DOE ') == 'jane doe'
+    assert value_index.normalize(5.0) == value_index.normalize('5')
+    assert value_index.normalize('Jane <mailto:Jane@Corp.com>', 'email') == 'jane@corp.com'
+    assert value_index.normalize('   ') is None
+
+
+def test_index_sources_lookup_and_overlap(conn):
+    added = value_index.index_sources(conn, [
+        ('people', 'email', 1, 1, 10, 'email', 0),
+        ('mail', 'sender', 1, 2, 20, 'email', 0),
+        ], window=30, batch_postings=40)
+
+    assert added == {(10, 1): 100, (20, 1): 100}
+    postings = value_index.lookup(conn, [value_index.value_hash('user60@corp.com', 'email')])
+    assert sorted(x[2:] for x in postings) == [(1, 10, 61), (2, 20, 11)]
+
+    result = value_index.overlap(conn, 1, 2, examples=3)
+    assert (result['a_distinct'], result['b_distinct'], result['shared']) == (100, 100, 50)
+    assert len(result['examples']) == 3
+
+
+def test_index_sources_resumes_after_high_water_mark(conn):
+    value_index.index_sources(conn, [('people', 'email', 1, 1, 10, 'email', 0)])
+    conn.execute("INSERT INTO people VALUES ('new@corp.com')")
+    conn.commit()
+
+    added = value_index.index_sources(conn, [('people', 'email', 1, 1, 10, 'email', 102)])
+
+    assert added == {(10, 1): 1}
+
+
+def test_index_sources_skips_missing_columns(conn):
+    # quoted, the missing column would be read as the string 'gone', and that hashed for every row.
+    added = value_index.index_sources(conn, [('people', 'gone', 1, 1, 10, 'text', 0)])
+
+    assert added == {}
+    assert conn.execute(f'SELECT count(*) FROM {value_index.POSTINGS_TABLE}').fetchone()[0] == 0
+    assert conn.execute(f'SELECT count(*) FROM {value_index.SOURCES_TABLE}').fetchone()[0] == 0
+
+
+def test_index_sources_rejects_unknown_normalizers(conn):
+    with pytest.raises(ValueError):
+        value_index.index_sources(conn, [('people', 'email', 1, 1, 10, 'soundex', 0)])
@@ -0,0 +1,253 @@
+"""
+A persistent index of the values of chosen DataRoles, for matching entities across Datasets.
+
+Every non-blank value of a column carrying an indexed role is normalised (e.g. trimmed and case-folded) and hashed to
+a 64-bit integer, and stored as a posting (hash, role_id, dataset_id, field_id, row_id) in `__beed_value_index`.
+The postings are clustered by hash (a WITHOUT ROWID table), so "where does this value appear" is one index seek,
+and a second index by (dataset, hash) makes the overlap of two Datasets one ordered read of the smaller side's hashes
+and an index probe per hash in the other, without reading the source tables.
+
+Each indexed (field, role) source records the highest rowid indexed so far, so updates only read the rows added
+since (e.g. by an ingest). Values are hashed in SQL by a function registered on the connection, and the postings are
+merged into the index in hash order, a batch at a time.
+"""
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Iterable
+import hashlib
+import re
+import sqlite3
+
+from helpers import quote_identifier, table_columns
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+POSTINGS_TABLE = '__beed_value_index'
+SOURCES_TABLE = '__beed_value_index_source'
+ROLES_TABLE = '__beed_value_index_role'
+#: postings are staged here (in the connection's temp database) before being merged into the index.
+STAGE_TABLE = 'temp.beed_value_stage'
+
+_DISPLAY_NAME = re.compile(r'<([^<>]+)>')
+
+
+def _text(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        # so that 5, 5.0 and '5' match.
+        value = int(value)
+    return ' '.join(str(value).split()).casefold()
+
+
+def _email(value) -> str:
+    text = _text(value)
+    if '<' in text:
+        match = _DISPLAY_NAME.search(text)
+        text = match.group(1).strip() if match else text
+    return text[len('mailto:'):] if text.startswith('mailto:') else text
+
+
+#: normaliser name -> function from a (non-null) value to the text which is hashed.
+NORMALIZERS = {
+    # whitespace collapsed, trimmed and case-folded; integral floats as integers.
+    'text': _text,
+    # the value as text, unchanged.
+    'exact': str,
+    # only the digits, e.g. for phone or account numbers.
+    'digits': lambda value: re.sub(r'\D', '', str(value)),
+    # as 'text', without a mailto: prefix or display name ("Name <address>").
+    'email': _email,
+}
+
+
+def normalize(value, normalizer: str = 'text') -> str | None:
+    """
+    Return the normalised text of `value`, or None for NULL and values which normalise to nothing.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    return NORMALIZERS[normalizer](value) or None
+
+
+@lru_cache(maxsize=2**16, typed=True)
+def value_hash(value, normalizer: str = 'text') -> int | None:
+    """
+    Return the signed 64-bit hash of the normalised `value`, as stored in the postings, or None.
+    Cached, as identifiers such as email addresses repeat many times within and across tables.
+    """
+    text = normalize(value, normalizer)
+    if text is None:
+        return None
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def register_functions(conn: sqlite3.Connection):
+    """
+    Register `beed_value_hash(value, normalizer)` on a connection.
+    """
+    conn.create_function('beed_value_hash', 2, value_hash, deterministic=True)
+
+
+def index_sources(
+    conn: sqlite3.Connection,
+    sources: list[tuple[str, str, int, int, int, str, int]],
+    window: int = 100_000,
+    batch_postings: int = 500_000,
+    progress: Callable[[dict], None] = None,
+    ) -> dict[tuple[int, int], int]:
+    """
+    Add the postings of the rows after the high-water mark of each (table, column, role_id, dataset_id, field_id,
+    normalizer, after_rowid) source, reading `window` rowids at a time.
+
+    Postings are staged in a temporary table and merged into the index in hash order about `batch_postings` at a time,
+    which visits each page of the index once, rather than once per value in random order. Each merge is committed
+    with the new high-water marks of its sources, so an interrupted build resumes where it stopped.
+    Sources whose column no longer exists are skipped with a warning.
+    Returns the number of postings added per (field_id, role_id).
+    """
+    register_functions(conn)
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {STAGE_TABLE} "
+                 "(hash INTEGER, role_id INTEGER, dataset_id INTEGER, field_id INTEGER, row_id INTEGER)")
+
+    added = dict()
+    #: (field_id, role_id) -> [dataset_id, normalizer, high-water mark, postings] of the staged sources.
+    pending = dict()
+
+    def merge():
+        with conn:
+            conn.execute(f"""
+                INSERT OR IGNORE INTO {POSTINGS_TABLE} (hash, role_id, dataset_id, field_id, row_id)
+                SELECT hash, role_id, dataset_id, field_id, row_id FROM {STAGE_TABLE}
+                ORDER BY hash, role_id, dataset_id, field_id, row_id
+                """)
+            for (field_id, role_id), (dataset_id, normalizer, max_rowid, count) in pending.items():
+                _save_source(conn, field_id, role_id, dataset_id, normalizer, max_rowid, count)
+            conn.execute(f"DELETE FROM {STAGE_TABLE}")
+        pending.clear()
+
+    staged = 0
+    columns = dict()
+    for done, (table, column, role_id, dataset_id, field_id, normalizer, after_rowid) in enumerate(sources):
+        if normalizer not in NORMALIZERS:
+            raise ValueError(f"Unknown normalizer {normalizer!r}, expected one of {list(NORMALIZERS)}")
+        if table not in columns:
+            columns[table] = set(table_columns(conn, table))
+        if column not in columns[table]:
+            # quoted, a name which is not a column would be read as a string literal, and its name hashed instead.
+            logger.warning(f"Not indexing {table}.{column}: no such column (sync the Dataset)")
+            continue
+        quoted_table, quoted_column = quote_identifier(table), quote_identifier(column)
+        max_rowid = conn.execute(f"SELECT max(rowid) FROM {quoted_table}").fetchone()[0] or 0
+        key = (field_id, role_id)
+        added[key] = 0
+        if after_rowid == 0:
+            # recorded even if the table is empty, so that it is known to be indexed.
+            pending[key] = [dataset_id, normalizer, 0, 0]
+
+        start = after_rowid
+        while start < max_rowid:
+            end = min(start + window, max_rowid)
+            cursor = conn.execute(f"""
+                INSERT INTO {STAGE_TABLE} (hash, role_id, dataset_id, field_id, row_id)
+                SELECT h, ?, ?, ?, rowid FROM (
+                    SELECT beed_value_hash({quoted_column}, ?) AS h, rowid FROM {quoted_table}
+                    WHERE rowid > ? AND rowid <= ? AND {quoted_column} IS NOT NULL
+                    )
+                WHERE h IS NOT NULL
+                """, (role_id, dataset_id, field_id, normalizer, start, end))
+            entry = pending.setdefault(key, [dataset_id, normalizer, end, 0])
+            entry[2], entry[3] = end, entry[3] + cursor.rowcount
+            added[key] += cursor.rowcount
+            staged += cursor.rowcount
+            start = end
+
+            if staged >= batch_postings:
+                merge()
+                staged = 0
+            if progress is not None:
+                progress(dict(table=table, column=column, rowid=end, max_rowid=max_rowid,
+                              sources=done, sources_total=len(sources), postings=sum(added.values())))
+
+    if pending:
+        merge()
+    return added
+
+
+def _save_source(conn: sqlite3.Connection, field_id: int, role_id: int, dataset_id: int, normalizer: str,
+                 max_rowid: int, added: int):
+    conn.execute(f"""
+        INSERT INTO {SOURCES_TABLE} (field_id, role_id, dataset_id, normalizer, max_rowid, postings, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (field_id, role_id) DO UPDATE SET
+            max_rowid = excluded.max_rowid, postings = postings + excluded.postings, updated_at = excluded.updated_at
+        """, (field_id, role_id, dataset_id, normalizer, max_rowid, added, datetime.now().isoformat(' ')))
+
+
+def remove_source(conn: sqlite3.Connection, field_id: int, role_id: int, dataset_id: int) -> int:
+    """
+    Delete the postings and the record of a (field, role) source. Returns the number of postings deleted.
+    """
+    with conn:
+        cursor = conn.execute(
+            f"DELETE FROM {POSTINGS_TABLE} WHERE dataset_id = ? AND role_id = ? AND field_id = ?",
+            (dataset_id, role_id, field_id))
+        conn.execute(f"DELETE FROM {SOURCES_TABLE} WHERE field_id = ? AND role_id = ?", (field_id, role_id))
+    return cursor.rowcount
+
+
+def lookup(conn: sqlite3.Connection, hashes: Iterable[int], role_ids: Iterable[int] = None,
+           limit: int = None) -> list[tuple]:
+    """
+    Return the (hash, role_id, dataset_id, field_id, row_id) postings of `hashes`, optionally only for `role_ids`.
+    """
+    hashes, role_ids = list(hashes), list(role_ids) if role_ids is not None else None
+    sql = f"SELECT hash, role_id, dataset_id, field_id, row_id FROM {POSTINGS_TABLE} WHERE hash IN ({', '.join('?' * len(hashes))})"
+    params = hashes
+    if role_ids is not None:
+        sql += f" AND role_id IN ({', '.join('?' * len(role_ids))})"
+        params = hashes + role_ids
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return conn.execute(sql, params).fetchall()
+
+
+def overlap(conn: sqlite3.Connection, dataset_a: int, dataset_b: int, role_ids: Iterable[int] = None,
+            examples: int = 0) -> dict:
+    """
+    Return the number of distinct hashes of `dataset_a`, of `dataset_b` and of both, optionally only for `role_ids`
+    (a value of A matches a value of B with any of those roles). With `examples`, also up to that many postings of A
+    (hash, role_id, dataset_id, field_id, row_id) whose value is also in B.
+    """
+    role_ids = list(role_ids) if role_ids is not None else None
+    roles_sql = f" AND role_id IN ({', '.join('?' * len(role_ids))})" if role_ids is not None else ''
+    roles = role_ids or []
+
+    def distinct(dataset_id):
+        return f"SELECT DISTINCT hash FROM {POSTINGS_TABLE} WHERE dataset_id = {int(dataset_id)}{roles_sql}"
+
+    a_count = conn.execute(f"SELECT count(*) FROM ({distinct(dataset_a)})", roles).fetchone()[0]
+    b_count = conn.execute(f"SELECT count(*) FROM ({distinct(dataset_b)})", roles).fetchone()[0]
+
+    # the smaller side is read, and each of its hashes looked up in the larger side's postings.
+    small, large = (dataset_a, dataset_b) if a_count <= b_count else (dataset_b, dataset_a)
+    shared_sql = f"""
+        SELECT s.hash FROM ({distinct(small)}) AS s
+        WHERE EXISTS (SELECT 1 FROM {POSTINGS_TABLE} WHERE hash = s.hash AND dataset_id = {int(large)}{roles_sql})
+        """
+    shared = conn.execute(f"SELECT count(*) FROM ({shared_sql})", roles + roles).fetchone()[0]
+
+    result = dict(a_distinct=a_count, b_distinct=b_count, shared=shared,
+                  jaccard=shared / (a_count + b_count - shared) if a_count + b_count - shared else 0.0)
+    if examples:
+        # looked up separately: joined to the limited subquery, SQLite plans a scan of the postings instead.
+        hashes = [x[0] for x in conn.execute(f"{shared_sql} LIMIT {int(examples)}", roles + roles)]
+        result['examples'] = conn.execute(f"""
+            SELECT hash, role_id, dataset_id, field_id, min(row_id) FROM {POSTINGS_TABLE}
+            WHERE hash IN ({', '.join('?' * len(hashes))}) AND dataset_id = {int(dataset_a)}{roles_sql}
+            GROUP BY hash
+            """, hashes + roles).fetchall()
+    return result